@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+'''
+Benchmarks ubuntu_updates_avail against fake apt-get and sudo executables.
+
+The stubs are put at the front of PATH and replay a synthetic simulated
+upgrade, with 0 to 100k pending packages, after sleeping for the given
+latency. Each stage of a check is timed in process, main() is timed end to end
+by running the script like cron would, and the import time is timed in a fresh
+interpreter. The results are saved as JSON so runs can be compared.
+
+@code
+./benchmark.py --sizes 0,1000,100000 --latency 0.05 --output before.json
+@endcode
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import time
+import json
+import shutil
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from optparse import OptionParser
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ubuntu_updates_avail.py')
+
+DEFAULT_SIZES = '0,100,1000,10000,100000'
+DEFAULT_INDEX_SIZES = '10000,100000'
+
+## used for every size, so that the records and all of the placeholders get rendered
+BENCHMARK_TEMPLATE = '{upgradable} upgradable ({security} security) as of {time}:\n{packages}\n'
+
+## replays $BENCH_APT_OUTPUT for the simulated upgrade, after $BENCH_LATENCY seconds
+APT_GET_STUB = '''#!/bin/sh
+sleep "${BENCH_LATENCY:-0}"
+case "$*" in
+    *update*) exit 0;;
+esac
+exec cat "$BENCH_APT_OUTPUT"
+'''
+
+SUDO_STUB = '''#!/bin/sh
+exec "$@"
+'''
+
+def program_options():
+    '''
+    handles program options
+
+    @return (options, args) tuple
+    @date Oct 17, 2026
+    '''
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--sizes", dest="sizes", default=DEFAULT_SIZES,
+                        help="comma separated numbers of pending packages to benchmark [default: %default]")
+    parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                        help="seconds each apt-get call sleeps before answering [default: %default]")
+    parser.add_option("--repeat", dest="repeat", type="int", default=3,
+                        help="times to run each measurement, the min and median are kept [default: %default]")
+    parser.add_option("--output", dest="output", default="benchmark.json",
+                        help="JSON file to save the results to, - for stdout [default: %default]")
+    parser.add_option("--work_dir", dest="work_dir", default=None,
+                        help="directory for the stubs and outputs, kept afterwards [default: a temporary directory]")
+    parser.add_option("--index_sizes", dest="index_sizes", default=DEFAULT_INDEX_SIZES,
+                        help="comma separated numbers of stanzas in the Packages files used to compare "
+                            "scan_packages() against reading and splitting the file [default: %default]")
+    parser.add_option("--max_import_time", dest="max_import_time", type="float", default=0,
+                        help="fail (exit 1) if importing the module takes longer than this many milliseconds. "
+                            "0 means don't check [default: %default]")
+
+    return parser.parse_args()
+
+def install_stubs(stub_dir):
+    '''
+    Writes the apt-get and sudo stubs and puts them at the front of PATH (for
+    this process and its children).
+
+    @param stub_dir String directory to write the stubs to.
+    @date Oct 17, 2026
+    '''
+    for name, text in (('apt-get', APT_GET_STUB), ('sudo', SUDO_STUB)):
+        filename = os.path.join(stub_dir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        os.chmod(filename, 0o755)
+
+    os.environ['PATH'] = stub_dir + os.pathsep + os.environ.get('PATH', '')
+
+def write_upgrade_output(filename, size):
+    '''
+    Writes out a synthetic `apt-get --simulate upgrade` with size packages to
+    upgrade, every fifth of them from the security pocket.
+
+    @param filename String where to write it.
+    @param size Int number of packages.
+    @date Oct 17, 2026
+    '''
+    with open(filename, 'w') as f:
+        f.write("Reading package lists...\nBuilding dependency tree...\nCalculating upgrade...\n")
+        f.write("%d upgraded, 0 newly installed, 0 to remove and 0 not upgraded.\n" % size)
+        for i in range(size):
+            pocket = 'jammy-security' if i % 5 == 0 else 'jammy-updates'
+            f.write("Inst pkg%06d [1.0-1] (1.0-2 Ubuntu:22.04/%s [amd64])\n" % (i, pocket))
+        for i in range(size):
+            f.write("Conf pkg%06d (1.0-2 Ubuntu:22.04/jammy-updates [amd64])\n" % i)
+
+def write_packages_file(filename, size):
+    '''
+    Writes out a synthetic Packages file with size stanzas, of roughly the
+    size of the real ones (about 1 kB each).
+
+    @date Oct 17, 2026
+    '''
+    description = ' ' + 'lorem ipsum dolor sit amet ' * 3 + '\n'
+    with open(filename, 'w') as f:
+        for i in range(size):
+            f.write("Package: pkg%06d\nArchitecture: amd64\nVersion: 1.0-%d\nPriority: optional\n"
+                    "Section: libs\nMaintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>\n"
+                    "Installed-Size: %d\nDepends: libc6 (>= 2.34), libfoo1 (>= 1.0)\n"
+                    "Filename: pool/main/p/pkg%06d/pkg%06d_1.0-%d_amd64.deb\nSize: %d\n"
+                    "MD5sum: %s\nSHA256: %s\nDescription: synthetic package %d\n%s%s%s\n"
+                    % (i, i, i * 3, i, i, i, i * 7, '0' * 32, '0' * 64, i, description, description, description))
+
+def naive_scan_packages(packages_file, wanted=None):
+    '''
+    What scan_packages() is benchmarked against: read the whole file as a
+    string and split it into stanzas and lines.
+
+    @date Oct 17, 2026
+    '''
+    with open(packages_file, 'r') as f:
+        text = f.read()
+
+    for stanza in text.split('\n\n'):
+        fields = dict(line.split(':', 1) for line in stanza.split('\n')
+                        if line and line[0] not in ' \t' and ':' in line)
+        name = fields.get('Package', '').strip()
+        if name and (wanted is None or name in wanted):
+            yield (name, fields.get('Version', '').strip(), fields.get('Architecture', 'all').strip(),
+                    int(fields.get('Size', 0)), int(fields.get('Installed-Size', 0)) * 1024)
+
+def measure_memory(func):
+    '''
+    @return Int the peak bytes python allocated while running func().
+    @date Oct 17, 2026
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_index(uua, work_dir, size, repeat):
+    '''
+    Compares scan_packages() against naive_scan_packages() on a Packages file
+    of size stanzas: time and peak memory, scanning for every package and for
+    just 100 of them (as when indexing the pending upgrades).
+
+    @return dict of scanner name to timings and peak_bytes.
+    @date Oct 17, 2026
+    '''
+    packages_file = os.path.join(work_dir, 'bench_Packages')
+    write_packages_file(packages_file, size)
+    wanted = set('pkg%06d' % i for i in range(0, size, max(1, size // 100)))
+
+    results = {}
+    for name, scan in (('mmap', uua.scan_packages), ('naive', naive_scan_packages)):
+        results[name] = {
+                'all'           : measure(lambda: sum(1 for _ in scan(packages_file)), repeat)[0],
+                'wanted'        : measure(lambda: sum(1 for _ in scan(packages_file, wanted)), repeat)[0],
+                'peak_bytes'    : measure_memory(lambda: sum(1 for _ in scan(packages_file))),
+                }
+    results['file_bytes'] = os.path.getsize(packages_file)
+    os.unlink(packages_file)
+    return results
+
+def measure(func, repeat):
+    '''
+    Runs func() repeat times.
+
+    @return ({'min': seconds, 'median': seconds}, the last return value of func)
+    @date Oct 17, 2026
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times)}, ret
+
+def benchmark_stages(uua, work_dir, repeat):
+    '''
+    Times each stage of a check in process.
+
+    @param uua the ubuntu_updates_avail module.
+    @param work_dir String where to write the template and output file.
+    @param repeat Int times to run each stage.
+    @return dict of stage name to the timings from measure().
+    @date Oct 17, 2026
+    '''
+    template_file = os.path.join(work_dir, 'template')
+    with open(template_file, 'w') as f:
+        f.write(BENCHMARK_TEMPLATE)
+    template = uua.Template(template_file)
+    out_file = os.path.join(work_dir, 'out')
+    if os.path.exists(out_file):
+        os.unlink(out_file)
+
+    stages = {}
+    stages['call_update'], _ = measure(lambda: uua.call_update(uua.RetryPolicy(1, 0)), repeat)
+    stages['get_upgrade_output'], lines = measure(lambda: list(uua.get_upgrade_output()), repeat)
+    stages['parse_upgrade_output'], (counts, records) = measure(
+                lambda: uua.parse_upgrade_output(iter(lines)), repeat)
+    stages['create_template_dict'], template_dict = measure(
+                lambda: uua.create_template_dict(counts, '%c', records), repeat)
+    stages['generate_output'], output = measure(lambda: uua.generate_output(template, template_dict), repeat)
+
+    # the first write changes the file, the rest find it unchanged and skip it
+    stages['write_msg'], _ = measure(lambda: uua.write_msg(out_file, output, False), 1)
+    stages['write_msg_unchanged'], _ = measure(lambda: uua.write_msg(out_file, output, False), repeat)
+    return stages
+
+def benchmark_main(work_dir, repeat):
+    '''
+    Times main() end to end, by running the script the way cron would.
+
+    @return The timings from measure().
+    @throws subprocess.CalledProcessError if the script fails.
+    @date Oct 17, 2026
+    '''
+    command = [sys.executable, SCRIPT, '--base_dir', work_dir, '--template', 'template',
+                '--log_level', 'info', 'main.out']
+    return measure(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL), repeat)[0]
+
+def benchmark_import(repeat):
+    '''
+    Times a cold start: importing the module in a fresh interpreter, less the
+    time for the interpreter itself.
+
+    @return dict with the min and median milliseconds.
+    @date Oct 17, 2026
+    '''
+    directory = os.path.dirname(SCRIPT)
+    bare = [sys.executable, '-c', 'pass']
+    imported = [sys.executable, '-c', 'import sys; sys.path.insert(0, %r); import ubuntu_updates_avail' % directory]
+
+    subprocess.run(imported, check=True)        # make sure the byte code is cached
+    bare_times, _ = measure(lambda: subprocess.run(bare, check=True), repeat)
+    imported_times, _ = measure(lambda: subprocess.run(imported, check=True), repeat)
+    return dict((key, max(0.0, imported_times[key] - bare_times[key]) * 1000) for key in ('min', 'median'))
+
+def main():
+    '''
+    Main function.
+
+    @return The exit code: 0, or 1 if the import was slower than max_import_time.
+    @date Oct 17, 2026
+    '''
+    options, args = program_options()
+
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='uua_benchmark.')
+    os.makedirs(work_dir, exist_ok=True)
+    install_stubs(work_dir)
+    os.environ['BENCH_LATENCY'] = str(options.latency)
+
+    sys.path.insert(0, os.path.dirname(SCRIPT))
+    import ubuntu_updates_avail
+
+    results = {
+            'python'    : platform.python_version(),
+            'platform'  : platform.platform(),
+            'latency'   : options.latency,
+            'repeat'    : options.repeat,
+            'import_ms' : benchmark_import(max(options.repeat, 5)),
+            'sizes'     : {},
+            'packages_index' : {},
+            }
+
+    try:
+        for size in [int(size) for size in options.sizes.split(',')]:
+            apt_output = os.path.join(work_dir, 'upgrade_%d.txt' % size)
+            write_upgrade_output(apt_output, size)
+            os.environ['BENCH_APT_OUTPUT'] = apt_output
+
+            stages = benchmark_stages(ubuntu_updates_avail, work_dir, options.repeat)
+            stages['main'] = benchmark_main(work_dir, options.repeat)
+            results['sizes'][str(size)] = stages
+
+            print("%7d packages: %s" % (size, ', '.join('%s %.1f ms' % (name, timing['median'] * 1000)
+                                                        for name, timing in stages.items())),
+                    file=sys.stderr)
+
+        for size in [int(size) for size in options.index_sizes.split(',')]:
+            index = benchmark_index(ubuntu_updates_avail, work_dir, size, options.repeat)
+            results['packages_index'][str(size)] = index
+            print("%7d stanzas (%.1f MB): %s" % (size, index['file_bytes'] / 1e6,
+                        ', '.join('%s %.1f ms / %.1f MB peak' % (name, index[name]['all']['median'] * 1000,
+                                                                 index[name]['peak_bytes'] / 1e6)
+                                    for name in ('mmap', 'naive'))),
+                    file=sys.stderr)
+    finally:
+        if options.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if options.output == '-':
+        print(text)
+    else:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+
+    print("import: %.1f ms" % results['import_ms']['median'], file=sys.stderr)
+    if options.max_import_time > 0 and results['import_ms']['median'] > options.max_import_time:
+        print("import took longer than %.1f ms" % options.max_import_time, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
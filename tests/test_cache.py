@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+'''
+Checks the result cache: state_fingerprint() of a fake root, and
+save_cached_result()/load_cached_result().
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+from ubuntu_updates_avail import PackageRecord, UpgradeCounts, rooted
+
+COUNTS = UpgradeCounts(2, 0, 1, 1)
+
+RECORDS = [
+        PackageRecord('Inst', 'libfoo', '1.0-1', '1.0-2', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        PackageRecord('Remv', 'oldpkg', '1', None, None, None),
+        ]
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+def rewrite_in_place(path, text):
+    '''
+    Rewrites the file with text of the same length, keeping its inode and
+    mtime, so only its contents tell it apart.
+    '''
+    st = os.stat(path)
+    with open(path, 'r+') as f:
+        f.write(text)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+class StateFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+
+        write_file(rooted(self.root, ubuntu_updates_avail.DPKG_STATUS_FILE), 'Package: dpkg\n')
+        write_file(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_LISTS_DIR), 'x_Packages'),
+                    'Package: libfoo\n')
+        write_file(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_CONF_PARTS), '50proxy'),
+                    'Acquire::http::Proxy "http://a";\n')
+
+    def fingerprint(self, **kwargs):
+        return ubuntu_updates_avail.state_fingerprint(self.root, **kwargs)
+
+    def test_stable(self):
+        self.assertIsNotNone(self.fingerprint())
+        self.assertEqual(self.fingerprint(), self.fingerprint())
+
+    def test_engine(self):
+        # a native engine result mustn't be served to an apt engine run
+        self.assertNotEqual(self.fingerprint(engine='native'), self.fingerprint(engine='apt'))
+        self.assertNotEqual(self.fingerprint(cross_check=True), self.fingerprint(cross_check=False))
+
+    def test_apt_conf(self):
+        before = self.fingerprint()
+        rewrite_in_place(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_CONF_PARTS), '50proxy'),
+                            'Acquire::http::Proxy "http://b";\n')
+        self.assertNotEqual(self.fingerprint(), before)
+
+        before = self.fingerprint()
+        write_file(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_CONF_PARTS), '99new'), '')
+        self.assertNotEqual(self.fingerprint(), before)
+
+    def test_state(self):
+        before = self.fingerprint()
+        write_file(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_LISTS_DIR), 'y_Packages'), '')
+        self.assertNotEqual(self.fingerprint(), before)
+
+    def test_hash_contents(self):
+        before, before_hashed = self.fingerprint(), self.fingerprint(hash_contents=True)
+        rewrite_in_place(rooted(self.root, ubuntu_updates_avail.DPKG_STATUS_FILE), 'Package: dpkh\n')
+        self.assertEqual(self.fingerprint(), before)
+        self.assertNotEqual(self.fingerprint(hash_contents=True), before_hashed)
+
+    def test_no_state(self):
+        os.unlink(rooted(self.root, ubuntu_updates_avail.DPKG_STATUS_FILE))
+        self.assertIsNotNone(self.fingerprint())
+
+        os.unlink(os.path.join(rooted(self.root, ubuntu_updates_avail.APT_LISTS_DIR), 'x_Packages'))
+        self.assertIsNone(self.fingerprint())
+
+        os.rmdir(rooted(self.root, ubuntu_updates_avail.APT_LISTS_DIR))
+        self.assertIsNone(self.fingerprint())
+
+class CachedResultTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_file = os.path.join(directory.name, 'cache')
+
+    def test_hit(self):
+        ubuntu_updates_avail.save_cached_result(self.cache_file, 'abc', COUNTS, RECORDS)
+        self.assertEqual(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc'), (COUNTS, RECORDS))
+        self.assertEqual(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc', False), (COUNTS, RECORDS))
+
+    def test_other_fingerprint(self):
+        ubuntu_updates_avail.save_cached_result(self.cache_file, 'abc', COUNTS, RECORDS)
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abd'))
+
+    def test_no_fingerprint(self):
+        ubuntu_updates_avail.save_cached_result(self.cache_file, None, COUNTS, RECORDS)
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, None))
+
+    def test_without_records(self):
+        ubuntu_updates_avail.save_cached_result(self.cache_file, 'abc', COUNTS, None)
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc', True))
+        self.assertEqual(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc', False), (COUNTS, None))
+
+    def test_unusable(self):
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc'))
+
+        with open(self.cache_file, 'w') as f:
+            f.write('{"fingerprint": "abc", "counts": [1, 2]')
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc'))
+
+        with open(self.cache_file, 'w') as f:
+            f.write('{"fingerprint": "abc", "counts": [1, 2], "records": null}')
+        self.assertIsNone(ubuntu_updates_avail.load_cached_result(self.cache_file, 'abc', False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+'''
+Checks that importing ubuntu_updates_avail stays cheap: it mustn't pull in
+the heavy stdlib modules (they're imported in the functions that use them),
+and a cold import must stay within IMPORT_BUDGET_MS of a bare interpreter.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## milliseconds a cold import may take over starting the bare interpreter.
+## It's about 25 ms on an idle machine, this leaves room for a busy one.
+IMPORT_BUDGET_MS = 100
+
+## none of these may be imported by just importing the module
+HEAVY_MODULES = ['subprocess', 'optparse', 'json', 'hashlib', 'socket', 'asyncio',
+                    'multiprocessing', 'concurrent.futures', 'urllib.request',
+                    'email.utils', 'tempfile', 'logging.handlers']
+
+def run_python(code, cwd=None):
+    '''
+    Runs code in a fresh interpreter, with the repo on its path.
+
+    @param code String python code to run.
+    @param cwd String directory to run it in, None for the current one.
+    @return String its stdout.
+    @date Oct 17, 2026
+    '''
+    return subprocess.run([sys.executable, '-c', 'import sys; sys.path.insert(0, %r); %s' % (REPO_DIR, code)],
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True, cwd=cwd).stdout
+
+def best_run_time(code, repeat):
+    '''
+    Times running code in a fresh interpreter, interpreter start up included.
+    The fastest run is the one least disturbed by whatever else is running.
+
+    @param code String python code to run in a fresh interpreter.
+    @param repeat Int number of runs.
+    @return Float seconds.
+    @date Oct 17, 2026
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_python(code)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+class ImportTest(unittest.TestCase):
+
+    def test_no_heavy_modules(self):
+        modules = run_python('import ubuntu_updates_avail; print(" ".join(sys.modules))').split()
+        self.assertEqual([name for name in HEAVY_MODULES if name in modules], [])
+
+    def test_no_side_effects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = run_python('import ubuntu_updates_avail; print(len(ubuntu_updates_avail.log.handlers))',
+                                cwd=directory)
+            self.assertEqual(output.split(), ['0'])
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_import_budget(self):
+        run_python('import ubuntu_updates_avail')        # make sure the byte code is cached
+        bare = best_run_time('pass', 5)
+        imported = best_run_time('import ubuntu_updates_avail', 5)
+        self.assertLess((imported - bare) * 1000, IMPORT_BUDGET_MS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+'''
+Checks waiting on the apt/dpkg locks: lock_holder() against a lock held by
+another process (and a fake list of locks), and call_update() against a stub
+apt-get that fails on a lock.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+
+## holds the (fcntl) lock on argv[1] until its stdin is closed
+HOLDER = '''import fcntl, sys
+f = open(sys.argv[1], 'w')
+fcntl.lockf(f, fcntl.LOCK_EX)
+print('locked', flush=True)
+sys.stdin.read()
+'''
+
+## apt-get update failing on the lists lock, as when something else holds it
+LOCKED_APT_GET = '''#!/bin/sh
+echo try >> "%s"
+echo "E: Could not get lock /var/lib/apt/lists/lock. It is held by process 1 (apt-get)" >&2
+exit 100
+'''
+
+class LockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.lock_file = os.path.join(self.directory.name, 'lock')
+        open(self.lock_file, 'w').close()
+
+    def hold(self):
+        '''
+        @return Int pid of a process holding the lock until the test ends.
+        '''
+        holder = subprocess.Popen([sys.executable, '-c', HOLDER, self.lock_file],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.stdin.close)
+        self.addCleanup(holder.stdout.close)
+        self.assertEqual(holder.stdout.readline(), 'locked\n')
+        return holder.pid
+
+    def proc_locks(self, *lines):
+        proc_locks = os.path.join(self.directory.name, 'locks')
+        with open(proc_locks, 'w') as f:
+            f.write(''.join(lines))
+        return proc_locks
+
+    def device(self):
+        st = os.stat(self.lock_file)
+        return '%02x:%02x:%d' % (os.major(st.st_dev), os.minor(st.st_dev), st.st_ino)
+
+class LockHolderTest(LockTest):
+
+    def test_free(self):
+        self.assertIsNone(ubuntu_updates_avail.lock_holder(self.lock_file))
+
+    def test_held(self):
+        pid = self.hold()
+        self.assertEqual(ubuntu_updates_avail.lock_holder(self.lock_file), pid)
+        self.assertEqual(ubuntu_updates_avail.wait_for_locks([self.lock_file], 0),
+                            '%s held by %s' % (self.lock_file, ubuntu_updates_avail.process_name(pid)))
+
+    def test_probe_lock(self):
+        # where there's no list of locks
+        pid = self.hold()
+        self.assertEqual(ubuntu_updates_avail.lock_holder(self.lock_file, self.proc_locks() + '.missing'), pid)
+        self.assertEqual(ubuntu_updates_avail.probe_lock(self.lock_file), pid)
+
+    def test_proc_locks(self):
+        # found by device and inode, without opening the lock file
+        proc_locks = self.proc_locks('1: POSIX  ADVISORY  WRITE 99 00:00:%d 0 EOF\n' % os.stat(self.lock_file).st_ino,
+                                        '2: FLOCK  ADVISORY  WRITE 98 %s 0 EOF\n' % self.device(),
+                                        '2: -> FLOCK  ADVISORY  WRITE 97 %s 0 EOF\n' % self.device())
+        os.chmod(self.lock_file, 0)
+        self.assertEqual(ubuntu_updates_avail.lock_holder(self.lock_file, proc_locks), 98)
+
+    def test_waiter(self):
+        proc_locks = self.proc_locks('2: -> POSIX  ADVISORY  WRITE 97 %s 0 EOF\n' % self.device())
+        self.assertIsNone(ubuntu_updates_avail.lock_holder(self.lock_file, proc_locks))
+
+    def test_missing(self):
+        self.assertIsNone(ubuntu_updates_avail.lock_holder(self.lock_file + '.missing'))
+
+class CallUpdateLockedTest(LockTest):
+
+    def setUp(self):
+        super().setUp()
+        bin_dir = os.path.join(self.directory.name, 'bin')
+        os.mkdir(bin_dir)
+        self.tries_file = os.path.join(self.directory.name, 'tries')
+        for name, script in (('sudo', '#!/bin/sh\nexec "$@"\n'), ('apt-get', LOCKED_APT_GET % self.tries_file)):
+            with open(os.path.join(bin_dir, name), 'w') as f:
+                f.write(script)
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+
+        path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + path
+        self.addCleanup(os.environ.__setitem__, 'PATH', path)
+
+    def tries(self):
+        with open(self.tries_file, 'r') as f:
+            return len(f.readlines())
+
+    def test_lock_not_seen(self):
+        # apt-get fails on a lock we can't see held: that's backed off from
+        # like any other failure, and the deadline still holds
+        policy = ubuntu_updates_avail.RetryPolicy(5, 10, jitter=False, deadline=2)
+        start = time.monotonic()
+        self.assertFalse(ubuntu_updates_avail.call_update(policy, lock_files=[self.lock_file], lock_timeout=60))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.tries(), 1)
+
+    def test_out_of_tries(self):
+        policy = ubuntu_updates_avail.RetryPolicy(2, 0.1)
+        with self.assertRaises(ubuntu_updates_avail.LockContentionError):
+            ubuntu_updates_avail.call_update(policy, lock_files=[self.lock_file], lock_timeout=60)
+        self.assertEqual(self.tries(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
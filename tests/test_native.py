@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+'''
+Checks the native engine (native_upgrades()) and what it reads with:
+read_stanzas() and read_release_flags(), against a fake root with a dpkg
+status file, Packages files and clearsigned InRelease files like Ubuntu's.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import io
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+from ubuntu_updates_avail import PackageRecord, UpgradeCounts
+
+STATUS = '''Package: dpkg
+Status: install ok installed
+Architecture: amd64
+Version: 1.21.1
+
+Package: libfoo
+Status: install ok installed
+Architecture: amd64
+Version: 1.0-1
+Description: a library
+ with a long description
+ .
+ over several lines
+
+Package: bar
+Status: install ok installed
+Architecture: all
+Version: 2.0
+
+Package: held
+Status: hold ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: needy
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Provides: needy-api
+
+Package: proposedonly
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: backported
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+
+Package: gone
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 0.9
+'''
+
+## suite -> (InRelease fields, Packages)
+ARCHIVES = {
+        'jammy-updates' : ('', '''Package: libfoo
+Architecture: amd64
+Version: 1.0-2
+
+Package: bar
+Architecture: all
+Version: 2.1
+
+Package: held
+Architecture: amd64
+Version: 1.1
+
+Package: needy
+Architecture: amd64
+Version: 1.1
+Depends: libc6 (>= 2.35), newlib (>= 1) | otherlib
+
+Package: dpkg
+Architecture: amd64
+Version: 1.21.1
+
+Package: gone
+Architecture: amd64
+Version: 1.0
+'''),
+        'jammy-proposed' : ('NotAutomatic: yes\n', '''Package: libfoo
+Architecture: amd64
+Version: 1.0-3
+
+Package: proposedonly
+Architecture: amd64
+Version: 1.1
+'''),
+        'jammy-backports' : ('NotAutomatic: yes\nButAutomaticUpgrades: yes\n', '''Package: backported
+Architecture: amd64
+Version: 1.1
+'''),
+        }
+
+IN_RELEASE = '''-----BEGIN PGP SIGNED MESSAGE-----
+Hash: SHA512
+
+Origin: Ubuntu
+Label: Ubuntu
+Suite: %(suite)s
+Version: 22.04
+Codename: jammy
+Date: Thu, 21 Apr 2022 17:16:08 UTC
+Architectures: amd64 arm64 armhf i386 ppc64el riscv64 s390x
+Components: main restricted universe multiverse
+Description: Ubuntu Jammy 22.04
+%(fields)sMD5Sum:
+ ae8fa4b6f23aa1e6b8e8b3c4ad0fbd0c          1194 main/binary-amd64/Packages
+SHA256:
+ 1c2b4bd6ad8cda2ac8a4fe3b6ed3a7bb6d5e6ab0f28bd36bf4e2c3f4ba87e8e9          1194 main/binary-amd64/Packages
+-----BEGIN PGP SIGNATURE-----
+
+iQIzBAEBCgAdFiEEFlnjcaQcR6obRFiUuY1zEd6HkBkFAmJhkQgACgkQuY1zEd6H
+=kF5b
+-----END PGP SIGNATURE-----
+'''
+
+def archive_prefix(suite):
+    return 'archive.ubuntu.com_ubuntu_dists_%s' % suite
+
+class FakeRootTest(unittest.TestCase):
+    '''
+    Sets up a status file and a lists directory with ARCHIVES in it.
+    '''
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+        self.lists_dir = os.path.join(self.root.name, 'lists')
+        os.mkdir(self.lists_dir)
+        for suite, (fields, packages) in ARCHIVES.items():
+            with open(os.path.join(self.lists_dir, archive_prefix(suite) + '_InRelease'), 'w') as f:
+                f.write(IN_RELEASE % {'suite': suite, 'fields': fields})
+            with open(self.packages_file(suite), 'w') as f:
+                f.write(packages)
+
+        self.status_file = os.path.join(self.root.name, 'status')
+        with open(self.status_file, 'w') as f:
+            f.write(STATUS)
+
+    def packages_file(self, suite):
+        return os.path.join(self.lists_dir, archive_prefix(suite) + '_main_binary-amd64_Packages')
+
+class ReadReleaseFlagsTest(FakeRootTest):
+
+    def test_clearsigned(self):
+        for suite, not_automatic in (('jammy-updates', False), ('jammy-proposed', True),
+                                        ('jammy-backports', False)):
+            with self.subTest(suite=suite):
+                self.assertEqual(ubuntu_updates_avail.read_release_flags(self.lists_dir, self.packages_file(suite)),
+                                    (suite, not_automatic))
+
+    def test_unsigned_release(self):
+        os.rename(os.path.join(self.lists_dir, archive_prefix('jammy-proposed') + '_InRelease'),
+                    os.path.join(self.lists_dir, archive_prefix('jammy-proposed') + '_Release'))
+        with open(os.path.join(self.lists_dir, archive_prefix('jammy-proposed') + '_Release'), 'w') as f:
+            f.write('Origin: Ubuntu\nSuite: jammy-proposed\nNotAutomatic: yes\nMD5Sum:\n 0123 1 main\n')
+
+        self.assertEqual(ubuntu_updates_avail.read_release_flags(self.lists_dir,
+                                                                    self.packages_file('jammy-proposed')),
+                            ('jammy-proposed', True))
+
+    def test_no_release_file(self):
+        os.unlink(os.path.join(self.lists_dir, archive_prefix('jammy-proposed') + '_InRelease'))
+        self.assertEqual(ubuntu_updates_avail.read_release_flags(self.lists_dir,
+                                                                    self.packages_file('jammy-proposed')),
+                            ('jammy-proposed', False))
+
+class ReadStanzasTest(unittest.TestCase):
+
+    def test_fields(self):
+        stanzas = list(ubuntu_updates_avail.read_stanzas(io.StringIO(STATUS), {'Version', 'Description'}))
+        self.assertEqual([stanza['Package'] for stanza in stanzas],
+                            ['dpkg', 'libfoo', 'bar', 'held', 'needy', 'proposedonly', 'backported', 'gone'])
+        self.assertEqual(stanzas[1], {'Package': 'libfoo', 'Version': '1.0-1', 'Description': 'a library'})
+        self.assertNotIn('Status', stanzas[0])
+
+    def test_wanted(self):
+        stanzas = list(ubuntu_updates_avail.read_stanzas(io.StringIO(STATUS), {'Version'},
+                                                            {'bar', 'gone'}.__contains__))
+        self.assertEqual(stanzas, [{'Package': 'bar', 'Version': '2.0'}, {'Package': 'gone', 'Version': '0.9'}])
+
+    def test_blank_lines(self):
+        text = '\n\nPackage: a\nVersion: 1\n\n\n\nPackage: b\nVersion: 2'
+        self.assertEqual(list(ubuntu_updates_avail.read_stanzas(io.StringIO(text), {'Version'})),
+                            [{'Package': 'a', 'Version': '1'}, {'Package': 'b', 'Version': '2'}])
+
+class NativeUpgradesTest(FakeRootTest):
+
+    def test_upgrades(self):
+        counts, records = ubuntu_updates_avail.native_upgrades(self.status_file, self.lists_dir)
+
+        # held is held back, and needy's new version needs a package that
+        # isn't installed; proposed isn't upgraded to (libfoo stays at
+        # -updates' version, proposedonly isn't upgraded), backports are
+        self.assertEqual(counts, UpgradeCounts(3, 0, 0, 2))
+        self.assertEqual(records, [
+                PackageRecord('Inst', 'backported', '1.0', '1.1', 'jammy-backports', 'amd64'),
+                PackageRecord('Inst', 'bar', '2.0', '2.1', 'jammy-updates', 'amd64'),
+                PackageRecord('Inst', 'libfoo', '1.0-1', '1.0-2', 'jammy-updates', 'amd64'),
+                ])
+
+    def test_provided_dependency(self):
+        # an installed package's Provides satisfies a dependency
+        with open(self.packages_file('jammy-updates'), 'a') as f:
+            f.write('\nPackage: needy2\nArchitecture: amd64\nVersion: 1.1\nDepends: needy-api\n')
+        with open(self.status_file, 'a') as f:
+            f.write('\nPackage: needy2\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1.0\n')
+
+        counts, records = ubuntu_updates_avail.native_upgrades(self.status_file, self.lists_dir)
+        self.assertEqual(counts, UpgradeCounts(4, 0, 0, 2))
+        self.assertIn('needy2', [record.name for record in records])
+
+    def test_no_lists(self):
+        empty = os.path.join(self.root.name, 'empty')
+        os.mkdir(empty)
+        with self.assertRaises(ubuntu_updates_avail.UpgradeSimulError):
+            ubuntu_updates_avail.native_upgrades(self.status_file, empty)
+
+    def test_no_status(self):
+        with self.assertRaises(ubuntu_updates_avail.UpgradeSimulError):
+            ubuntu_updates_avail.native_upgrades(os.path.join(self.root.name, 'missing'), self.lists_dir)
+
+if __name__ == '__main__':
+    unittest.main()
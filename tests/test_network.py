@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+'''
+Checks the network side of a check against servers on localhost: the mirror
+probe (probe_mirrors(), check_network()) against a listening socket and a
+closed port, and the conditional update's Release probe (probe_source())
+against a local http.server, and that local checks (local_check_config())
+skip it.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import time
+import email.utils
+import http.server
+import socket
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+
+## what the Release file's mtime is set to, as apt would from Last-Modified
+RELEASE_MTIME = 1700000000
+
+ROUTE_HEADER = 'Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\tMTU\tWindow\tIRTT\n'
+DEFAULT_ROUTE = 'eth0\t00000000\t0100A8C0\t0003\t0\t0\t0\t00000000\t0\t0\t0\n'
+LOCAL_ROUTE = 'eth0\t0000A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\t0\t0\t0\n'
+
+def closed_port():
+    '''
+    @return Int a localhost port that nothing is listening on.
+    @date Oct 17, 2026
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class ReleaseHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves HEAD requests for the Release files, with the server's
+    last_modified and honouring If-Modified-Since unless the server's
+    ignore_condition is set. Anything but a Release file is a 404.
+    '''
+    def do_HEAD(self):
+        self.server.requests.append((self.path, self.headers.get('If-Modified-Since')))
+
+        if not self.path.endswith('/InRelease'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        since = self.headers.get('If-Modified-Since')
+        if since and not self.server.ignore_condition \
+                and email.utils.parsedate_to_datetime(since).timestamp() >= self.server.last_modified:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Last-Modified', email.utils.formatdate(self.server.last_modified, usegmt=True))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class ProbeSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), ReleaseHandler)
+        self.server.requests = []
+        self.server.last_modified = RELEASE_MTIME
+        self.server.ignore_condition = False
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.uri = 'http://127.0.0.1:%d/ubuntu' % self.server.server_port
+        self.lists_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.lists_dir.cleanup)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def cache_release(self, suite='jammy', name='InRelease', mtime=RELEASE_MTIME):
+        url = ubuntu_updates_avail.release_url(self.uri, suite, name)
+        path = os.path.join(self.lists_dir.name, ubuntu_updates_avail.apt_list_file_name(url))
+        open(path, 'w').close()
+        os.utime(path, (mtime, mtime))
+
+    def probe(self, suite='jammy'):
+        return ubuntu_updates_avail.probe_source(self.uri, suite, self.lists_dir.name, 5)
+
+    def test_not_modified(self):
+        self.cache_release()
+        self.assertIsNone(self.probe())
+
+        path, since = self.server.requests[-1]
+        self.assertEqual(path, '/ubuntu/dists/jammy/InRelease')
+        self.assertEqual(email.utils.parsedate_to_datetime(since).timestamp(), RELEASE_MTIME)
+
+    def test_modified(self):
+        self.cache_release()
+        self.server.last_modified = RELEASE_MTIME + 3600
+        self.assertEqual(self.probe(), 'modified upstream')
+
+    def test_condition_ignored(self):
+        # a 200 with an old enough Last-Modified is as good as a 304
+        self.cache_release()
+        self.server.ignore_condition = True
+        self.assertIsNone(self.probe())
+
+        self.server.last_modified = RELEASE_MTIME + 1
+        self.assertEqual(self.probe(), 'modified upstream')
+
+    def test_http_error(self):
+        self.cache_release(name='Release')
+        self.assertEqual(self.probe(), 'HTTP error 404')
+
+    def test_no_cached_release(self):
+        self.assertEqual(self.probe(), 'no cached Release file')
+        self.assertEqual(self.server.requests, [])
+
+    def test_flat_repository(self):
+        self.cache_release(suite='./')
+        self.assertIsNone(self.probe(suite='./'))
+        self.assertEqual(self.server.requests[-1][0], '/ubuntu/./InRelease')
+
+    def test_unprobeable_scheme(self):
+        self.assertEqual(ubuntu_updates_avail.probe_source('file:///srv/mirror', 'jammy', self.lists_dir.name, 5),
+                            'cannot probe file sources')
+
+    def test_server_down(self):
+        self.uri = 'http://127.0.0.1:%d/ubuntu' % closed_port()
+        self.cache_release()
+        self.assertTrue(self.probe().startswith('probe failed: '))
+
+class ProbeMirrorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.addCleanup(self.listener.close)
+        self.open_mirror = '127.0.0.1:%d' % self.listener.getsockname()[1]
+        self.closed_mirror = '127.0.0.1:%d' % closed_port()
+
+        self.route_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.route_dir.cleanup)
+
+    def route_files(self, *routes):
+        route_file = os.path.join(self.route_dir.name, 'route')
+        with open(route_file, 'w') as f:
+            f.write(ROUTE_HEADER + ''.join(routes))
+
+        ipv6_route_file = os.path.join(self.route_dir.name, 'ipv6_route')
+        open(ipv6_route_file, 'w').close()
+        return dict(route_file=route_file, ipv6_route_file=ipv6_route_file)
+
+    def test_no_mirrors(self):
+        self.assertEqual(ubuntu_updates_avail.probe_mirrors([], 1), {})
+
+    def test_open_and_closed(self):
+        latencies = ubuntu_updates_avail.probe_mirrors([self.closed_mirror, self.open_mirror], 5)
+        self.assertEqual(set(latencies), set([self.closed_mirror, self.open_mirror]))
+        self.assertIsNone(latencies[self.closed_mirror])
+        self.assertGreaterEqual(latencies[self.open_mirror], 0)
+
+    def test_first_connection_wins(self):
+        # a mirror that never answers mustn't hold up one that did
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(0)
+        self.addCleanup(silent.close)
+        for _ in range(8):                      # fill its backlog, so connections hang
+            sock = socket.socket()
+            sock.setblocking(False)
+            sock.connect_ex(silent.getsockname())
+            self.addCleanup(sock.close)
+
+        start = time.monotonic()
+        latencies = ubuntu_updates_avail.probe_mirrors(['localhost:%d' % self.listener.getsockname()[1],
+                                                        '127.0.0.1:%d' % silent.getsockname()[1]], 5)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertIsNotNone(latencies['localhost:%d' % self.listener.getsockname()[1]])
+
+    def test_bad_mirror(self):
+        self.assertEqual(ubuntu_updates_avail.probe_mirrors(['host.invalid:80'], 5), {'host.invalid:80' : None})
+
+    def test_check_network(self):
+        latencies = ubuntu_updates_avail.check_network([self.open_mirror], 5, **self.route_files(DEFAULT_ROUTE))
+        self.assertIsNotNone(latencies[self.open_mirror])
+
+    def test_no_default_route(self):
+        with self.assertRaises(ubuntu_updates_avail.NoNetworkError):
+            ubuntu_updates_avail.check_network([self.open_mirror], 5, **self.route_files(LOCAL_ROUTE))
+
+    def test_unreachable_mirrors(self):
+        with self.assertRaises(ubuntu_updates_avail.NoNetworkError):
+            ubuntu_updates_avail.check_network([self.closed_mirror], 5, **self.route_files(DEFAULT_ROUTE))
+
+class LocalCheckTest(unittest.TestCase):
+    '''
+    The checks triggered by a change to the package state go without the
+    update, and so without the network check too.
+    '''
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+        for path, text in ((ubuntu_updates_avail.DPKG_STATUS_FILE,
+                                'Package: dpkg\nStatus: install ok installed\nArchitecture: amd64\nVersion: 1\n'),
+                            (os.path.join(ubuntu_updates_avail.APT_LISTS_DIR, 'x_main_binary-amd64_Packages'),
+                                'Package: dpkg\nArchitecture: amd64\nVersion: 2\n')):
+            path = ubuntu_updates_avail.rooted(self.root.name, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(text)
+
+        self.config = ubuntu_updates_avail.Config(engine='native', network_check=True, network_timeout=1,
+                                                    mirrors=['127.0.0.1:%d' % closed_port()])
+
+    def test_local_check_config(self):
+        local_config = ubuntu_updates_avail.local_check_config(self.config)
+        self.assertEqual((local_config.num_update_checks, local_config.network_check), (0, False))
+        self.assertEqual(local_config.engine, 'native')
+        self.assertTrue(self.config.network_check)
+
+    def test_unreachable_mirrors(self):
+        with self.assertRaises(ubuntu_updates_avail.NoNetworkError):
+            ubuntu_updates_avail.check_updates(ubuntu_updates_avail.Config(**dict(vars(self.config),
+                                                                                num_update_checks=0)),
+                                                self.root.name)
+
+        counts, _ = ubuntu_updates_avail.check_updates(ubuntu_updates_avail.local_check_config(self.config),
+                                                        self.root.name)
+        self.assertEqual(counts.upgrade, 1)
+
+if __name__ == '__main__':
+    unittest.main()
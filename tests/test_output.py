@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+'''
+Checks writing the output file: write_msg() (which skips rewriting
+unchanged output) and atomic_write().
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+
+class OutputTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.out_file = os.path.join(self.directory, 'out')
+
+    def write(self, msg, is_error=False, no_error_output=False):
+        before = dict(ubuntu_updates_avail.write_stats)
+        ubuntu_updates_avail.write_msg(self.out_file, msg, is_error, no_error_output)
+        return dict((key, ubuntu_updates_avail.write_stats[key] - before[key]) for key in before)
+
+    def read(self):
+        with open(self.out_file, 'r') as f:
+            return f.read()
+
+    def test_new_file(self):
+        self.assertEqual(self.write(' 3 upgradable'), {'written': 1, 'skipped': 0})
+        self.assertEqual(self.read(), ' 3 upgradable')
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.out_file).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_unchanged(self):
+        self.write(' 3 upgradable')
+        os.utime(self.out_file, ns=(1, 1000000000))
+        before = os.stat(self.out_file)
+
+        self.assertEqual(self.write(' 3 upgradable'), {'written': 0, 'skipped': 1})
+        after = os.stat(self.out_file)
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+
+    def test_changed(self):
+        self.write(' 3 upgradable')
+        os.chmod(self.out_file, 0o640)
+        before = os.stat(self.out_file)
+
+        self.assertEqual(self.write(' 4 upgradable'), {'written': 1, 'skipped': 0})
+        self.assertEqual(self.read(), ' 4 upgradable')
+        after = os.stat(self.out_file)
+        self.assertNotEqual(after.st_ino, before.st_ino)       # replaced, not rewritten
+        self.assertEqual(after.st_mode & 0o7777, 0o640)
+
+    def test_no_error_output(self):
+        self.write(' 3 upgradable')
+
+        self.assertEqual(self.write(' update check failed', True, True), {'written': 0, 'skipped': 0})
+        self.assertEqual(self.read(), ' 3 upgradable')
+
+        self.write(' update check failed', True)
+        self.assertEqual(self.read(), ' update check failed')
+
+        self.write(' 4 upgradable', False, True)
+        self.assertEqual(self.read(), ' 4 upgradable')
+
+    def test_no_temporary_files(self):
+        self.write(' 3 upgradable')
+        self.write(' 4 upgradable')
+        self.assertEqual(os.listdir(self.directory), ['out'])
+
+    def test_atomic_write_failure(self):
+        # the temporary file doesn't outlive a failed write
+        with self.assertRaises(OSError):
+            ubuntu_updates_avail.atomic_write(os.path.join(self.directory, 'missing', 'out'), 'x')
+        os.mkdir(self.out_file)
+        with self.assertRaises(OSError):
+            ubuntu_updates_avail.atomic_write(self.out_file, 'x')
+        self.assertEqual(os.listdir(self.directory), ['out'])
+
+if __name__ == '__main__':
+    unittest.main()
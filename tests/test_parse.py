@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+'''
+Checks parsing the simulated upgrade: parse_upgrade_output(),
+iter_package_records() (and so PACKAGE_LINE_REGEX), and the placeholders
+worked out from the records.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+from ubuntu_updates_avail import PackageRecord, UpgradeCounts
+
+UPGRADE_OUTPUT = '''Reading package lists...
+Building dependency tree...
+Reading state information...
+Calculating upgrade...
+The following packages will be REMOVED:
+  oldpkg
+The following NEW packages will be installed:
+  newpkg
+The following packages have been kept back:
+  held
+The following packages will be upgraded:
+  bar libc6 libc6:i386 libfoo
+4 upgraded, 1 newly installed, 1 to remove and 1 not upgraded.
+Remv oldpkg [1]
+Inst libfoo [1.0-1] (1.0-2 Ubuntu:22.04/jammy-updates [amd64])
+Inst bar [2.0] (2.1 Ubuntu:22.04/jammy-updates, Ubuntu:22.04/jammy-security [all])
+Inst libc6 [2.35-0ubuntu3] (2.35-0ubuntu3.1 Ubuntu:22.04/jammy-updates [amd64]) [libc6:i386 ]
+Inst libc6:i386 [2.35-0ubuntu3] (2.35-0ubuntu3.1 Ubuntu:22.04/jammy-updates [i386])
+Inst newpkg (3 Ubuntu:22.04/jammy-updates [amd64])
+Conf libfoo (1.0-2 Ubuntu:22.04/jammy-updates [amd64])
+Conf bar (2.1 Ubuntu:22.04/jammy-updates, Ubuntu:22.04/jammy-security [all])
+Conf libc6 (2.35-0ubuntu3.1 Ubuntu:22.04/jammy-updates [amd64])
+Conf libc6:i386 (2.35-0ubuntu3.1 Ubuntu:22.04/jammy-updates [i386])
+Conf newpkg (3 Ubuntu:22.04/jammy-updates [amd64])
+'''
+
+RECORDS = [
+        PackageRecord('Remv', 'oldpkg', '1', None, None, None),
+        PackageRecord('Inst', 'libfoo', '1.0-1', '1.0-2', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        PackageRecord('Inst', 'bar', '2.0', '2.1', 'Ubuntu:22.04/jammy-updates, Ubuntu:22.04/jammy-security', 'all'),
+        PackageRecord('Inst', 'libc6', '2.35-0ubuntu3', '2.35-0ubuntu3.1', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        PackageRecord('Inst', 'libc6:i386', '2.35-0ubuntu3', '2.35-0ubuntu3.1', 'Ubuntu:22.04/jammy-updates', 'i386'),
+        PackageRecord('Inst', 'newpkg', None, '3', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        ]
+
+class ParseTest(unittest.TestCase):
+
+    def test_counts_and_records(self):
+        counts, records = ubuntu_updates_avail.parse_upgrade_output(UPGRADE_OUTPUT.splitlines(True))
+        self.assertEqual(counts, UpgradeCounts(4, 1, 1, 1))
+        self.assertEqual(records, RECORDS)
+
+    def test_without_records(self):
+        counts, records = ubuntu_updates_avail.parse_upgrade_output(UPGRADE_OUTPUT.splitlines(True), False)
+        self.assertEqual(counts, UpgradeCounts(4, 1, 1, 1))
+        self.assertIsNone(records)
+
+    def test_stops_reading(self):
+        # without the records, nothing past the summary line is read
+        closed = []
+
+        def lines():
+            try:
+                for line in UPGRADE_OUTPUT.splitlines(True):
+                    if line.startswith(('Inst', 'Remv')):
+                        self.fail('read past the summary line')
+                    yield line
+            finally:
+                closed.append(True)
+
+        ubuntu_updates_avail.parse_upgrade_output(lines(), False)
+        self.assertEqual(closed, [True])
+
+    def test_no_summary(self):
+        with self.assertRaises(ubuntu_updates_avail.UpgradeOutputParseError):
+            ubuntu_updates_avail.parse_upgrade_output(['Reading package lists...\n', 'E: oops\n'])
+
+    def test_line_by_line(self):
+        for line, record in zip([line for line in UPGRADE_OUTPUT.splitlines(True)
+                                    if line.startswith(('Inst', 'Remv'))], RECORDS):
+            with self.subTest(line=line):
+                self.assertEqual(list(ubuntu_updates_avail.iter_package_records([line])), [record])
+
+    def test_skipped_lines(self):
+        lines = ['Conf libfoo (1.0-2 Ubuntu:22.04/jammy-updates [amd64])\n',
+                    'The following packages will be upgraded:\n',
+                    '  Inst-ish continuation\n',
+                    'Inst\n']
+        self.assertEqual(list(ubuntu_updates_avail.iter_package_records(lines)), [])
+
+class RecordPlaceholdersTest(unittest.TestCase):
+
+    def test_security(self):
+        template_dict = ubuntu_updates_avail.create_template_dict(UpgradeCounts(4, 1, 1, 1), '%c', RECORDS)
+        self.assertEqual(template_dict['security'], '1')
+        self.assertEqual(template_dict['security_packages'], 'bar')
+
+        # new packages and removals aren't upgrades
+        self.assertEqual(template_dict['packages'], 'libfoo, bar, libc6, libc6:i386')
+        self.assertEqual(template_dict['upgradable'], '5')
+
+    def test_is_security_record(self):
+        self.assertTrue(ubuntu_updates_avail.is_security_record(RECORDS[2]))
+        self.assertFalse(ubuntu_updates_avail.is_security_record(RECORDS[1]))
+        self.assertFalse(ubuntu_updates_avail.is_security_record(RECORDS[0]))
+
+    def test_no_records(self):
+        template_dict = ubuntu_updates_avail.create_template_dict(UpgradeCounts(4, 1, 1, 1), '%c', None)
+        self.assertEqual((template_dict['packages'], template_dict['security_packages']), ('', ''))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+'''
+Checks the {download_size} and {installed_size_delta} placeholders, worked
+out from Packages files and a dpkg status file in a fake root, including
+foreign architecture (multiarch) packages.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+from ubuntu_updates_avail import PackageRecord, UpgradeCounts
+
+PACKAGES = {
+        'amd64' : '''Package: libfoo
+Architecture: amd64
+Version: 1.0-2
+Installed-Size: 2000
+Size: 700000
+
+Package: bar
+Architecture: all
+Version: 2.1
+Installed-Size: 100
+Size: 500000
+
+Package: libc6
+Architecture: amd64
+Version: 2.35-1
+Installed-Size: 13000
+Size: 3000000
+''',
+        'i386' : '''Package: libc6
+Architecture: i386
+Version: 2.35-1
+Installed-Size: 12000
+Size: 2800000
+''',
+        }
+
+STATUS = '''Package: dpkg
+Status: install ok installed
+Architecture: amd64
+Version: 1.21.1
+
+Package: libfoo
+Status: install ok installed
+Architecture: amd64
+Version: 1.0-1
+Installed-Size: 1000
+
+Package: bar
+Status: install ok installed
+Architecture: all
+Version: 2.0
+Installed-Size: 300
+
+Package: libc6
+Status: install ok installed
+Architecture: amd64
+Version: 2.35-0
+Installed-Size: 12900
+
+Package: libc6
+Status: install ok installed
+Architecture: i386
+Version: 2.35-0
+Installed-Size: 11900
+
+Package: oldpkg
+Status: install ok installed
+Architecture: amd64
+Version: 1
+Installed-Size: 10
+'''
+
+RECORDS = [
+        PackageRecord('Inst', 'libfoo', '1.0-1', '1.0-2', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        PackageRecord('Inst', 'bar', '2.0', '2.1', 'Ubuntu:22.04/jammy-security', 'all'),
+        PackageRecord('Inst', 'libc6:i386', '2.35-0', '2.35-1', 'Ubuntu:22.04/jammy-updates', 'i386'),
+        PackageRecord('Inst', 'libc6', '2.35-0', '2.35-1', 'Ubuntu:22.04/jammy-updates', 'amd64'),
+        PackageRecord('Remv', 'oldpkg', '1', None, None, None),
+        ]
+
+COUNTS = UpgradeCounts(4, 0, 1, 0)
+
+class SizesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+
+        self.lists_dir = os.path.join(self.root.name, 'lists')
+        os.mkdir(self.lists_dir)
+        for arch, packages in PACKAGES.items():
+            with open(os.path.join(self.lists_dir, 'x_dists_jammy_main_binary-%s_Packages' % arch), 'w') as f:
+                f.write(packages)
+
+        self.status_file = os.path.join(self.root.name, 'status')
+        with open(self.status_file, 'w') as f:
+            f.write(STATUS)
+
+    def template_dict(self, records, lists_dir=None):
+        names = set(ubuntu_updates_avail.package_key(record)[0] for record in records)
+        index = ubuntu_updates_avail.packages_index(lists_dir or self.lists_dir, names)
+        installed = ubuntu_updates_avail.installed_sizes(self.status_file, names)
+        native_arch = ubuntu_updates_avail.native_architecture(self.status_file)
+        return ubuntu_updates_avail.create_template_dict(COUNTS, '%c', records, index, None, installed, native_arch)
+
+    def test_package_key(self):
+        self.assertEqual(ubuntu_updates_avail.package_key(RECORDS[2]), ('libc6', 'i386'))
+        self.assertEqual(ubuntu_updates_avail.package_key(RECORDS[4]), ('oldpkg', None))
+        self.assertEqual(ubuntu_updates_avail.package_key(RECORDS[4], 'amd64'), ('oldpkg', 'amd64'))
+
+    def test_native_architecture(self):
+        self.assertEqual(ubuntu_updates_avail.native_architecture(self.status_file), 'amd64')
+
+    def test_sizes(self):
+        template_dict = self.template_dict(RECORDS)
+        self.assertEqual(template_dict['download_size'], '7.0 MB')
+        # (2000 + 100 + 12000 + 13000) - (1000 + 300 + 11900 + 12900 + 10) KiB
+        self.assertEqual(template_dict['installed_size_delta'], '+1.0 MB')
+
+    def test_foreign_architecture(self):
+        template_dict = self.template_dict(RECORDS[2:3])
+        self.assertEqual(template_dict['download_size'], '2.8 MB')
+        self.assertEqual(template_dict['installed_size_delta'], '+102.4 kB')
+
+    def test_no_lists(self):
+        empty = os.path.join(self.root.name, 'empty')
+        os.mkdir(empty)
+        for lists_dir in (empty, os.path.join(self.root.name, 'missing')):
+            template_dict = self.template_dict(RECORDS, lists_dir)
+            self.assertEqual(template_dict['download_size'], '')
+            self.assertEqual(template_dict['installed_size_delta'], '')
+
+    def test_unknown_candidate(self):
+        template_dict = self.template_dict(RECORDS[:1] + [RECORDS[1]._replace(candidate='2.2')])
+        self.assertEqual(template_dict['download_size'], '')
+        self.assertEqual(template_dict['installed_size_delta'], '')
+
+    def test_not_highest_version(self):
+        # apt's candidate is found whatever else is in the lists, e.g: a newer
+        # version in -proposed, or one pinned below what -updates has
+        with open(os.path.join(self.lists_dir, 'x_dists_jammy-proposed_main_binary-amd64_Packages'), 'w') as f:
+            f.write('Package: libfoo\nArchitecture: amd64\nVersion: 1.0-3\nInstalled-Size: 9000\nSize: 900000\n')
+        template_dict = self.template_dict(RECORDS[:1])
+        self.assertEqual(template_dict['download_size'], '700.0 kB')
+        self.assertEqual(template_dict['installed_size_delta'], '+1.0 MB')
+
+        template_dict = self.template_dict([RECORDS[0]._replace(candidate='1.0-3')])
+        self.assertEqual(template_dict['download_size'], '900.0 kB')
+        self.assertEqual(template_dict['installed_size_delta'], '+8.2 MB')
+
+    def test_unknown_installed(self):
+        template_dict = self.template_dict(RECORDS[:1] + [PackageRecord('Remv', 'gone', '1', None, None, None)])
+        self.assertEqual(template_dict['download_size'], '700.0 kB')
+        self.assertEqual(template_dict['installed_size_delta'], '')
+
+    def test_nothing_pending(self):
+        template_dict = self.template_dict([])
+        self.assertEqual(template_dict['download_size'], '0 B')
+        self.assertEqual(template_dict['installed_size_delta'], '0 B')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+'''
+Checks dpkg_version_compare() against dpkg's own ordering rules, and against
+dpkg --compare-versions itself when dpkg is installed.
+
+@date Oct 17, 2026
+'''
+
+import sys
+import os
+import shutil
+import functools
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ubuntu_updates_avail
+
+## (a, b, expected sign of comparing a to b), mostly from dpkg's own tests
+## and the Debian policy manual's examples
+VERSION_CASES = [
+        # equal, however they're written
+        ('1.0', '1.0', 0),
+        ('0:1.0', '1.0', 0),
+        ('1.001', '1.1', 0),
+        ('1.0', '1.0-0', 0),
+        ('0', '00', 0),
+
+        # epochs trump everything else
+        ('1:0.1', '9.9', 1),
+        ('2:1.0', '10:1.0', -1),
+        ('1:1.0-1', '1:1.0-2', -1),
+
+        # numeric parts compare as numbers
+        ('1.9', '1.10', -1),
+        ('1.2.3', '1.2.10', -1),
+        ('10', '9', 1),
+
+        # ~ sorts before everything, even the end of the version
+        ('1.0~rc1', '1.0', -1),
+        ('1.0~~', '1.0~~a', -1),
+        ('1.0~~a', '1.0~', -1),
+        ('1.0~', '1.0', -1),
+        ('1.0~rc1', '1.0~rc2', -1),
+
+        # letters sort before non-letters, and after the end
+        ('1.0', '1.0a', -1),
+        ('1.0a', '1.0+', -1),
+        ('1.0a', '1.0b', -1),
+        ('1.0+b1', '1.0.1', -1),
+        ('1.0Z', '1.0a', -1),
+
+        # the revision is after the last hyphen
+        ('1.2-3-4', '1.2-3-10', -1),
+        ('1.2-3-4', '1.2-4', 1),
+        ('1.0-1', '1.0-1ubuntu1', -1),
+        ('1.0-1ubuntu1', '1.0-1ubuntu1.1', -1),
+        ('2.0-1', '2.0', 1),
+        ]
+
+def sign(n):
+    return (n > 0) - (n < 0)
+
+class VersionCompareTest(unittest.TestCase):
+
+    def test_cases(self):
+        for a, b, expected in VERSION_CASES:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(sign(ubuntu_updates_avail.dpkg_version_compare(a, b)), expected)
+                self.assertEqual(sign(ubuntu_updates_avail.dpkg_version_compare(b, a)), -expected)
+
+    def test_sorting(self):
+        ordered = ['1.0~~', '1.0~~a', '1.0~', '1.0', '1.0-1', '1.0a', '1.0+', '1.0.1', '1:0.1']
+        shuffled = list(reversed(ordered))
+        self.assertEqual(sorted(shuffled, key=functools.cmp_to_key(ubuntu_updates_avail.dpkg_version_compare)),
+                            ordered)
+
+    @unittest.skipUnless(shutil.which('dpkg'), "dpkg isn't installed")
+    def test_against_dpkg(self):
+        for a, b, _ in VERSION_CASES:
+            for relation, expected in (('lt', -1), ('eq', 0), ('gt', 1)):
+                with self.subTest(a=a, relation=relation, b=b):
+                    dpkg = subprocess.run(['dpkg', '--compare-versions', a, relation, b]).returncode == 0
+                    ours = sign(ubuntu_updates_avail.dpkg_version_compare(a, b)) == expected
+                    self.assertEqual(ours, dpkg)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,14 @@ I wrote this program to display update information in my conky script.  The
 program checks whether there are updates available using apt-get and output to
 a file.
 
+@section Library Using it as a Library
+@par
+Importing the module doesn't do anything (no option parsing, no logging setup,
+no subprocesses), so other programs can use it directly. check_updates() does
+the checking and returns a Result, with the settings coming from a Config. The
+command line is main(), which just parses the options into a Config, sets up
+logging, and renders/writes what check_updates() found.
+
 
 @section Requirements
 - python 3
@@ -76,14 +84,17 @@ report them to me, so please do.
 
 #TODO: an alternative to calling update and parsing is to call "apt list --upgradeable", but this only gives the total number, and still requires parsing the output
 
-import subprocess
 import sys
 import re
 import logging
-import textwrap
-from optparse import OptionParser
 import os
 import time
+import collections
+
+# Everything else (subprocess, optparse, urllib, multiprocessing, etc.) is
+# imported in the functions that use it. Importing this module has to stay
+# cheap, both for the command line (which is started a lot) and for programs
+# that use it as a library and only need part of it.
 
 
 ###
@@ -99,6 +110,193 @@ DEFAULT_OUTPUT_TEMPLATE = '''\
  
 
 DEFAULT_SERVER_ADDRESS = 'us.archive.ubuntu.com'
+DEFAULT_NETWORK_TIMEOUT = 3             # seconds for the whole network check
+DEFAULT_MAX_SLEEP_PERIOD = 300          # cap on the backoff between update tries
+
+## stderr of apt-get update (or sudo) that retrying won't fix
+PERMANENT_UPDATE_ERRORS = ('is not in the sudoers',
+                            'a password is required',
+                            'a terminal is required',
+                            'are you root',
+                            'Permission denied',
+                            'Malformed',
+                            'The list of sources could not be read',
+                            'Conflicting values set for option',
+                            'is not signed',
+                            'does not have a Release file',)
+
+## stderr of apt-get update when something else holds the apt/dpkg locks
+LOCK_UPDATE_ERRORS = ('Could not get lock',
+                        'Unable to lock directory',
+                        'Unable to acquire the dpkg frontend lock',)
+
+PROC_NET_ROUTE = '/proc/net/route'
+PROC_NET_IPV6_ROUTE = '/proc/net/ipv6_route'
+PROC_LOCKS = '/proc/locks'
+
+DEFAULT_DAEMON_INTERVAL = 3600          # seconds between checks in daemon mode
+
+APT_SOURCES_LIST = '/etc/apt/sources.list'
+APT_SOURCES_PARTS = '/etc/apt/sources.list.d'
+APT_LISTS_DIR = '/var/lib/apt/lists'
+APT_LISTS_LOCK_FILE = '/var/lib/apt/lists/lock'
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+DPKG_LOCK_FILE = '/var/lib/dpkg/lock'
+DPKG_FRONTEND_LOCK_FILE = '/var/lib/dpkg/lock-frontend'
+APT_PREFERENCES = '/etc/apt/preferences'
+APT_PREFERENCES_PARTS = '/etc/apt/preferences.d'
+APT_CONF = '/etc/apt/apt.conf'
+APT_CONF_PARTS = '/etc/apt/apt.conf.d'
+
+DEFAULT_PROBE_TIMEOUT = 10              # seconds to wait on each mirror probe
+WATCH_DEBOUNCE = 2                      # seconds without events before --watch re-checks
+DEFAULT_QUERY_TIMEOUT = 5               # seconds a --query (and the server's read of it) may take
+DEFAULT_LOCK_TIMEOUT = 60               # seconds to wait for the apt/dpkg locks before updating
+LOCK_POLL_PERIOD = 1                    # seconds between looks at a held lock
+DEFAULT_FLIGHT_WAIT = 600               # seconds to wait for a check already in progress
+FLIGHT_POLL_PERIOD = 0.2                # seconds between tries at the --flight_file's lock
+DEADLINE_GRACE = 2                      # seconds past the --deadline a check gets to wind down
+
+## compiled once so that daemon mode doesn't recompile it every cycle
+UPGRADE_SUMMARY_REGEX = re.compile('([0-9]+) upgraded, ([0-9]+) newly installed, ([0-9]+) to remove and ([0-9]+) not upgraded.')
+
+## placeholders that need the Packages index (see packages_index()) as well
+## as the records
+INDEX_PLACEHOLDERS = frozenset(['download_size', 'installed_size_delta'])
+
+## placeholders that come from the history file (see update_history())
+HISTORY_PLACEHOLDERS = frozenset(['new_since_last', 'pending_days'])
+
+## placeholders that need the per-package records, rather than just the counts
+RECORD_PLACEHOLDERS = frozenset(['packages', 'security', 'security_packages']) | \
+                        INDEX_PLACEHOLDERS | HISTORY_PLACEHOLDERS
+
+## every placeholder create_template_dict() fills in
+TEMPLATE_PLACEHOLDERS = frozenset(['upgrade', 'install', 'remove', 'not_upgraded',
+                                    'time', 'upgradable', 'stale_age']) | RECORD_PLACEHOLDERS
+
+## matches the Inst/Remv lines of the simulated upgrade, e.g:
+##  Inst libfoo [1.0-1] (1.0-2 Ubuntu:22.04/jammy-updates [amd64])
+##  Remv libbar [2.0]
+PACKAGE_LINE_REGEX = re.compile(r'(Inst|Remv) (\S+)(?: \[([^\]]*)\])?(?: \((\S+) (.*?) ?\[([^\]]+)\]\))?')
+
+DEFAULT_LOG_LEVEL = logging.INFO
+DEFAULT_LOG_MAX_BYTES = 1 << 20         # size at which the log file is rotated
+DEFAULT_LOG_BACKUPS = 3                 # rotated log files kept
+LOG_FORMATS = ('text', 'json')
+
+## inotify(7), for --watch
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+PROFILE_TOP = 25                        # functions listed in the --profile summary
+
+HISTORY_MAX_RUNS = 1000                 # runs kept in the history file, older ones are compacted away
+
+## runs: the counts of each run, newest last (bounded by HISTORY_MAX_RUNS).
+## pending: the upgrades pending as of the last run, with when each was first
+##  seen. It is replaced every run, so it only ever holds the latest state.
+HISTORY_SCHEMA = '''
+PRAGMA auto_vacuum = INCREMENTAL;
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    upgrade INTEGER NOT NULL,
+    install INTEGER NOT NULL,
+    remove INTEGER NOT NULL,
+    not_upgraded INTEGER NOT NULL,
+    new INTEGER);
+CREATE TABLE IF NOT EXISTS pending (
+    name TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    candidate TEXT,
+    first_seen REAL NOT NULL,
+    PRIMARY KEY (name, arch)) WITHOUT ROWID;
+'''
+
+## the metrics written to the metrics file: name -> (type, help)
+METRICS_PREFIX = 'ubuntu_updates_avail_'
+METRICS = {
+        'stage_duration_seconds'        : ('gauge', 'Seconds each stage of the last check took.'),
+        'pending_packages'              : ('gauge', 'Packages pending as of the last successful check, by kind.'),
+        'last_run_timestamp_seconds'    : ('gauge', 'When the last check finished.'),
+        'last_success_timestamp_seconds': ('gauge', 'When the last successful check finished.'),
+        'exit_code'                     : ('gauge', 'Exit code of the last check, see ERROR_CODES.'),
+        'runs_total'                    : ('counter', 'Checks run.'),
+        'update_retries_total'          : ('counter', 'Failed apt-get updates that were retried.'),
+        'lock_contention_total'         : ('counter', 'Updates that found the apt/dpkg locks held past --lock_timeout.'),
+        'cache_hits_total'              : ('counter', 'Checks that reused the cached counts.'),
+        'cache_misses_total'            : ('counter', 'Checks that had to compute the counts.'),
+        'shared_results_total'          : ('counter', 'Checks that reused the result of one already in progress.'),
+        'stale_renders_total'           : ('counter', 'Times the last good result was rendered as a check ran late.'),
+        'errors_total'                  : ('counter', 'Failed checks, by ERROR_CODES key.'),
+        }
+
+## samples that are carried over from the last metrics file, so they keep
+## counting (or are kept) across runs
+METRICS_KEPT = frozenset(['pending_packages', 'last_success_timestamp_seconds']) | \
+                frozenset(name for name, (kind, _) in METRICS.items() if kind == 'counter')
+
+## a sample line of a metrics file, e.g: name{label="value"} 1
+METRICS_SAMPLE_REGEX = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+METRICS_LABEL_REGEX = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+## The settings for a check and their defaults. These are the command line
+## options (see program_options()), and the attributes of Config.
+DEFAULT_CONFIG = {
+                'base_dir'          : '.',
+                'log_file'          : 'ubuntu_updates_avail.log',
+                'log_dir'           : None,
+                'log_level'         : 'default',
+                'log_max_bytes'     : DEFAULT_LOG_MAX_BYTES,
+                'log_backups'       : DEFAULT_LOG_BACKUPS,
+                'log_format'        : 'text',
+                'template_file'     : None,
+                'time_format'       : '%c',
+                'max_width'         : 0,
+                'no_error_output'   : False,
+                'num_update_checks' : 1,
+                'sleep_period'      : 0,
+                'backoff_factor'    : 2.0,
+                'max_sleep_period'  : DEFAULT_MAX_SLEEP_PERIOD,
+                'jitter'            : True,
+                'update_deadline'   : 0,
+                'lock_timeout'      : DEFAULT_LOCK_TIMEOUT,
+                'skip_if_locked'    : False,
+                'no_root'           : False,
+                'network_check'     : False,
+                'mirrors'           : None,
+                'network_timeout'   : DEFAULT_NETWORK_TIMEOUT,
+                'conditional_update': False,
+                'probe_timeout'     : DEFAULT_PROBE_TIMEOUT,
+                'engine'            : 'apt',
+                'cross_check'       : False,
+                'cache_file'        : None,
+                'cache_hash'        : False,
+                'metrics_file'      : None,
+                'history_file'      : None,
+                'flight_file'       : None,
+                'flight_wait'       : DEFAULT_FLIGHT_WAIT,
+                'deadline'          : 0,
+                'stale_after'       : 0,
+                'stale_file'        : None,
+                'targets'           : None,
+                'serve'             : None,
+                'query'             : None,
+                'query_counts'      : False,
+                'roots'             : None,
+                'jobs'              : 4,
+                'roots_timeout'     : 0,
+                'daemon'            : False,
+                'profile'           : False,
+                'watch'             : False,
+                'interval'          : DEFAULT_DAEMON_INTERVAL,
+                }
 
 NO_ERROR = 0
 
@@ -109,9 +307,12 @@ ERROR_CODES = {
                 'CustomException' : 11,
                 'NoNetworkError' : 12,
                 'UpdateError' : 13,
-                'UpgradSimulError' : 14,
+                'UpgradeSimulError': 14,
                 'UpgradeOutputParseError' : 15,
                 'GenerateOutputError' : 16,
+                'LockContentionError' : 17,
+                'DeadlineExceededError' : 18,
+                'NoResultError' : 19,
                 }
 
 ## The key values to this dict must be the same as the names of the exceptions
@@ -121,11 +322,53 @@ ERROR_MSGS = {  'default'                   : FAILED_MSG,
                 'CustomException'           : FAILED_MSG,
                 'NoNetworkError'            : ' no network available',
                 'UpdateError'               : ' failed to update package info',
-                'UpgradSimulError'          : ' failed to simulate upgrade',
+                'UpgradeSimulError'         : ' failed to simulate upgrade',
                 'UpgradeOutputParseError'   : ' failed to parse simulated upgrade output',
                 'GenerateOutputError'       : ' failed to generate outut',
+                'LockContentionError'       : ' package manager is busy',
+                'DeadlineExceededError'     : ' update check took too long',
+                'NoResultError'             : ' no result yet',
                 }
 
+## The counts from apt-get upgrade's summary line (or the native engine's
+## equivalent of it)
+UpgradeCounts = collections.namedtuple('UpgradeCounts', 'upgrade install remove not_upgraded')
+
+## One package from the simulated upgrade. action is 'Inst' or 'Remv'. current
+## is None for new packages, candidate/origin/arch are None for removals.
+## Tuples rather than objects, so thousands of them stay cheap.
+PackageRecord = collections.namedtuple('PackageRecord', 'action name current candidate origin arch')
+
+## What check_updates() found: the UpgradeCounts and the list of
+## PackageRecords (None if they weren't needed).
+Result = collections.namedtuple('Result', 'counts records')
+
+class Config(object):
+    '''
+    The settings for a check. Starts off with DEFAULT_CONFIG, with any of them
+    overridden by keyword arguments, e.g:
+
+    @code
+    config = Config(engine='native', num_update_checks=0)
+    @endcode
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, **settings):
+        '''
+        @param settings the settings to override (see DEFAULT_CONFIG).
+        @throws TypeError for settings that don't exist.
+        '''
+        unknown = set(settings) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise TypeError('unknown settings: %s' % ', '.join(sorted(unknown)))
+
+        self.__dict__.update(DEFAULT_CONFIG)
+        self.__dict__.update(settings)
+
+    def __repr__(self):
+        return 'Config(%s)' % ', '.join('%s=%r' % item for item in sorted(self.__dict__.items()))
+
 ###
 #### exceptions
 ###
@@ -201,6 +444,55 @@ class UpdateError(CustomException):
     def __str__(self):
         return "Call to apt-get update failed: %s" % self.error
 
+class LockContentionError(CustomException):
+    '''
+    Error when something else (unattended-upgrades, a user's apt-get, etc.)
+    held the apt/dpkg locks for longer than we were willing to wait.
+
+    Kept apart from UpdateError because nothing is wrong, we just couldn't
+    update right now.
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, error):
+        '''
+        @param error which lock was held and by whom
+        '''
+        super().__init__(error)
+
+    def __str__(self):
+        return "Package manager is busy: %s" % self.error
+
+class DeadlineExceededError(CustomException):
+    '''
+    Error when the check didn't finish by the --deadline.
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, error):
+        '''
+        @param error what was still running
+        '''
+        super().__init__(error)
+
+    def __str__(self):
+        return "Deadline exceeded: %s" % self.error
+
+class NoResultError(CustomException):
+    '''
+    Error the --serve server answers with until its first check finishes.
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, error):
+        '''
+        @param error why there isn't a result
+        '''
+        super().__init__(error)
+
+    def __str__(self):
+        return "No result yet: %s" % self.error
+
 class UpgradeSimulError(CustomException):
     '''
     Error for when the upgrade simulation failed.
@@ -215,7 +507,7 @@ class UpgradeSimulError(CustomException):
         super().__init__(error)
 
     def __str__(self):
-        return "Upgrade simulation failed: %s" % e
+        return "Upgrade simulation failed: %s" % self.error
 
 class UpgradeOutputParseError(CustomException):
     '''
@@ -231,7 +523,7 @@ class UpgradeOutputParseError(CustomException):
         super().__init__(error)
 
     def __str__(self):
-        return "Upgrade output parseing failed: %s" % e
+        return "Upgrade output parseing failed: %s" % self.error
 
 class GenerateOutputError(CustomException):
     '''
@@ -247,20 +539,27 @@ class GenerateOutputError(CustomException):
         super().__init__(error)
 
     def __str__(self):
-        return "Generation of output failed: %s" % e
+        return "Generation of output failed: %s" % self.error
 
 
 ###
 #### program options
 ###
-def program_options():
+def program_options(argv=None):
     '''
     handles program options
 
+    The defaults all come from DEFAULT_CONFIG.
+
+    @param argv List of Strings, the arguments to parse. None means sys.argv.
+    @return (Config, args) tuple
     @date Jan 16, 2011
     @author Matthew Todd
     '''
-    usage = "usage: %prog [options] <output_file/->"
+    import textwrap
+    from optparse import OptionParser
+
+    usage = "usage: %prog [options] <output_file/->\n       %prog [options] --target <target> [--target <target> ...] [output_file/-]"
     version_info = textwrap.dedent('''\
         ubuntu_updates_avail Copyright (C) 2011 Matthew A. Todd
         This program is licensed under the GNU GPL v.3. For a full text of the
@@ -272,10 +571,21 @@ def program_options():
                     which contains the template. The template is a python
                     string that will have format() called on it. You can use
                     the following identifiers/placeholders: {upgrade},
-                    {install}, {remove}, {not_upgraded}, {time}, {upgradable} along with the
-                    normal formatting syntax.
+                    {install}, {remove}, {not_upgraded}, {time}, {upgradable},
+                    {packages}, {security}, {security_packages},
+                    {download_size}, {installed_size_delta},
+                    {new_since_last}, {pending_days}, {stale_age} along with
+                    the normal formatting syntax.
                     
                     upgrade, install, remove, not_upgraded are strait from apt-get upgrade output.
+
+                    packages is a comma separated list of the packages to be
+                    upgraded. security is how many of them come from a
+                    -security pocket, and security_packages lists them.
+
+                    download_size is how much the upgrade will download, and
+                    installed_size_delta how much more (or less) disk space
+                    it will use, e.g: +1.2 MB.
                     
                     time is the current time (full asctime)
                     
@@ -284,83 +594,354 @@ def program_options():
 
     num_update_checks_help = textwrap.dedent('''\
             Number of times to try apt-get update before failing. Default is 1.
-            0 tries implies that it is not to update.''')
+            0 tries implies that it is not to update. Failures that retrying
+            can't fix (sudo refusing, broken sources) aren't retried.''')
+
+    sleep_period_help = textwrap.dedent('''\
+            how long to sleep between update tries. This is the first sleep,
+            each one after is backoff_factor times longer (up to
+            max_sleep_period), with random jitter so that many hosts don't
+            retry in lockstep.''')
 
     no_update_help = textwrap.dedent('''\
             Do not update. Note that this option conflicts with
             --num_update_checks (for obvious reasons). If both are specified,
             which one is used isn't specified.''')
 
+    daemon_help = textwrap.dedent('''\
+            Stay resident and re-run the check every INTERVAL seconds instead
+            of exiting after a single check. The template and logging are only
+            setup once.''')
+
     parser = OptionParser(usage)
     parser.add_option("--version", dest="version",
                         action="store_true", default=False,
                         help='''print version information and quit''')
 
     parser.add_option("--base_dir", dest="base_dir",
-                        action="store", type="string", default=".",
+                        action="store", type="string",
                         help="""Location to store output file and log file (if log file isn't given its own directory)""")
 
     parser.add_option("--log_file", dest="log_file",
-                        action="store", type="string", default="ubuntu_updates_avail.log",
+                        action="store", type="string",
                         help="""Name of generated log file""")
 
     parser.add_option("--log_dir", dest="log_dir",
-                        action="store", type="string", default=None,
+                        action="store", type="string",
                         help="""Location to store the generated log file""")
 
     parser.add_option("--log_level", dest="log_level",
-                        action="store", type="string", default="debug",
-                        help="""The log level""")
+                        action="store", type="string",
+                        help="""The log level. Default is %s.""" % logging.getLevelName(DEFAULT_LOG_LEVEL).lower())
+
+    parser.add_option("--log_max_bytes", dest="log_max_bytes",
+                        action="store", type="int",
+                        help='''Size at which the log file is rotated (to
+                        log_file.1, etc.) 0 means never. Default is
+                        %d.''' % DEFAULT_LOG_MAX_BYTES)
+
+    parser.add_option("--log_backups", dest="log_backups",
+                        action="store", type="int",
+                        help='''Rotated log files to keep. Default is
+                        %d.''' % DEFAULT_LOG_BACKUPS)
+
+    parser.add_option("--log_format", dest="log_format",
+                        action="store", type="choice", choices=LOG_FORMATS,
+                        help='''Format of the log file: text (the default), or
+                        json for one compact JSON object per line.''')
 
     parser.add_option("--template", dest="template_file",
-                        action="store", type="string", default=None,
+                        action="store", type="string",
                         help=template_help)
 
+    parser.add_option("--target", dest="targets",
+                        action="append", type="string",
+                        help='''Another output to render from the same check,
+                        as DEST[,template=FILE][,max_width=N][,format=json]
+                        [,no_error_output]. DEST and FILE are relative to
+                        base_dir, and DEST can be - for stdout. format=json
+                        writes all of the placeholders as a JSON object
+                        instead of using a template. Can be given many times.
+                        With --target the output_file argument is
+                        optional.''')
+
     parser.add_option("--time_format", dest="time_format",
-                        action="store", type="string", default='%c',
+                        action="store", type="string",
                         help='''Define the format of the time placeholder to be used in the template.''')
 
     parser.add_option("--max_width", dest="max_width",
-                        action="store", type="int", default=0,
+                        action="store", type="int",
                         help='''max width of the output.''')
 
     parser.add_option("--no_error_output", dest="no_error_output",
-                        action="store_true", default=False,
+                        action="store_true",
                         help='''Do not update output file with errors. If
                             update was unsucessful, leave old file untouched.''')
 
     parser.add_option("-c", "--num_update_checks", dest="num_update_checks",
-                        action="store", type="int", default=1,
+                        action="store", type="int",
                         help=num_update_checks_help)
 
     parser.add_option("--sleep_period", dest="sleep_period",
-                        action="store", type="int", default=0,
-                        help="how long to sleep between update tries.")
+                        action="store", type="int",
+                        help=sleep_period_help)
+
+    parser.add_option("--backoff_factor", dest="backoff_factor",
+                        action="store", type="float",
+                        help='''How much longer each sleep between update tries
+                        is than the last. 1 means a fixed sleep_period. Default
+                        is 2.''')
+
+    parser.add_option("--max_sleep_period", dest="max_sleep_period",
+                        action="store", type="int",
+                        help='''Longest sleep between update tries. Default is
+                        %d.''' % DEFAULT_MAX_SLEEP_PERIOD)
+
+    parser.add_option("--no_jitter", dest="jitter",
+                        action="store_false",
+                        help='''Sleep exactly as long as the backoff says,
+                        rather than a random amount between half and all of
+                        it.''')
+
+    parser.add_option("--update_deadline", dest="update_deadline",
+                        action="store", type="int",
+                        help='''Seconds all of the update tries (and sleeps)
+                        may take in total. When the deadline is reached, the
+                        package lists from the last good update are used
+                        rather than failing. 0 (the default) means no
+                        deadline.''')
+
+    parser.add_option("--lock_timeout", dest="lock_timeout",
+                        action="store", type="int",
+                        help='''Seconds to wait for the apt and dpkg locks
+                        (held by e.g: unattended-upgrades) to be free before
+                        each update try. If they're still held, the check
+                        fails with its own error, rather than an update
+                        failure. Default is %d.''' % DEFAULT_LOCK_TIMEOUT)
+
+    parser.add_option("--skip_if_locked", dest="skip_if_locked",
+                        action="store_true",
+                        help='''When the apt and dpkg locks are still held
+                        after --lock_timeout, skip the update and use the
+                        package lists from the last good update, rather than
+                        failing.''')
 
     parser.add_option("--no_update", dest="num_update_checks",
                         action="store_const", const=0,
                         help=no_update_help)
 
     parser.add_option("--no_root", dest="no_root",
-                        action="store_true", default=False,
+                        action="store_true",
                         help='''Disable all operations requiring root priveleges.''')
 
     parser.add_option("--network_check", dest="network_check",
-                        action="store_true", default=False,
+                        action="store_true",
                         help='''Enable network checking. Will verify network's
                         prescence before trying to update. Note that network
                         check's accuracy cannot be guaranteed.''')
 
-    (options, args) = parser.parse_args()
+    parser.add_option("--mirror", dest="mirrors",
+                        action="append", type="string",
+                        help='''Mirror (host or host:port) to try connecting to
+                        in the network check. Can be given many times. Defaults
+                        to the hosts in apt's sources.''')
+
+    parser.add_option("--network_timeout", dest="network_timeout",
+                        action="store", type="float",
+                        help='''Seconds the network check may take in total.
+                        Default is %d.''' % DEFAULT_NETWORK_TIMEOUT)
+
+    parser.add_option("--conditional_update", dest="conditional_update",
+                        action="store_true",
+                        help='''Only call apt-get update if at least one of the
+                        sources' Release files has changed upstream since it
+                        was last downloaded. Checked with cheap HTTP HEAD
+                        requests.''')
+
+    parser.add_option("--probe_timeout", dest="probe_timeout",
+                        action="store", type="int",
+                        help='''Seconds to wait for each source when checking
+                        for changes (see --conditional_update). Default is %d.''' % DEFAULT_PROBE_TIMEOUT)
+
+    parser.add_option("--engine", dest="engine",
+                        action="store", type="choice", choices=['apt', 'native'],
+                        help='''How to work out the pending upgrades: 'apt'
+                        simulates the upgrade with apt-get, 'native' reads the
+                        dpkg status and apt lists directly without forking.
+                        The native engine falls back to apt-get if it can't
+                        read the lists. Default is apt.''')
+
+    parser.add_option("--cross_check", dest="cross_check",
+                        action="store_true",
+                        help='''Run both engines and log any disagreement. If
+                        they disagree, apt-get's counts are used.''')
+
+    parser.add_option("--cache_file", dest="cache_file",
+                        action="store", type="string",
+                        help='''File (relative to base_dir) in which to cache
+                        the counts. If the dpkg status, apt lists, apt's
+                        configuration and the engine haven't changed since
+                        the counts were cached, they are reused instead of
+                        simulating the upgrade again.''')
+
+    parser.add_option("--cache_hash", dest="cache_hash",
+                        action="store_true",
+                        help='''Also hash the contents of the dpkg status and
+                        apt lists when checking the cache, rather than just
+                        their mtime, size and inode. Slower, but catches
+                        changes that preserve the mtime.''')
+
+    parser.add_option("--metrics_file", dest="metrics_file",
+                        action="store", type="string",
+                        help='''File (relative to base_dir) to write metrics to
+                        after each check, in Prometheus text format: how long
+                        each stage took, the pending counts, update retries,
+                        cache hits and errors. Point it at node_exporter's
+                        textfile collector directory (the name has to end in
+                        .prom) to scrape it.''')
+
+    parser.add_option("--history_file", dest="history_file",
+                        action="store", type="string",
+                        help='''SQLite file (relative to base_dir) to record
+                        the counts and pending upgrades of each run in. Needed
+                        for the {new_since_last} and {pending_days}
+                        placeholders. Only the last %d runs are kept.''' % HISTORY_MAX_RUNS)
+
+    parser.add_option("--flight_file", dest="flight_file",
+                        action="store", type="string",
+                        help='''File (relative to base_dir) through which
+                        overlapping runs (cron, login hooks, by hand) share
+                        their result. If a check is already in progress, we
+                        wait for it and render its result, rather than
+                        updating and simulating the upgrade again.''')
+
+    parser.add_option("--flight_wait", dest="flight_wait",
+                        action="store", type="int",
+                        help='''Seconds to wait for a check already in
+                        progress (see --flight_file), after which we check
+                        ourselves. Default is %d.''' % DEFAULT_FLIGHT_WAIT)
+
+    parser.add_option("--deadline", dest="deadline",
+                        action="store", type="int",
+                        help='''Seconds the whole check may take. Every
+                        command (apt-get, sudo) is given what's left of it as
+                        a timeout and, when that runs out, is killed along
+                        with its children. With --stale_file, the last good
+                        result is rendered instead. 0 (the default) means no
+                        deadline.''')
+
+    parser.add_option("--stale_after", dest="stale_after",
+                        action="store", type="int",
+                        help='''Seconds after which a check that is still
+                        running has the last good result (see --stale_file)
+                        rendered meanwhile. The check carries on (up to the
+                        --deadline, if any) and its result replaces the stale
+                        one when it's done. 0 (the default) means never.''')
+
+    parser.add_option("--stale_file", dest="stale_file",
+                        action="store", type="string",
+                        help='''File (relative to base_dir) in which to keep
+                        the last good result, to render when a check runs
+                        past --stale_after or --deadline. {stale_age} is how
+                        old it is (and empty when the result is fresh).''')
+
+    parser.add_option("--root", dest="roots",
+                        action="append", type="string",
+                        help='''Check the system rooted at ROOT (a chroot,
+                        container or image rootfs) instead of this one. Can be
+                        given many times to check many roots concurrently. Each
+                        root's output goes to <output_file>.<root> and the
+                        output file gets a summary of all of them.''')
+
+    parser.add_option("--jobs", dest="jobs",
+                        action="store", type="int",
+                        help='''How many roots to check at once. Default is 4.''')
+
+    parser.add_option("--roots_timeout", dest="roots_timeout",
+                        action="store", type="int",
+                        help='''Seconds to wait for all of the roots to be
+                        checked. Roots still running after this are killed and
+                        reported as failed. 0 (the default) means no limit.''')
+
+    parser.add_option("--daemon", dest="daemon",
+                        action="store_true",
+                        help=daemon_help)
+
+    parser.add_option("--interval", dest="interval",
+                        action="store", type="int",
+                        help='''Seconds between checks in daemon mode. Default is %d.''' % DEFAULT_DAEMON_INTERVAL)
+
+    parser.add_option("--serve", dest="serve",
+                        action="store", type="string", metavar="SOCKET",
+                        help='''Run as a server: check every --interval
+                        seconds and answer --query clients on the Unix socket
+                        SOCKET (relative to base_dir) from the latest result,
+                        instead of writing output files. The templates that
+                        can be asked for are "default" (--template) and each
+                        --target, by its DEST.''')
+
+    parser.add_option("--query", dest="query",
+                        action="store", type="string", metavar="SOCKET",
+                        help='''Ask the --serve server on SOCKET (relative to
+                        base_dir) for its latest output and print it, instead
+                        of checking. The argument is the name of the template
+                        to render, "default" if not given. Exits with the
+                        server's last exit code.''')
+
+    parser.add_option("--query_counts", dest="query_counts",
+                        action="store_true",
+                        help='''With --query, print the counts as JSON rather
+                        than rendering a template.''')
+
+    parser.add_option("--watch", dest="watch",
+                        action="store_true",
+                        help='''With --daemon or --serve, also re-check (without
+                        updating) whenever the local package state changes:
+                        dpkg's status file or locks, or apt's lists. Bursts of
+                        changes are waited out (%d seconds without any) so an
+                        upgrade is only re-checked once it is done. The full
+                        check, with the update, still happens every
+                        --interval.''' % WATCH_DEBOUNCE)
+
+    parser.add_option("--profile", dest="profile",
+                        action="store_true",
+                        help='''Profile the run with cProfile and time every
+                        subprocess (apt-get, sudo) it starts. The stats are
+                        written to <log_file>.pstats in the log directory,
+                        with a summary of the subprocesses and the top %d
+                        functions in <log_file>.profile. With --root, the
+                        roots are checked in other processes, which aren't
+                        profiled.''' % PROFILE_TOP)
+
+    parser.set_defaults(**DEFAULT_CONFIG)
+    (options, args) = parser.parse_args(argv)
 
     if options.version:
         print(version_info)
         sys.exit(0)
 
-    if len(args) != 1:
+    if options.query:
+        if len(args) > 1:
+            parser.error("Incorrect number of arguments")
+    elif options.serve:
+        if args:
+            parser.error("--serve doesn't take an output file, use --target to name templates")
+        if options.roots or options.daemon:
+            parser.error("--serve can't be used with --root or --daemon")
+    elif len(args) > 1 or (len(args) == 0 and not options.targets):
         parser.error("Incorrect number of arguments")
 
-    return (options, args)
+    if options.watch and not (options.daemon or options.serve):
+        parser.error("--watch needs --daemon or --serve")
+
+    for spec in options.targets or ():
+        try:
+            parse_target(spec)
+        except ValueError as e:
+            parser.error("invalid --target %s: %s" % (spec, e))
+
+    del options.version
+    return (Config(**vars(options)), args)
 
 def compute_out_file(base_dir, filename):
     '''
@@ -376,38 +957,120 @@ def compute_out_file(base_dir, filename):
     if filename.strip() == '-':
         return '-'
     else:
-        return os.path.abspath(os.path.join(options.base_dir, args[0]))
+        return os.path.abspath(os.path.join(base_dir, filename))
 
-def get_template(template_file, base_dir):
+def rooted(root, path):
     '''
-    Gets the template from the file. If no file, then uses default.
+    The path of an absolute path (e.g: DPKG_STATUS_FILE) inside the given
+    root directory.
 
-    @param template_file String filename of the template file. Can contain path information.
-    @param base_dir String directory to base the file off of.
-    @date Feb 11, 2011
-    @author Matthew Todd
+    @param root String root directory. None (or /) means the running system.
+    @param path String absolute path.
+    @date Oct 17, 2026
     '''
-    if options.template_file:
-        template_file = os.path.abspath(os.path.join(options.base_dir, options.template_file))
-        with open(template_file, 'r') as f:
-            return f.read()
-    else:
-        return DEFAULT_OUTPUT_TEMPLATE
+    if not root or root == '/':
+        return path
+    return os.path.join(root, path.lstrip('/'))
+
+def root_file(filename, root):
+    '''
+    The file (output, cache, etc.) to use for the given root when checking
+    many roots: filename with the root's path appended, e.g:
+    updates.info.srv_chroot_jammy.
+
+    @param filename String the file's name when checking a single system. '-'
+        (stdout) and None are returned unchanged.
+    @param root String root directory, or None for the running system.
+    @date Oct 17, 2026
+    '''
+    if root is None or filename in (None, '-'):
+        return filename
+    return '%s.%s' % (filename, root.strip('/').replace('/', '_') or 'root')
+
+def apt_root_options(root):
+    '''
+    The apt-get options that make it work on the system in the given root
+    directory rather than the running one.
+
+    Dir moves all of apt's relative directories (etc, lists, cache) into the
+    root, but dpkg's status file is absolute so it has to be moved as well.
+
+    @param root String root directory. None (or /) means the running system.
+    @return list of Strings
+    @date Oct 17, 2026
+    '''
+    if not root or root == '/':
+        return []
+    return ['-o', 'Dir=%s' % root, '-o', 'Dir::State::status=%s' % rooted(root, DPKG_STATUS_FILE)]
+
+def metrics_root_file(filename, root):
+    '''
+    Like root_file(), but the root goes before the extension, as the textfile
+    collector only reads files ending in .prom, e.g:
+    updates.srv_chroot_jammy.prom.
+
+    @param filename String the metrics file's name when checking a single system.
+    @param root String root directory, or None for the running system.
+    @date Oct 17, 2026
+    '''
+    base, extension = os.path.splitext(filename)
+    return root_file(base, root) + extension
 
-# we do this here so that we have what we need to setup logging.
-options, args = program_options()
+def compute_base_file(base_dir, filename):
+    '''
+    Computes the path of a file that lives relative to base_dir (cache file,
+    etc.)
+
+    @param base_dir String The directory from which to base the file.
+    @param filename String the name of the file. Can contain path information
+        as well. None means the file isn't wanted.
+    @return the absolute path, or None if filename is None.
+    @date Oct 17, 2026
+    '''
+    if filename is None:
+        return None
+    return os.path.abspath(os.path.join(base_dir, filename))
 
 
 ###
 #### logging
 ###
-def setupLogging(directory, filename, level):
+class JSONFormatter(logging.Formatter):
+    '''
+    Formats log records as compact JSON objects, one per line, for
+    --log_format json.
+
+    @date Oct 17, 2026
+    '''
+    def format(self, record):
+        import json
+
+        entry = {'time': record.created, 'level': record.levelname,
+                'module': record.module, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'))
+
+def setupLogging(directory, filename, level, max_bytes=DEFAULT_LOG_MAX_BYTES,
+                    backups=DEFAULT_LOG_BACKUPS, log_format='text'):
     '''
     Create and setup our root logger.
 
+    The root logger only puts records on a queue (QueueHandler), and a
+    QueueListener's thread writes them to the log file, so the checks don't
+    wait on the log file's I/O (slow disks, NFS). The log file is appended
+    to, and rotated once it reaches max_bytes, so each run doesn't wipe out
+    the last one's logs.
+
     @param filename String indicating name of the log file to output
     @param directory String indicating directory where to output the log file
     @param level String indicating the log level to use
+    @param max_bytes Int size at which to rotate the log file, 0 means never.
+    @param backups Int rotated log files to keep.
+    @param log_format String 'text', or 'json' for JSON lines (see
+        JSONFormatter).
+    @return logging.handlers.QueueListener, which has to be stopped before
+        exiting, so that the queued records are written.
 
     @throws InvalidLogLevelError whenever the inputted level is invalid.
 
@@ -417,6 +1080,9 @@ def setupLogging(directory, filename, level):
     @date Nov 10, 2010
     @author Matthew Todd
     '''
+    import logging.handlers
+    import queue
+
     class InvalidLogLevelError(Exception):
         '''
         Invalid log level.
@@ -431,6 +1097,19 @@ def setupLogging(directory, filename, level):
         def __repr__(self):
             return str(self)
 
+    class DeferredQueueHandler(logging.handlers.QueueHandler):
+        '''
+        Queues records without formatting them (QueueHandler.prepare() would),
+        so the formatting happens in the listener's thread too.
+        '''
+        def prepare(self, record):
+            import copy
+
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            return record
+
     log_file = os.path.abspath(os.path.join(directory, filename))
 
     level = level.upper()
@@ -449,14 +1128,62 @@ def setupLogging(directory, filename, level):
     else:
         raise InvalidLogLevelError(level)
 
+    handler = logging.handlers.RotatingFileHandler(log_file, 'a', max_bytes, backups)
+    if log_format == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("[%(module)s - %(levelname)s]\t %(message)s")
+    handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.listener = listener
+
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
-    handler = logging.FileHandler(log_file, 'w')
-    formatter = logging.Formatter("[%(module)s - %(levelname)s]\t %(message)s")
-    handler.setFormatter(formatter)
-    root_logger.addHandler(handler)
+    root_logger.addHandler(queue_handler)
+    listener.start()
 
     root_logger.info("Logger created: %s" % time.asctime())
+    return listener
+
+def setup_worker():
+    '''
+    Sets up a worker process forked from us (see run_roots()): its logging
+    (see setup_worker_logging()), and when it's terminated (the pool is, at
+    the roots timeout) the commands it's running are killed first, rather
+    than left running as orphans.
+
+    @date Oct 17, 2026
+    '''
+    import signal
+
+    def terminate(signum, frame):
+        kill_running_groups()
+        sys.exit(ERROR_CODES['default'])
+
+    setup_worker_logging()
+    signal.signal(signal.SIGTERM, terminate)
+
+def setup_worker_logging():
+    '''
+    Logging for a worker process forked from us (see run_roots()). The
+    QueueListener's thread doesn't survive the fork, so the worker writes
+    straight to the listener's handlers instead, and leaves rotating the log
+    file to the parent.
+
+    @date Oct 17, 2026
+    '''
+    root_logger = logging.getLogger()
+    for queue_handler in list(root_logger.handlers):
+        listener = getattr(queue_handler, 'listener', None)
+        if listener is None:
+            continue
+        root_logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            handler.maxBytes = 0
+            root_logger.addHandler(handler)
 
 def compute_log_dir(log_dir, base_dir):
     '''
@@ -473,325 +1200,3268 @@ def compute_log_dir(log_dir, base_dir):
     @date Feb 11, 2011
     @author Matthew Todd
     '''
-    if options.log_dir != None:
-        return options.log_dir
+    if log_dir != None:
+        return log_dir
     else:
-        return options.base_dir
+        return base_dir
 
-# we do this here b/c it makes sense for the logger to be available to all funcs,
-#  without having to pass it to each one
-setupLogging(compute_log_dir(options.log_dir, options.base_dir), options.log_file, options.log_level)
+# the logger is available to all funcs, without having to pass it to each one.
+# It isn't setup here (main() does that), so importing this module doesn't
+# touch the application's logging.
 log = logging.getLogger(__name__)
 
-log.info("options = %r, args = %r" % (options, args))           # never know when we might need this info
+# the process groups of the commands running with a timeout (see
+# run_command()), so that they can be killed if we're terminated
+running_groups = set()
+
+# the threads of the checks build_within_deadline() gave up on, which may
+# still be winding down (see wait_for_abandoned_checks())
+abandoned_checks = []
 
 
 ###
-#### decorators
+#### templates
 ###
-
-def option_no_root(f):
+def template_placeholders(template):
     '''
-    Decorator that handles no root option stuff.
+    The names of the placeholders used in the template.
 
-    If no_root it set, then we're not going to use f(). Instead we'll log that
-    its not being run due to insufficient privileges and return None. If
-    no_root is not set, then we'll just run f normally.
-
-    This way we only check no_root once, during decoration. So we can call a
-    decorated function many times without having to waste time checking. Also,
-    its much easier to add the no_root check to functions as we just decorate
-    them.
-
-    Uses options.no_root
-
-    @note
-    This decorator will prevent the entire function from running based on
-    the value of no_root. This requires that everything in the function
-    shouldn't run if it is set. Therefore functions decorated with this
-    decorator should be sufficiently small/precise as to only contain that
-    which requires root privileges and its immediately related code.
-
-    @param f function to decorate
-    @date Mar 23, 2011
-    @author Matthew Todd
+    @param template String the output template.
+    @throws ValueError if the template isn't a valid format string.
+    @return set of Strings
+    @date Oct 17, 2026
     '''
-    if options.no_root:
-        def g(*args):
-            log.info("not running '%s' b/c of insufficient privileges (no_root)." % f.__name__)
-            return None
-        return g
+    import string
 
-    else:
-        return f
+    names = set()
+    for _, field_name, _, _ in string.Formatter().parse(template):
+        if field_name:
+            names.add(re.split('[.[]', field_name, 1)[0])
+    return names
 
-###
-#### helper functions
-###
-def write_msg(filename, msg, is_error):
+class Template(object):
     '''
-    This function writes out the given message to the output file.
-
-    This function truncates the output file prior to writing out the new
-    message. So the last call to this function will be overwritten. Thus if you
-    want to write out multiple pieces of data, combine them into one string and
-    then write it out using this function.
-
-    Although this may be inconvenient, as we'll have to create the full output
-    before writing, this way we can ensure that output is only outputted if its
-    supposed to be (no_error_output option). Anyways, as this program stands,
-    there is only really the need to write to file once. Plus normally
-    everything is buffered so it'll end up writing all at once to disk in the
-    end.
+    An output template, loaded and checked once and then compiled into a
+    render function.
 
-    @param filename String filename of the output file.
-    @param msg String the message to write out to the output file. This is what will
-        be displayed to the user.
-    @param is_error Boolean whether the output is an error msg. This allows us to shut
-        off error messages to the output file, should we so desire.
-    @date Jan 17, 2011
-    @author Matthew Todd
-    '''
-    if not (options.no_error_output and is_error):
-        if filename == '-':
-            print(msg)
-        else:
-            with open(filename, 'w') as f:
-                f.write(msg)
-    else:
-        log.info('not writing error to output file b/c no_error_output is set')
+    Checking happens when the template is loaded, so a template with an
+    unknown placeholder or a bad format spec is reported straight away rather
+    than as a KeyError when we try to render it. In daemon mode,
+    reload_if_changed() re-reads the file, but only if its mtime has changed.
 
-def check_network(server_address = DEFAULT_SERVER_ADDRESS):
+    @date Oct 17, 2026
     '''
-    Determine whether the network (internet) is available.
-
-    Raises an exception to signal that the network is down.
-
-    - checks routing table for default route
-    - checks if the ubuntu servers are reachable
+    def __init__(self, template_file=None, max_width=0):
+        '''
+        @param template_file String path of the template file. None means to
+            use DEFAULT_OUTPUT_TEMPLATE.
+        @param max_width Int Maximum width of all lines in the output. Values
+            <= 0 mean no wrapping.
+        @throws GenerateOutputError if the template is invalid or can't be read.
+        '''
+        self.template_file = template_file
+        self.max_width = max_width
+        self.mtime = None
+        self.load()
 
-    @note Hasn't been tested extensively due to the fact that its hard to
-    similate most condtions.
+    def load(self):
+        '''
+        (Re)loads, checks and compiles the template.
 
-    @note I'm considering removing this function b/c its not very effective.
-    Its given me several false positives and doesn't offer more than multiple
-    update checks. Please give me feedback if you have any ideas as how to make
-    it more effective or if you want me to keep it.
+        Nothing is changed if the new template is invalid.
 
-    @param server_address String the ubuntu server to check. Defaults to the main us server.
-    @throws NoNetworkError
-    @return None
-    @date Jan 27, 2011
-    @author Matthew Todd
-    '''
-    # check for default route in routing table
-    output = subprocess.getoutput('/sbin/route -n | grep -c "^0\.0\.0\.0"')
-    if int(output) == 0:
-        raise NoNetworkError("no default route in table")
+        @throws GenerateOutputError
+        '''
+        mtime = None
+        try:
+            if self.template_file:
+                with open(self.template_file, 'r') as f:
+                    mtime = os.fstat(f.fileno()).st_mtime_ns
+                    text = f.read()
+            else:
+                text = DEFAULT_OUTPUT_TEMPLATE
+
+            placeholders = template_placeholders(text)
+        except (IOError, OSError, ValueError) as e:
+            raise GenerateOutputError('invalid template %s: %s' % (self.template_file, e))
+
+        unknown = placeholders - TEMPLATE_PLACEHOLDERS
+        if unknown:
+            raise GenerateOutputError('unknown identifier/placeholder: %s' % ', '.join(sorted(unknown)))
+
+        render = self.compile(text, self.max_width)
+        try:
+            render(dict.fromkeys(TEMPLATE_PLACEHOLDERS, '0'))
+        except (ValueError, IndexError, AttributeError, KeyError) as e:
+            raise GenerateOutputError('invalid template %s: %s' % (self.template_file, e))
 
-    # ping ubuntu servers
-    ret_code, _ = subprocess.getstatusoutput('ping -q -c 3 %s' % server_address)
-    if ret_code > 0:
-        raise NoNetworkError("ping failed with return code: %d" % ret_code)
+        self.text = text
+        self.placeholders = placeholders
+        self.render = render
+        self.mtime = mtime
 
-@option_no_root
-def call_update(num_update_checks, sleep_period):
-    '''
-    Calls apt-get update.
+    @staticmethod
+    def compile(text, max_width):
+        '''
+        Compiles the template text into a render function, which takes the
+        template dict and returns the output.
+        '''
+        import textwrap
 
-    Raises an exception if the update failed.
+        format_map = text.format_map
+        if max_width > 0:
+            wrapper = textwrap.TextWrapper(width=max_width)
+            return lambda template_dict: wrapper.fill(format_map(template_dict))
+        return format_map
 
-    @param num_update_checks Int The number of times to try updating. Negative numbers are equivalent to 0.
-    @param sleep_period Int How long to sleep between update tries. Numbers <= 0 means no sleeping.
-    @throws UpdateFailedError
-    @return None
-    @date Feb 12, 2011
-    @author Matthew Todd
-    '''
-    def ordinal(num):
+    def __getstate__(self):
         '''
-        Return the ordinal of the number
+        The compiled render function can't be pickled (which the process pool
+        needs), so its left out and recompiled by __setstate__().
+        '''
+        state = self.__dict__.copy()
+        del state['render']
+        return state
 
-        Placeholder function.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.render = self.compile(self.text, self.max_width)
 
-        @date Feb 25, 2011
-        @author Matthew Todd
+    def reload_if_changed(self):
         '''
-        return num
-
-    if num_update_checks < 1:
-        log.info("number of times to update is %d (less than 1), therefore not updating" % num_update_checks)
-        return
+        Reloads the template if its file's mtime has changed since it was
+        loaded. If the new template is invalid, the old one is kept.
 
-    if sleep_period < 0:
-        sleep_period = 0
+        @return Boolean whether the template was reloaded.
+        '''
+        if not self.template_file:
+            return False
 
-    fail_count = 0
-    while True:
         try:
-            subprocess.check_call(["sudo", "apt-get", "update", "-qq"])
-            break
-        except (subprocess.CalledProcessError, OSError) as e:
-            fail_count += 1
-            log.error("update failed for %d try with: %s" % (ordinal(fail_count), e))
-
-            if fail_count >= num_update_checks:
-                raise UpdateError(e)
-
-            log.info("sleeping for %d seconds before trying to update again" % sleep_period)
-            time.sleep(sleep_period)        # sleep before trying to update again
-
-    log.info("update succeeded")
+            if os.stat(self.template_file).st_mtime_ns == self.mtime:
+                return False
+            self.load()
+        except (OSError, GenerateOutputError) as e:
+            log.error("keeping the old template, couldn't reload it: %s" % e)
+            return False
 
-def get_upgrade_output():
-    '''
-    Gets the output from the simulated upgrade.
-
-    Note that this is a SIMULATION (hence the --no-act.) Also note that this
-    doesn't use root priveleges, so its definitely not going to upgrade.
+        log.info("reloaded template %s" % self.template_file)
+        return True
 
-    @throws UpgradeSimulError
-    @return the output string from the simulated upgrade
-    @date Feb 12, 2011
-    @author Matthew Todd
+class JSONTemplate(Template):
     '''
-    try:
-        ret = subprocess.check_output(['apt-get', 'upgrade', '--no-act', '-q'])
-        return ret.decode()
-    except (subprocess.CalledProcessError, OSError) as e:
-        log.error("upgrade --no-act failed with: %s" % e)
-        raise UpgradeSimulError(e)
+    Renders all of the placeholders as a JSON object, for programs rather than
+    people to read (format=json targets).
 
-def parse_upgrade_output(upgrade_output):
+    @date Oct 17, 2026
     '''
-    Parse/screen scrape the output of the simulated upgrade.
+    def __init__(self):
+        super().__init__(None, 0)
 
-    Uses regex, hence the return type. Would like to return something that is
-    independent of implementation. But there is no reason to add extra code
-    complexity when we don't need it, so I'm going to leave this be for the
-    moment.
+    def load(self):
+        self.text = None
+        self.placeholders = TEMPLATE_PLACEHOLDERS
+        self.render = self.compile(None, 0)
 
-    @throws UpgradeOutputParseError
-    @param upgrade_output String the output from the simulated (or actual) apt-get upgrade.
-    @returns a regex-match-object
-    @date Feb 12, 2011
-    @author Matthew Todd
-    '''
-    regex = re.compile('([0-9]+) upgraded, ([0-9]+) newly installed, ([0-9]+) to remove and ([0-9]+) not upgraded.')
-    match_obj = regex.search(upgrade_output)
+    @staticmethod
+    def compile(text, max_width):
+        import json
 
-    if match_obj == None:
-       raise UpgradeOutputParseError('regex failed')
+        return lambda template_dict: json.dumps(template_dict, sort_keys=True)
 
-    return match_obj
+## One of the outputs to render a check to: the output file, its Template,
+## whether error messages should be left out of it, and its name (for --serve).
+Target = collections.namedtuple('Target', 'out_file template no_error_output name', defaults=(None,))
 
-def generate_output(template, template_dict, max_width):
+def parse_target(spec):
     '''
-    Generates the output from the given template and its dict.
+    Parses a --target: DEST[,template=FILE][,max_width=N][,format=json][,no_error_output]
 
-    @param max_width Maximum width of all lines in the output. Values <= 0 are
-        ignored, so python's default will be used instead.
-    @throws GenerateOutputError
-    @param template String the output template with placeholders (or not) to replace
-    with their proper values.
-    @param template_dict Dictionary Dictionary of template-placeholder value to use with
-    formatting the template.
-    @return the output string
-    @date Feb 12, 2011
-    @author Matthew Todd
+    @param spec String the --target value.
+    @return dict with dest, template_file, max_width, format and
+        no_error_output.
+    @throws ValueError if it isn't valid.
+    @date Oct 17, 2026
     '''
-    try:
-        out_template = get_template(options.template_file, options.base_dir)
-
-        if max_width > 0:
-            return textwrap.fill(out_template.format(**template_dict), width=max_width)
+    dest, _, rest = spec.partition(',')
+    if not dest.strip():
+        raise ValueError('no destination')
+
+    target = {'dest': dest.strip(), 'template_file': None, 'max_width': 0, 'format': 'text',
+                'no_error_output': False}
+    for item in rest.split(',') if rest else ():
+        key, has_value, value = item.partition('=')
+        key, value = key.strip(), value.strip()
+        if key == 'no_error_output' and not has_value:
+            target['no_error_output'] = True
+        elif key == 'template' and value:
+            target['template_file'] = value
+        elif key == 'max_width':
+            target['max_width'] = int(value)
+        elif key == 'format' and value in ('text', 'json'):
+            target['format'] = value
         else:
-            return out_template.format(**template_dict)
-    except KeyError as e:
-        raise GenerateOutputError('unknown identifier/placeholder: %s' % e)
+            raise ValueError('unknown target option: %s' % item)
 
-def create_template_dict(match_obj, time_format):
-    '''
-    Create the template dict to be used to substitute in real values.
+    return target
 
-    @param match_obj the regex match object from "sudo apt-get upgrade ...".
-        Contains the data to use to fill the dict.
-    @param time_format a format string to be used in formatting the time
-        placeholder. Should be of the format as described by the Python spec
-        (probably same or very similar to C spec as well.)
-    @return dictionary with the template placeholder's as keys and their
-        apporopriate values (from match_obj)
-    @param match_obj regex-match-obj the regex match object from "sudo apt-get upgrade ...". Contains the data to use
-        to fill the dict.
-    @return dictionary with the template placeholder's as keys and their apporopriate values (from match_obj)
-    @date Feb 11, 2011
-    @author Matthew Todd
+def load_targets(config, filename=None):
     '''
-    upgrade = match_obj.group(1)
-    install = match_obj.group(2)
-    remove = match_obj.group(3)
-    not_upgraded = match_obj.group(4)
-    cur_time = time.strftime(time_format)
-    upgradable = str(int(upgrade) + int(not_upgraded))
+    Loads the targets to render to: the output_file argument (with --template,
+    --max_width and --no_error_output) and then each --target.
+
+    @param config Config the settings.
+    @param filename String the output_file argument, None if it wasn't given.
+    @return List of Targets.
+    @throws GenerateOutputError if a template is invalid. Its error has
+        already been reported to that target's output file.
+    @date Oct 17, 2026
+    '''
+    specs = []
+    if filename is not None:
+        specs.append({'dest': filename, 'template_file': config.template_file, 'max_width': config.max_width,
+                        'format': 'text', 'no_error_output': config.no_error_output, 'name': 'default'})
+    specs += [parse_target(spec) for spec in config.targets or ()]
+
+    targets = []
+    for spec in specs:
+        out_file = compute_out_file(config.base_dir, spec['dest'])
+        no_error_output = spec['no_error_output'] or config.no_error_output
+        log.info("target: out_file = '%s', template = %s, format = %s"
+                    % (out_file, spec['template_file'], spec['format']))
+        try:
+            if spec['format'] == 'json':
+                template = JSONTemplate()
+            else:
+                template = Template(compute_base_file(config.base_dir, spec['template_file']), spec['max_width'])
+        except GenerateOutputError as e:
+            report_error([Target(out_file, None, no_error_output)], e)
+            raise
 
-    return { 'upgrade'      : upgrade,
-            'install'       : install,
-            'remove'        : remove,
-            'not_upgraded'  : not_upgraded,
-            'time'          : cur_time,
-            'upgradable'    : upgradable,}
+        targets.append(Target(out_file, template, no_error_output, spec.get('name', spec['dest'])))
+
+    return targets
 
 ###
-#### main
+#### helper functions
 ###
-def main():
-    '''
-    Main function.
+## how many times write_msg() has written and skipped writing the output file
+write_stats = {'written' : 0, 'skipped' : 0}
 
-    Has a default catch all except clause which logs the exception. Normally
-    catch-alls are undesired b/c it may hide/obscure problems, but b/c this
-    program is likely to be run as a cron job, we need a way to catch
-    exceptions/errors/etc for later debugging/assesing/etc.
+class Metrics(object):
+    '''
+    Timings and counters for a check, written out in the Prometheus text
+    format for node_exporter's textfile collector.
 
-    @return The exit code. The meaning of the exit code is store above near the
-    top of the file in the ERROR_CODES dictionary.
+    Counters (and the time of the last success) are carried over from the
+    file that was last written, so they keep counting across runs.
 
-    @date Feb 11, 2011
-    @author Matthew Todd
+    @date Oct 17, 2026
     '''
-    out_file = compute_out_file(options.base_dir, args[0])
-    log.info("out_file = '%s'" % out_file)
-
-    try:
-        if options.network_check:
-            check_network()
+    def __init__(self, root=None, filename=None):
+        '''
+        @param root String root directory being checked. If given, every
+            sample gets a root label, so that the files of many roots can be
+            scraped together.
+        @param filename String the metrics file, loaded now and written by
+            finish(). None means the metrics aren't written anywhere.
+        '''
+        self.labels = () if root is None else (('root', root),)
+        self.samples = collections.OrderedDict()
+        self.filename = filename
+        if filename:
+            self.load(filename)
 
-        call_update(options.num_update_checks, options.sleep_period)
+    def load(self, filename):
+        '''
+        Carries over the METRICS_KEPT samples from the last metrics file. A
+        missing or unreadable file just means starting from 0.
 
-        upgrade_output = get_upgrade_output()
+        @param filename String the metrics file.
+        '''
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    match = METRICS_SAMPLE_REGEX.match(line.strip())
+                    if match is None or not match.group(1).startswith(METRICS_PREFIX):
+                        continue
+                    name = match.group(1)[len(METRICS_PREFIX):]
+                    if name in METRICS_KEPT:
+                        labels = tuple(METRICS_LABEL_REGEX.findall(match.group(2) or ''))
+                        self.samples[(name, labels)] = float(match.group(3))
+        except (IOError, OSError, ValueError) as e:
+            log.debug("couldn't load metrics file %s: %s" % (filename, e))
+
+    def key(self, name, labels):
+        return (name, tuple(sorted(self.labels + tuple((labels or {}).items()))))
+
+    def set(self, name, value, labels=None):
+        self.samples[self.key(name, labels)] = value
+
+    def count(self, name, labels=None, n=1):
+        key = self.key(name, labels)
+        self.samples[key] = self.samples.get(key, 0) + n
+
+    def stage(self, name):
+        '''
+        Times a stage of the check, with time.monotonic(), e.g:
 
-        match_obj = parse_upgrade_output(upgrade_output)
+        @code
+        with metrics.stage('update'):
+            call_update(policy)
+        @endcode
 
-        template_dict = create_template_dict(match_obj, options.time_format)
+        @param name String the stage's name (its stage label).
+        '''
+        import contextlib
 
-        template = get_template(options.template_file, options.base_dir)
+        @contextlib.contextmanager
+        def timer():
+            start = time.monotonic()
+            try:
+                yield
+            finally:
+                self.count('stage_duration_seconds', {'stage': name}, time.monotonic() - start)
 
-        output = generate_output(template, template_dict, options.max_width)
+        return timer()
 
-        write_msg(out_file, output, is_error=False)
+    def render(self):
+        '''
+        @return String the samples in the Prometheus text format.
+        '''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+        for name in sorted(METRICS):
+            samples = [(labels, value) for (sample_name, labels), value in self.samples.items()
+                        if sample_name == name]
+            if not samples:
+                continue
+
+            kind, help_text = METRICS[name]
+            lines.append('# HELP %s%s %s' % (METRICS_PREFIX, name, help_text))
+            lines.append('# TYPE %s%s %s' % (METRICS_PREFIX, name, kind))
+            for labels, value in sorted(samples):
+                label_text = ','.join('%s="%s"' % (label, escape(label_value)) for label, label_value in labels)
+                lines.append('%s%s%s %s' % (METRICS_PREFIX, name, '{%s}' % label_text if labels else '',
+                                            repr(float(value))))
+
+        return '\n'.join(lines) + '\n'
+
+    def finish(self, ret):
+        '''
+        Records how the check ended and writes the metrics out, if there is a
+        metrics file.
 
-        log.info('normal exit: %s' % time.asctime())
-        return NO_ERROR
+        @param ret Int the check's exit code.
+        '''
+        if self.filename:
+            self.count('runs_total')
+            self.set('exit_code', ret)
+            self.set('last_run_timestamp_seconds', time.time())
+            self.write(self.filename)
 
-    except CustomException as e:
-        log.exception(e)
-        write_msg(out_file, ERROR_MSGS[e.key], is_error=True)
-        return ERROR_CODES[e.key]
+    def write(self, filename):
+        '''
+        Writes the metrics out with atomic_write(), so the collector never
+        reads half of them. Failing to write them isn't an error, it just gets
+        logged.
+
+        @param filename String the metrics file.
+        '''
+        try:
+            atomic_write(filename, self.render())
+        except (IOError, OSError) as e:
+            log.warning("couldn't write metrics file %s: %s" % (filename, e))
+
+class Watcher(object):
+    '''
+    Watches the local package state with inotify (through ctypes, as there is
+    no inotify in the standard library): dpkg's status file and locks, and
+    apt's lists.
+
+    Directories are watched rather than the files, as dpkg and apt replace
+    their files by renaming new ones over them.
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, roots=(None,)):
+        '''
+        @param roots List of the root directories to watch (see rooted()).
+            None is the running system.
+        @throws OSError if inotify isn't available.
+        '''
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        dpkg_names = frozenset(os.path.basename(path) for path in
+                                (DPKG_STATUS_FILE, DPKG_LOCK_FILE, DPKG_FRONTEND_LOCK_FILE))
+        self.watches = {}       # watch descriptor -> (directory, names we care about, None for all)
+        for root in roots:
+            for directory, names in ((os.path.dirname(rooted(root, DPKG_STATUS_FILE)), dpkg_names),
+                                     (rooted(root, APT_LISTS_DIR), None)):
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                            IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+                if wd < 0:
+                    log.warning("can't watch %s: %s" % (directory, os.strerror(ctypes.get_errno())))
+                    continue
+                self.watches[wd] = (directory, names)
+                log.info("watching %s" % directory)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        '''
+        Reads the pending events, without blocking.
+
+        @return List of Strings, the changed paths we care about.
+        '''
+        import struct
+
+        changed = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += 16 + length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed.append('(overflow)')
+                elif wd in self.watches:
+                    directory, names = self.watches[wd]
+                    if (names is None and name not in ('lock', 'partial')) or (names is not None and name in names):
+                        changed.append(os.path.join(directory, name))
+
+    def wait(self, timeout):
+        '''
+        Waits up to timeout seconds for the package state to change, and then
+        for the changes to stop (WATCH_DEBOUNCE seconds without any).
+
+        @param timeout Float seconds.
+        @return Boolean whether it changed (False means the timeout passed).
+        '''
+        import select
+
+        deadline = time.monotonic() + timeout
+        changed = []
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                return False
+            changed = self.read()
+
+        while select.select([self.fd], [], [], WATCH_DEBOUNCE)[0]:
+            changed += self.read()
+
+        log.info("package state changed: %s" % ', '.join(sorted(set(changed))))
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+class Flight(object):
+    '''
+    Single-flight coordination of overlapping runs through a shared file: the
+    first run to take the file's lock (flock on filename.lock) does the check
+    and shares its result, and the runs that come along while it's in
+    progress wait for it and reuse the result rather than doing their own.
+
+    @code
+    flight = Flight(filename, wait)
+    try:
+        shared = flight.join(placeholders)
+        if shared is None:
+            # check, then flight.share(...)
+    finally:
+        flight.close()
+    @endcode
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, filename, wait=DEFAULT_FLIGHT_WAIT):
+        '''
+        @param filename String the file the result is shared in.
+        @param wait Int seconds to wait for a check in progress.
+        '''
+        self.filename = filename
+        self.wait = wait
+        self.lock = None
+
+    def join(self, placeholders):
+        '''
+        Takes the lock, waiting (up to wait) for the check in progress, if
+        there is one, to finish.
+
+        @param placeholders Set of the placeholders we're going to render,
+            the shared template dict has to have been built for them.
+        @return (UpgradeCounts, template dict, security count or None) tuple
+            that the check we waited for shared, or None if we have to check
+            ourselves.
+        '''
+        import fcntl
+
+        start = time.time()
+        deadline = time.monotonic() + max(self.wait, 0)
+        try:
+            self.lock = open(self.filename + '.lock', 'a')
+        except (IOError, OSError) as e:
+            log.warning("couldn't open %s.lock, not sharing results: %s" % (self.filename, e))
+            return None
+
+        waited = False
+        while True:
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                pass
+            if not waited:
+                log.info("a check is already in progress, waiting up to %d seconds for it" % self.wait)
+                waited = True
+            if time.monotonic() >= deadline:
+                log.warning("gave up waiting for the check in progress, checking ourselves")
+                return None
+            time.sleep(FLIGHT_POLL_PERIOD)
+
+        if not waited:
+            return None
+        shared = load_shared_result(self.filename)
+        if shared is not None and shared['time'] >= start and placeholders <= shared['placeholders']:
+            log.info("reusing the result of the check in progress")
+            return shared['counts'], shared['template_dict'], shared['security']
+        log.info("the check in progress didn't leave a result we can use, checking ourselves")
+        return None
+
+    def share(self, counts, template_dict, placeholders, security=None):
+        '''
+        Shares our result with the runs waiting for it, see
+        save_shared_result().
+        '''
+        save_shared_result(self.filename, counts, template_dict, placeholders, security)
+
+    def close(self):
+        '''
+        Releases the lock (if we have it), letting the next run in.
+        '''
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+def atomic_write(filename, data):
+    '''
+    Replaces the file's contents with data, atomically.
+
+    data is written to a temporary file in the same directory, synced to disk
+    and then renamed over the file, so readers (conky, etc.) see either the
+    old contents or the new, never a half written file. The file keeps its
+    permissions (and owner, if we're root).
+
+    @param filename String the file to write.
+    @param data String what to write to it.
+    @throws IOError, OSError
+    @date Oct 17, 2026
+    '''
+    import tempfile
+
+    directory, basename = os.path.split(os.path.abspath(filename))
+    fd, temp_file = tempfile.mkstemp(prefix='.%s.' % basename, suffix='.tmp', dir=directory)
+    try:
+        try:
+            st = os.stat(filename)
+            os.fchmod(fd, st.st_mode & 0o7777)
+            if os.geteuid() == 0:
+                os.fchown(fd, st.st_uid, st.st_gid)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.fchmod(fd, 0o666 & ~umask)
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, filename)
+    except:
+        os.unlink(temp_file)
+        raise
+
+def file_digest(filename):
+    '''
+    The sha256 digest of the file's contents, or None if it can't be read.
+
+    @date Oct 17, 2026
+    '''
+    import hashlib
+
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+    except (IOError, OSError):
+        return None
+
+def write_msg(filename, msg, is_error, no_error_output=False):
+    '''
+    This function writes out the given message to the output file.
+
+    This function replaces the output file's contents with the new message. So
+    the last call to this function will be overwritten. Thus if you want to
+    write out multiple pieces of data, combine them into one string and then
+    write it out using this function.
+
+    The file is written with atomic_write(), and only if the message differs
+    from what is already in the file. Rewriting identical content would just
+    wake up everything watching the file.
+
+    Although this may be inconvenient, as we'll have to create the full output
+    before writing, this way we can ensure that output is only outputted if its
+    supposed to be (no_error_output option). Anyways, as this program stands,
+    there is only really the need to write to file once. Plus normally
+    everything is buffered so it'll end up writing all at once to disk in the
+    end.
+
+    @param filename String filename of the output file.
+    @param msg String the message to write out to the output file. This is what will
+        be displayed to the user.
+    @param is_error Boolean whether the output is an error msg. This allows us to shut
+        off error messages to the output file, should we so desire.
+    @param no_error_output Boolean don't write error messages to the output file.
+    @date Jan 17, 2011
+    @author Matthew Todd
+    '''
+    import hashlib
+
+    if not (no_error_output and is_error):
+        if filename == '-':
+            print(msg, flush=True)
+        elif file_digest(filename) == hashlib.sha256(msg.encode()).digest():
+            write_stats['skipped'] += 1
+            log.info("output unchanged, not rewriting '%s' (skipped writes: %d, writes: %d)"
+                        % (filename, write_stats['skipped'], write_stats['written']))
+        else:
+            atomic_write(filename, msg)
+            write_stats['written'] += 1
+            log.info("wrote '%s' (skipped writes: %d, writes: %d)"
+                        % (filename, write_stats['skipped'], write_stats['written']))
+    else:
+        log.info('not writing error to output file b/c no_error_output is set')
+
+def has_default_route(route_file=PROC_NET_ROUTE, ipv6_route_file=PROC_NET_IPV6_ROUTE):
+    '''
+    Whether the kernel's routing table has a default route that is up, read
+    straight from /proc rather than running route.
+
+    @param route_file String path of the IPv4 routing table.
+    @param ipv6_route_file String path of the IPv6 routing table.
+    @return Boolean
+    @date Oct 17, 2026
+    '''
+    RTF_UP = 0x1
+
+    try:
+        with open(route_file, 'r') as f:
+            next(f, None)                       # header
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 8 and fields[1] == '00000000' and fields[7] == '00000000' \
+                        and int(fields[3], 16) & RTF_UP:
+                    return True
+    except (IOError, OSError, ValueError) as e:
+        log.debug("couldn't read %s: %s" % (route_file, e))
+
+    try:
+        with open(ipv6_route_file, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 10 and fields[0] == '0' * 32 and fields[1] == '00' \
+                        and fields[9] != 'lo' and int(fields[8], 16) & RTF_UP:
+                    return True
+    except (IOError, OSError, ValueError) as e:
+        log.debug("couldn't read %s: %s" % (ipv6_route_file, e))
+
+    return False
+
+def source_mirrors(sources):
+    '''
+    The host:port of each http(s) source, for the network check.
+
+    @param sources List of (uri, suite) tuples, see read_apt_sources().
+    @return list of Strings
+    @date Oct 17, 2026
+    '''
+    import urllib.parse
+
+    mirrors = []
+    for uri, _ in sources:
+        parts = urllib.parse.urlsplit(uri)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            continue
+
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+        except ValueError:
+            continue
+
+        host = '[%s]' % parts.hostname if ':' in parts.hostname else parts.hostname
+        mirror = '%s:%d' % (host, port)
+        if mirror not in mirrors:
+            mirrors.append(mirror)
+
+    return mirrors
+
+def probe_mirrors(mirrors, timeout):
+    '''
+    Races TCP connections to all of the mirrors at once, name resolution
+    included, all under the same overall timeout, and stops as soon as one of
+    them connects.
+
+    Names are resolved on daemon threads, so a resolver that hangs past the
+    timeout is simply abandoned rather than holding up the check (or exit).
+
+    @param mirrors List of Strings, host or host:port (port defaults to 80).
+    @param timeout Float seconds to wait for a connection.
+    @return dict of mirror -> latency in seconds, None if it wasn't reached
+        (it failed, timed out or was abandoned once another one connected).
+    @date Oct 17, 2026
+    '''
+    import asyncio
+    import socket
+    import threading
+
+    def resolve(loop, host, port):
+        future = loop.create_future()
+
+        def settle(result, error):
+            if not future.done():
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+        def run():
+            try:
+                result, error = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM), None
+            except (OSError, UnicodeError) as e:
+                result, error = None, e
+
+            try:
+                loop.call_soon_threadsafe(settle, result, error)
+            except RuntimeError:
+                pass                            # the probe's already over
+
+        threading.Thread(target=run, name='resolve %s' % host, daemon=True).start()
+        return future
+
+    async def connect(mirror):
+        host, sep, port = mirror.rpartition(':')
+        if not sep or not port.isdigit():
+            host, port = mirror, '80'
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            addresses = await resolve(loop, host.strip('[]'), int(port))
+            error = None
+            for family, type_, proto, _, address in addresses:
+                with socket.socket(family, type_, proto) as sock:
+                    sock.setblocking(False)
+                    try:
+                        await loop.sock_connect(sock, address)
+                        return loop.time() - start
+                    except OSError as e:
+                        error = e
+            raise error or OSError("no addresses")
+        except (OSError, UnicodeError, ValueError) as e:
+            log.debug("couldn't connect to %s: %s" % (mirror, e))
+            return None
+
+    async def race():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        tasks = dict((asyncio.ensure_future(connect(mirror)), mirror) for mirror in mirrors)
+        latencies = dict.fromkeys(mirrors)
+
+        pending = set(tasks)
+        while pending and loop.time() < deadline:
+            done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(),
+                                                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                latencies[tasks[task]] = task.result()
+            if any(latency is not None for latency in latencies.values()):
+                break
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        return latencies
+
+    if not mirrors:
+        return {}
+
+    return asyncio.run(race())
+
+def check_network(mirrors, timeout=DEFAULT_NETWORK_TIMEOUT,
+                    route_file=PROC_NET_ROUTE, ipv6_route_file=PROC_NET_IPV6_ROUTE):
+    '''
+    Determine whether the network (internet) is available.
+
+    Raises an exception to signal that the network is down.
+
+    - checks routing table for default route
+    - checks if any of the mirrors accept a TCP connection
+
+    Everything is done in process (no route or ping), and the mirrors are all
+    tried at once, so a healthy network is confirmed in about one round trip.
+    Using TCP rather than ICMP means networks that block ping aren't reported
+    as down.
+
+    @param mirrors List of Strings, the mirrors (host or host:port) to try.
+        Empty means DEFAULT_SERVER_ADDRESS.
+    @param timeout Float seconds the whole check may take.
+    @param route_file String path of the IPv4 routing table.
+    @param ipv6_route_file String path of the IPv6 routing table.
+    @throws NoNetworkError
+    @return dict of mirror -> latency in seconds (or None), see probe_mirrors().
+    @date Jan 27, 2011
+    @author Matthew Todd
+    '''
+    if not has_default_route(route_file, ipv6_route_file):
+        raise NoNetworkError("no default route in table")
+
+    latencies = probe_mirrors(mirrors or [DEFAULT_SERVER_ADDRESS], timeout)
+    for mirror, latency in sorted(latencies.items()):
+        if latency is None:
+            log.info("mirror %s: not reached" % mirror)
+        else:
+            log.info("mirror %s: connected in %.1f ms" % (mirror, latency * 1000))
+
+    if not any(latency is not None for latency in latencies.values()):
+        raise NoNetworkError("none of the mirrors could be reached within %g seconds" % timeout)
+
+    return latencies
+
+def read_apt_sources(sources_list=APT_SOURCES_LIST, sources_parts=APT_SOURCES_PARTS):
+    '''
+    Reads the apt sources (sources.list and sources.list.d) and returns the
+    archives that apt-get update will download Release files for.
+
+    Both the one line format (*.list) and the deb822 format (*.sources) are
+    understood. deb and deb-src lines for the same archive share a Release
+    file, so each (uri, suite) pair is only returned once.
+
+    @param sources_list String path of the main sources.list.
+    @param sources_parts String directory of the additional source files.
+    @return list of (uri, suite) tuples, in the order apt reads them.
+    @date Oct 17, 2026
+    '''
+    import glob
+
+    def one_line_sources(f):
+        for line in f:
+            words = line.split('#', 1)[0].split()
+            if len(words) < 3 or words[0] not in ('deb', 'deb-src'):
+                continue
+
+            words = words[1:]
+            if words[0].startswith('['):
+                while words and not words[0].endswith(']'):
+                    words.pop(0)
+                words = words[1:]
+
+            if len(words) >= 2:
+                yield (words[0], words[1])
+
+    def deb822_sources(f):
+        for stanza in f.read().split('\n\n'):
+            fields = {}
+            for line in stanza.splitlines():
+                if line.startswith('#') or line[:1].isspace() or ':' not in line:
+                    continue
+                key, value = line.split(':', 1)
+                fields[key.strip().lower()] = value.split()
+
+            if fields.get('enabled', ['yes'])[0].lower() == 'no':
+                continue
+            for uri in fields.get('uris', []):
+                for suite in fields.get('suites', []):
+                    yield (uri, suite)
+
+    files = [(sources_list, one_line_sources)]
+    files += [(path, one_line_sources) for path in sorted(glob.glob(os.path.join(sources_parts, '*.list')))]
+    files += [(path, deb822_sources) for path in sorted(glob.glob(os.path.join(sources_parts, '*.sources')))]
+
+    sources = []
+    for path, reader in files:
+        try:
+            with open(path, 'r') as f:
+                for source in reader(f):
+                    if source not in sources:
+                        sources.append(source)
+        except (IOError, OSError) as e:
+            log.debug("couldn't read sources from %s: %s" % (path, e))
+
+    return sources
+
+def release_url(uri, suite, name):
+    '''
+    The url of a Release file (InRelease, Release) of the given archive.
+
+    Suites ending in a slash are flat repositories, which don't have a dists
+    directory.
+
+    @param uri String the archive's uri, as given in sources.list.
+    @param suite String the suite (distribution) of the archive.
+    @param name String the Release file's name.
+    @date Oct 17, 2026
+    '''
+    if not uri.endswith('/'):
+        uri += '/'
+
+    if suite.endswith('/'):
+        return uri + suite + name
+    return uri + 'dists/' + suite + '/' + name
+
+def apt_list_file_name(url):
+    '''
+    The name apt gives to the file in APT_LISTS_DIR downloaded from url.
+
+    Mirrors apt's URItoFileName(): the scheme and any user/password are
+    dropped, special characters are %-quoted, and slashes become underscores.
+
+    @param url String the url the file was downloaded from.
+    @date Oct 17, 2026
+    '''
+    import urllib.parse
+
+    parts = urllib.parse.urlsplit(url)
+    name = parts.netloc.rsplit('@', 1)[-1] + parts.path
+
+    quoted = []
+    for c in name:
+        if c in '\\|{}[]<>"^~_=!@#$%^&*' or ord(c) <= 0x20 or ord(c) >= 0x7F:
+            quoted.append('%%%02x' % ord(c))
+        else:
+            quoted.append(c)
+
+    return ''.join(quoted).replace('/', '_')
+
+def probe_source(uri, suite, lists_dir, timeout):
+    '''
+    Checks whether an archive's Release file has changed upstream since apt
+    last downloaded it.
+
+    apt sets the mtime of the files it downloads to the server's Last-Modified
+    time, so we send that back as If-Modified-Since in a HEAD request. Servers
+    that ignore the condition still give us Last-Modified to compare against.
+
+    Anything we can't probe (no cached Release file, not http, probe fails) is
+    treated as changed, as skipping a needed update is worse than running an
+    unneeded one.
+
+    @param uri String the archive's uri, as given in sources.list.
+    @param suite String the suite (distribution) of the archive.
+    @param lists_dir String directory where apt keeps the downloaded files.
+    @param timeout Int seconds to wait for the server.
+    @return None if unchanged, otherwise a String saying why it needs refreshing.
+    @date Oct 17, 2026
+    '''
+    import email.utils
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    if urllib.parse.urlsplit(uri).scheme not in ('http', 'https'):
+        return 'cannot probe %s sources' % urllib.parse.urlsplit(uri).scheme
+
+    for name in ('InRelease', 'Release'):
+        url = release_url(uri, suite, name)
+        local_file = os.path.join(lists_dir, apt_list_file_name(url))
+        if os.path.exists(local_file):
+            break
+    else:
+        return 'no cached Release file'
+
+    local_mtime = os.stat(local_file).st_mtime
+    request = urllib.request.Request(url, method='HEAD',
+                headers={'If-Modified-Since' : email.utils.formatdate(local_mtime, usegmt=True)})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            last_modified = response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        return 'HTTP error %d' % e.code
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return 'probe failed: %s' % e
+
+    if last_modified:
+        try:
+            if email.utils.parsedate_to_datetime(last_modified).timestamp() <= local_mtime:
+                return None
+        except (TypeError, ValueError):
+            pass
+
+    return 'modified upstream'
+
+def changed_sources(sources, lists_dir=APT_LISTS_DIR, timeout=DEFAULT_PROBE_TIMEOUT):
+    '''
+    Probes all of the sources (concurrently) and returns those that need
+    refreshing. Logs which sources triggered the refresh.
+
+    @param sources List of (uri, suite) tuples, see read_apt_sources().
+    @param lists_dir String directory where apt keeps the downloaded files.
+    @param timeout Int seconds to wait for each server.
+    @return list of (uri, suite, reason) tuples. Empty if nothing changed.
+    @date Oct 17, 2026
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not sources:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(8, len(sources))) as executor:
+        reasons = list(executor.map(lambda source: probe_source(source[0], source[1], lists_dir, timeout), sources))
+
+    changed = []
+    for (uri, suite), reason in zip(sources, reasons):
+        if reason is None:
+            log.debug("source unchanged: %s %s" % (uri, suite))
+        else:
+            log.info("source triggered refresh: %s %s (%s)" % (uri, suite, reason))
+            changed.append((uri, suite, reason))
+
+    return changed
+
+class RetryPolicy(object):
+    '''
+    How to retry apt-get update: how many tries, exponential backoff with
+    jitter between them, and an overall deadline.
+
+    The deadline clock starts when the policy is created.
+
+    @date Oct 17, 2026
+    '''
+    def __init__(self, attempts, sleep_period, backoff_factor=2.0,
+                    max_sleep_period=DEFAULT_MAX_SLEEP_PERIOD, jitter=True, deadline=0):
+        '''
+        @param attempts Int the max number of tries.
+        @param sleep_period Int seconds to sleep after the first failure.
+            Numbers <= 0 means no sleeping.
+        @param backoff_factor Float how much longer each sleep is than the last.
+        @param max_sleep_period Int the longest sleep.
+        @param jitter Boolean whether to sleep a random amount between half and
+            all of the backoff.
+        @param deadline Int seconds all of the tries may take. <= 0 means no
+            deadline.
+        '''
+        self.attempts = attempts
+        self.sleep_period = max(sleep_period, 0)
+        self.backoff_factor = max(backoff_factor, 1.0)
+        self.max_sleep_period = max_sleep_period
+        self.jitter = jitter
+        self.deadline = time.monotonic() + deadline if deadline > 0 else None
+
+    def delay(self, failures):
+        '''
+        How long to sleep after the given number of failures.
+        '''
+        import random
+
+        delay = min(self.max_sleep_period, self.sleep_period * self.backoff_factor ** (failures - 1))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+    def remaining(self):
+        '''
+        Seconds until the deadline, or None if there isn't one.
+        '''
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
+
+def classify_update_failure(ret_code, stderr):
+    '''
+    Whether a failed apt-get update is worth retrying.
+
+    Anything we don't recognise as permanent is assumed to be transient
+    (mirror down, dns failure, hash sum mismatch mid-sync, etc.)
+
+    @param ret_code Int the exit status of sudo apt-get update.
+    @param stderr String what it wrote to stderr.
+    @return 'permanent', 'locked' (something else holds the apt/dpkg locks) or
+        'transient'
+    @date Oct 17, 2026
+    '''
+    if ret_code in (126, 127):              # couldn't run the command at all
+        return 'permanent'
+    if any(error in stderr for error in PERMANENT_UPDATE_ERRORS):
+        return 'permanent'
+    if any(error in stderr for error in LOCK_UPDATE_ERRORS):
+        return 'locked'
+    return 'transient'
+
+def lock_holder(lock_file, proc_locks=PROC_LOCKS):
+    '''
+    Who holds the (fcntl) lock on lock_file, which is how apt and dpkg lock.
+
+    The holder is looked up in the kernel's list of locks by the file's
+    device and inode, so the lock files needn't be readable (apt's and dpkg's
+    are root's, 0640). Where there's no such list, the lock is probed with
+    F_GETLK instead, which does need to open the file. Either way the lock is
+    only looked at, never taken, so we can't get in the way of whoever wants
+    it next. If the file is missing, or we can't look at all, the lock is
+    taken to be free and apt-get gets to find out for itself.
+
+    @param lock_file String path of the lock file.
+    @param proc_locks String path of the kernel's list of locks.
+    @return Int pid of the process holding the lock, or None if it's free.
+    @date Oct 17, 2026
+    '''
+    try:
+        st = os.stat(lock_file)
+    except OSError as e:
+        log.debug("couldn't probe lock %s: %s" % (lock_file, e))
+        return None
+
+    device = '%02x:%02x:%d' % (os.major(st.st_dev), os.minor(st.st_dev), st.st_ino)
+    try:
+        with open(proc_locks, 'r') as f:
+            for line in f:
+                # e.g: 1: POSIX  ADVISORY  WRITE 1234 fd:00:131074 0 EOF, the
+                # processes waiting on a lock being listed after it with "->"
+                fields = line.split()
+                if len(fields) >= 6 and fields[1] != '->' and fields[5] == device:
+                    return int(fields[4])
+        return None
+    except (IOError, OSError, ValueError) as e:
+        log.debug("couldn't read %s: %s" % (proc_locks, e))
+
+    return probe_lock(lock_file)
+
+def probe_lock(lock_file):
+    '''
+    Who holds the (fcntl) lock on lock_file, by asking with F_GETLK, for where
+    lock_holder() can't read the kernel's list of locks.
+
+    @param lock_file String path of the lock file.
+    @return Int pid of the process holding the lock, or None if it's free (or
+        we can't tell).
+    @date Oct 17, 2026
+    '''
+    import fcntl
+    import struct
+
+    try:
+        fd = os.open(lock_file, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError as e:
+        log.warning("couldn't probe lock %s, taking it to be free: %s" % (lock_file, e))
+        return None
+    try:
+        # struct flock: l_type, l_whence, l_start, l_len, l_pid
+        flock = struct.pack('hhqqi', fcntl.F_WRLCK, os.SEEK_SET, 0, 0, 0)
+        lock_type, _, _, _, pid = struct.unpack('hhqqi', fcntl.fcntl(fd, fcntl.F_GETLK, flock))
+    except OSError as e:
+        log.warning("couldn't probe lock %s, taking it to be free: %s" % (lock_file, e))
+        return None
+    finally:
+        os.close(fd)
+    return None if lock_type == fcntl.F_UNLCK else pid
+
+def process_name(pid):
+    '''
+    Name of the process, for the logs. Falls back to its pid.
+    '''
+    try:
+        with open('/proc/%d/comm' % pid) as comm:
+            return '%s (pid %d)' % (comm.read().strip(), pid)
+    except (IOError, OSError):
+        return 'pid %d' % pid
+
+def wait_for_locks(lock_files, timeout):
+    '''
+    Waits until none of the lock files are held, or the timeout runs out.
+
+    @param lock_files List of Strings paths of the lock files.
+    @param timeout Number seconds to wait. <= 0 means just look once.
+    @return None if all the locks are free, otherwise a description of the
+        one still held (e.g: "/var/lib/apt/lists/lock held by apt-get (pid 12)")
+    @date Oct 17, 2026
+    '''
+    deadline = time.monotonic() + max(timeout, 0)
+    logged = set()
+    while True:
+        for lock_file in lock_files:
+            pid = lock_holder(lock_file)
+            if pid is not None:
+                break
+        else:
+            return None
+
+        held = "%s held by %s" % (lock_file, process_name(pid))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return held
+        if held not in logged:
+            log.info("%s, waiting up to %.0f seconds for it" % (held, remaining))
+            logged.add(held)
+        time.sleep(min(LOCK_POLL_PERIOD, remaining))
+
+def kill_group(pgid):
+    '''
+    Kills a process group (with SIGKILL), if it's still there.
+
+    @param pgid Int the process group id, the pid of its leader.
+    @date Oct 17, 2026
+    '''
+    import signal
+
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def kill_running_groups():
+    '''
+    Kills the process groups of all the commands still running with a
+    timeout (see run_command()), when we're terminated or give up on a check.
+
+    @date Oct 17, 2026
+    '''
+    for pgid in list(running_groups):
+        log.warning("killing process group %d" % pgid)
+        kill_group(pgid)
+
+def run_command(args, timeout=None, **kwargs):
+    '''
+    Runs a command to completion, like subprocess.run().
+
+    With a timeout, the command is started in a session (and so a process
+    group) of its own, and when the timeout runs out the whole group is
+    killed, not just the command: sudo doesn't pass SIGKILL on to apt-get,
+    and apt-get's download methods would be left behind. Note that in a
+    session of its own, sudo can't ask for a password.
+
+    @param args List of Strings, the command.
+    @param timeout Number seconds it may take, None means no limit.
+    @param kwargs passed on to subprocess.Popen.
+    @throws subprocess.TimeoutExpired, OSError
+    @return subprocess.CompletedProcess
+    @date Oct 17, 2026
+    '''
+    import subprocess
+
+    child = subprocess.Popen(args, start_new_session=timeout is not None, **kwargs)
+    if timeout is not None:
+        running_groups.add(child.pid)
+    try:
+        stdout, stderr = child.communicate(timeout=timeout)
+    except BaseException:
+        if timeout is not None:
+            kill_group(child.pid)
+        else:
+            child.kill()
+        child.communicate()
+        raise
+    finally:
+        running_groups.discard(child.pid)
+
+    return subprocess.CompletedProcess(args, child.returncode, stdout, stderr)
+
+def call_update(policy, apt_options=(), metrics=None, lock_files=(), lock_timeout=0,
+                skip_if_locked=False):
+    '''
+    Calls apt-get update.
+
+    Raises an exception if the update failed. Transient failures are retried
+    according to policy, permanent ones aren't. If the policy's deadline is
+    reached, we give up on updating without raising, and the package lists
+    from the last good update get used instead.
+
+    Before each try, we wait (up to lock_timeout) for the lock files to be
+    free, rather than have apt-get fail on them and sleep. If they're still
+    held, that's a LockContentionError, or with skip_if_locked, the lists
+    from the last good update get used. If apt-get fails on a lock anyway
+    (something took it first), the next try waits on the lock rather than
+    sleeping, as long as we can see it held.
+
+    @param policy RetryPolicy how many times to try and how long to wait
+        between tries. Attempts < 1 means not to update.
+    @param apt_options List of extra options for apt-get, see apt_root_options().
+    @param metrics Metrics counts the retries and lock contention, if given.
+    @param lock_files List of Strings the apt/dpkg lock files to wait on.
+    @param lock_timeout Int seconds to wait for them.
+    @param skip_if_locked Boolean whether to skip the update, rather than
+        fail, when the locks are held.
+    @throws UpdateError, LockContentionError
+    @return True if the update succeeded, False if we fell back to the last
+        good lists (None if not updating).
+    @date Feb 12, 2011
+    @author Matthew Todd
+    '''
+    import subprocess
+
+    def ordinal(num):
+        '''
+        Return the ordinal of the number
+
+        Placeholder function.
+
+        @date Feb 25, 2011
+        @author Matthew Todd
+        '''
+        return num
+
+    if policy.attempts < 1:
+        log.info("number of times to update is %d (less than 1), therefore not updating" % policy.attempts)
+        return
+
+    def locked(held):
+        if metrics is not None:
+            metrics.count('lock_contention_total')
+        if skip_if_locked:
+            log.warning("%s, using the lists from the last good update" % held)
+            return False
+        log.error("giving up on updating: %s" % held)
+        raise LockContentionError(held)
+
+    fail_count = 0
+    while True:
+        if lock_files:
+            timeout = lock_timeout
+            remaining = policy.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+            held = wait_for_locks(lock_files, timeout)
+            if held is not None and timeout < lock_timeout:
+                log.warning("update deadline reached waiting on %s, using the lists from the last good update" % held)
+                return False
+            if held is not None:
+                return locked(held)
+
+        try:
+            result = run_command(["sudo", "apt-get"] + list(apt_options) + ["update", "-qq"],
+                                    timeout=policy.remaining(), stderr=subprocess.PIPE,
+                                    universal_newlines=True, errors='replace')
+        except subprocess.TimeoutExpired:
+            log.warning("update deadline reached during update, using the lists from the last good update")
+            return False
+        except OSError as e:
+            log.error("update failed with: %s" % e)
+            raise UpdateError(e)
+
+        if result.returncode == 0:
+            break
+
+        fail_count += 1
+        e = subprocess.CalledProcessError(result.returncode, result.args, stderr=result.stderr)
+        kind = classify_update_failure(result.returncode, result.stderr)
+        log.error("update failed for %d try (%s) with: %s\n%s" % (ordinal(fail_count), kind, e, result.stderr.strip()))
+
+        if kind == 'permanent' or fail_count >= policy.attempts:
+            if kind == 'locked':
+                return locked(result.stderr.strip())
+            raise UpdateError(e)
+        if kind == 'locked' and lock_files and wait_for_locks(lock_files, 0) is not None:
+            continue                    # lost the race for the lock, wait on it again
+
+        sleep_period = policy.delay(fail_count)
+        remaining = policy.remaining()
+        if remaining is not None and sleep_period >= remaining:
+            log.warning("update deadline reached, using the lists from the last good update")
+            return False
+
+        if metrics is not None:
+            metrics.count('update_retries_total')
+        log.info("sleeping for %.1f seconds before trying to update again" % sleep_period)
+        time.sleep(sleep_period)        # sleep before trying to update again
+
+    log.info("update succeeded")
+    return True
+
+def get_upgrade_output(apt_options=(), timeout=None):
+    '''
+    Gets the output from the simulated upgrade.
+
+    Note that this is a SIMULATION (hence the --no-act.) Also note that this
+    doesn't use root priveleges, so its definitely not going to upgrade.
+
+    This is a generator yielding the output a line at a time as apt-get writes
+    it, so the output is never buffered as a whole. If the generator is closed
+    before the output ends (we've found what we were looking for), apt-get is
+    killed rather than left to write output no one is going to read.
+
+    With a timeout, apt-get is run in a process group of its own, which is
+    killed when the timeout runs out (see run_command()).
+
+    @param apt_options List of extra options for apt-get, see apt_root_options().
+    @param timeout Number seconds apt-get may take, None means no limit.
+    @throws UpgradeSimulError, once the output ends, if apt-get failed
+    @throws DeadlineExceededError if apt-get ran out of time
+    @return generator of the output lines from the simulated upgrade
+    @date Feb 12, 2011
+    @author Matthew Todd
+    '''
+    import subprocess
+    import threading
+
+    try:
+        child = subprocess.Popen(['apt-get'] + list(apt_options) + ['upgrade', '--no-act', '-q'],
+                                    stdout=subprocess.PIPE, universal_newlines=True, errors='replace',
+                                    start_new_session=timeout is not None)
+    except OSError as e:
+        log.error("upgrade --no-act failed with: %s" % e)
+        raise UpgradeSimulError(e)
+
+    timed_out = []
+    timer = None
+    if timeout is not None:
+        def expire():
+            timed_out.append(True)
+            kill_group(child.pid)
+
+        running_groups.add(child.pid)
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+    finished = False
+    try:
+        for line in child.stdout:
+            yield line
+        finished = True
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if not finished:
+            if timeout is not None:
+                kill_group(child.pid)
+            else:
+                child.kill()
+        child.stdout.close()
+        ret_code = child.wait()
+        running_groups.discard(child.pid)
+
+    if timed_out and ret_code != 0:
+        log.error("upgrade --no-act killed after %.0f seconds" % timeout)
+        raise DeadlineExceededError('upgrade --no-act still running after %.0f seconds' % timeout)
+    if ret_code != 0:
+        e = subprocess.CalledProcessError(ret_code, child.args)
+        log.error("upgrade --no-act failed with: %s" % e)
+        raise UpgradeSimulError(e)
+
+def parse_upgrade_output(upgrade_output, need_records=True):
+    '''
+    Parse/screen scrape the output of the simulated upgrade.
+
+    Works on a stream of lines in one pass. The summary line comes before the
+    Inst/Remv lines, so if the records aren't needed, we stop reading as soon
+    as we have the summary (closing upgrade_output if its a generator, which
+    stops apt-get).
+
+    @throws UpgradeOutputParseError
+    @param upgrade_output iterable of Strings, the lines of the output from the
+        simulated (or actual) apt-get upgrade. E.g: get_upgrade_output().
+    @param need_records Boolean whether to parse the per-package records.
+    @returns (UpgradeCounts, list of PackageRecords) tuple. The records are
+        None if they weren't needed.
+    @date Feb 12, 2011
+    @author Matthew Todd
+    '''
+    lines = iter(upgrade_output)
+    try:
+        for line in lines:
+            match_obj = UPGRADE_SUMMARY_REGEX.search(line)
+            if match_obj is not None:
+                break
+        else:
+            raise UpgradeOutputParseError('regex failed')
+
+        counts = UpgradeCounts(*[int(group) for group in match_obj.groups()])
+
+        records = None
+        if need_records:
+            records = list(iter_package_records(lines))
+    finally:
+        if hasattr(lines, 'close'):
+            lines.close()
+
+    return counts, records
+
+def iter_package_records(lines):
+    '''
+    Parses the Inst and Remv lines of the simulated upgrade, yielding a
+    PackageRecord for each.
+
+    A generator over an iterable of lines, so that it works on a stream and
+    never holds more than the current line. Conf lines just repeat the Inst
+    lines, so they're skipped along with everything else.
+
+    @param lines iterable of Strings, the lines of the simulated upgrade.
+    @date Oct 17, 2026
+    '''
+    for line in lines:
+        if not line.startswith(('Inst ', 'Remv ')):
+            continue
+
+        match_obj = PACKAGE_LINE_REGEX.match(line)
+        if match_obj is None:
+            log.debug("couldn't parse package line: %r" % line)
+            continue
+
+        yield PackageRecord(*match_obj.groups())
+
+def is_security_record(record):
+    '''
+    Whether the package record's candidate comes from a -security pocket.
+
+    @date Oct 17, 2026
+    '''
+    return record.origin is not None and '-security' in record.origin
+
+def dpkg_version_compare(a, b):
+    '''
+    Compares two debian version strings the same way dpkg does.
+
+    Versions are [epoch:]upstream[-revision]. The epoch is compared
+    numerically, then the upstream version and revision are compared with
+    dpkg's verrevcmp(), where letters sort before non-letters and ~ sorts
+    before everything (even the end of the string).
+
+    @param a String version
+    @param b String version
+    @return negative if a < b, 0 if they're equal, positive if a > b.
+    @date Oct 17, 2026
+    '''
+    def split(version):
+        epoch, sep, rest = version.partition(':')
+        if not sep:
+            epoch, rest = '0', version
+        upstream, sep, revision = rest.rpartition('-')
+        if not sep:
+            upstream, revision = rest, ''
+        return int(epoch or 0), upstream, revision
+
+    def order(c):
+        if c == '~':
+            return -1
+        if c.isdigit():
+            return 0
+        if c.isalpha():
+            return ord(c)
+        return ord(c) + 256
+
+    def verrevcmp(a, b):
+        i = j = 0
+        while i < len(a) or j < len(b):
+            while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+                ac = order(a[i]) if i < len(a) else 0
+                bc = order(b[j]) if j < len(b) else 0
+                if ac != bc:
+                    return ac - bc
+                i += 1
+                j += 1
+
+            while i < len(a) and a[i] == '0':
+                i += 1
+            while j < len(b) and b[j] == '0':
+                j += 1
+
+            first_diff = 0
+            while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+                if not first_diff:
+                    first_diff = ord(a[i]) - ord(b[j])
+                i += 1
+                j += 1
+
+            if i < len(a) and a[i].isdigit():
+                return 1
+            if j < len(b) and b[j].isdigit():
+                return -1
+            if first_diff:
+                return first_diff
+        return 0
+
+    a_epoch, a_upstream, a_revision = split(a)
+    b_epoch, b_upstream, b_revision = split(b)
+
+    if a_epoch != b_epoch:
+        return a_epoch - b_epoch
+    return verrevcmp(a_upstream, b_upstream) or verrevcmp(a_revision, b_revision)
+
+def read_stanzas(f, fields, wanted=None):
+    '''
+    Reads the deb822 stanzas (dpkg status, Packages files, etc.) from f,
+    yielding a dict of only the requested fields for each.
+
+    Reads line by line, so whole files are never held in memory.
+
+    @param f file object to read from.
+    @param fields Set of field names to keep. Package is always kept.
+    @param wanted Function taking a package name, returning whether we want
+        the stanza. Unwanted stanzas are skipped without splitting their lines.
+        None means we want them all.
+    @date Oct 17, 2026
+    '''
+    stanza = {}
+    skipping = False
+    for line in f:
+        if line.isspace():
+            if stanza and not skipping:
+                yield stanza
+            stanza = {}
+            skipping = False
+        elif skipping or line[0] in ' \t':
+            continue
+        elif line.startswith('Package:'):
+            name = line[8:].strip()
+            skipping = wanted is not None and not wanted(name)
+            stanza['Package'] = name
+        else:
+            key, _, value = line.partition(':')
+            if key in fields:
+                stanza[key] = value.strip()
+
+    if stanza and not skipping:
+        yield stanza
+
+def scan_packages(packages_file, wanted=None):
+    '''
+    Scans a Packages file for the Package, Version, Architecture, Size and
+    Installed-Size of each stanza, yielding (name, version, arch, size,
+    installed_size) tuples. Both sizes are in bytes (Installed-Size is given
+    in KiB).
+
+    The file is mmapped and searched as raw bytes, so only the fields we want
+    are ever copied and decoded; the rest (descriptions, hashes, depends)
+    stays in the page cache rather than on our heap. Packages files on hosts
+    with many sources run to hundreds of megabytes.
+
+    Package is always the first field of a stanza in the files apt-get update
+    writes, stanzas that don't start with it are skipped.
+
+    @param packages_file String path of the (uncompressed) Packages file.
+    @param wanted Set of package names to yield, None means all of them.
+        Unwanted stanzas are skipped without looking at their other fields.
+    @throws IOError, OSError if the file can't be read.
+    @date Oct 17, 2026
+    '''
+    import mmap
+
+    with open(packages_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            def field(key, start, end):
+                pos = mm.find(key, start, end)
+                if pos < 0:
+                    return None
+                pos += len(key)
+                line_end = mm.find(b'\n', pos, end)
+                return mm[pos:end if line_end < 0 else line_end].strip()
+
+            size = len(mm)
+            start = 0
+            while start < size:
+                end = mm.find(b'\n\n', start)
+                if end < 0:
+                    end = size
+
+                line_end = mm.find(b'\n', start, end)
+                if line_end < 0:
+                    line_end = end
+                if mm[start:start + 8] == b'Package:':
+                    name = mm[start + 8:line_end].strip().decode('ascii', 'replace')
+                    if wanted is None or name in wanted:
+                        version = field(b'\nVersion:', line_end, end)
+                        arch = field(b'\nArchitecture:', line_end, end)
+                        package_size = field(b'\nSize:', line_end, end)
+                        installed_size = field(b'\nInstalled-Size:', line_end, end)
+                        yield (name,
+                                (version or b'').decode('ascii', 'replace'),
+                                (arch or b'all').decode('ascii', 'replace'),
+                                int(package_size) if package_size and package_size.isdigit() else 0,
+                                int(installed_size) * 1024 if installed_size and installed_size.isdigit() else 0)
+
+                start = end + 1
+                while start < size and mm[start:start + 1] == b'\n':
+                    start += 1
+
+def packages_index(lists_dir=APT_LISTS_DIR, wanted=None):
+    '''
+    Builds a version index from the Packages files in lists_dir with
+    scan_packages(): the download and installed sizes of every version of
+    each package and architecture. Records are looked up by their exact
+    candidate, so whichever version apt picked (pinned, from a NotAutomatic
+    archive, ...) is found without working out a candidate here.
+
+    Only the wanted packages are kept, so the index stays small however big
+    the lists are.
+
+    @param lists_dir String directory where apt keeps the downloaded lists.
+    @param wanted Set of package names to index, None means all of them.
+    @return dict (name, arch, version) -> (size, installed_size)
+    @date Oct 17, 2026
+    '''
+    import glob
+
+    index = {}
+    for packages_file in glob.glob(os.path.join(lists_dir, '*_Packages')):
+        try:
+            for name, version, arch, size, installed_size in scan_packages(packages_file, wanted):
+                index.setdefault((name, arch, version), (size, installed_size))
+        except (IOError, OSError) as e:
+            log.warning("couldn't scan %s: %s" % (packages_file, e))
+
+    return index
+
+def installed_sizes(status_file=DPKG_STATUS_FILE, wanted=None):
+    '''
+    The Installed-Size of the installed packages, from dpkg's status file.
+
+    @param status_file String path of dpkg's status file.
+    @param wanted Set of package names to look up, None means all of them.
+    @return dict (name, arch) -> installed size in bytes. Empty if the status
+        file can't be read.
+    @date Oct 17, 2026
+    '''
+    sizes = {}
+    try:
+        with open(status_file, 'r', errors='replace') as f:
+            for stanza in read_stanzas(f, {'Status', 'Architecture', 'Installed-Size'},
+                                        None if wanted is None else wanted.__contains__):
+                if stanza.get('Status', '').endswith(' installed'):
+                    installed_size = stanza.get('Installed-Size', '')
+                    sizes[(stanza['Package'], stanza.get('Architecture', 'all'))] = \
+                            int(installed_size) * 1024 if installed_size.isdigit() else 0
+    except (IOError, OSError) as e:
+        log.warning("couldn't read %s: %s" % (status_file, e))
+
+    return sizes
+
+def native_architecture(status_file=DPKG_STATUS_FILE):
+    '''
+    The native architecture, which is the one dpkg itself is installed for.
+
+    @param status_file String path of dpkg's status file.
+    @return String, or None if it can't be read.
+    @date Oct 17, 2026
+    '''
+    try:
+        with open(status_file, 'r', errors='replace') as f:
+            for stanza in read_stanzas(f, {'Architecture'}, 'dpkg'.__eq__):
+                return stanza.get('Architecture')
+    except (IOError, OSError) as e:
+        log.warning("couldn't read %s: %s" % (status_file, e))
+
+    return None
+
+def package_key(record, native_arch=None):
+    '''
+    The (name, arch) a record's package is found under in packages_index()
+    (along with its version) and installed_sizes(). apt qualifies the names of foreign packages, e.g:
+    Inst libc6:i386, and Remv lines have no architecture at all.
+
+    @param record PackageRecord
+    @param native_arch String the native architecture, for records without
+        one, see native_architecture().
+    @return (name, arch) tuple, the arch being None if it isn't known.
+    @date Oct 17, 2026
+    '''
+    name, _, qualifier = record.name.partition(':')
+    return name, qualifier or record.arch or native_arch
+
+def size_to_str(size, signed=False):
+    '''
+    Formats a size in bytes the way apt does (SI units), e.g: 12.3 MB.
+
+    @param size Int bytes.
+    @param signed Boolean whether to put a + in front of positive sizes.
+    @return String
+    @date Oct 17, 2026
+    '''
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(size) < 1000 or unit == 'GB':
+            break
+        size /= 1000.0
+
+    sign = '+' if signed and size > 0 else ''
+    if unit == 'B':
+        return '%s%d B' % (sign, size)
+    return '%s%.1f %s' % (sign, size, unit)
+
+def read_release_flags(lists_dir, packages_file):
+    '''
+    Reads the Release file belonging to a Packages file in lists_dir and
+    returns its suite and whether it is NotAutomatic (backports, proposed),
+    i.e: whether apt leaves it out of upgrades. Archives that are also
+    ButAutomaticUpgrades (backports on newer releases) aren't, as apt does
+    upgrade the packages installed from them.
+
+    Packages files are named <archive>_dists_<suite>_<component>_binary-<arch>_Packages
+    so the Release file is <archive>_dists_<suite>_InRelease (or _Release).
+    InRelease is clearsigned, so its fields come after the PGP armor header.
+
+    @return (suite, not_automatic) tuple
+    @date Oct 17, 2026
+    '''
+    import itertools
+    import urllib.parse
+
+    prefix = os.path.basename(packages_file).split('_binary-')[0].rsplit('_', 1)[0]
+    suite = urllib.parse.unquote(prefix.rpartition('_dists_')[2].replace('_', '/'))
+
+    for name in ('InRelease', 'Release'):
+        try:
+            with open(os.path.join(lists_dir, prefix + '_' + name), 'r', errors='replace') as f:
+                first = next(f, '')
+                if first.startswith('-----BEGIN PGP SIGNED MESSAGE-----'):
+                    for line in f:              # the armor headers (Hash:), up to a blank line
+                        if line.isspace():
+                            break
+                    lines = f
+                else:
+                    lines = itertools.chain([first], f)
+
+                release = next(read_stanzas(lines, {'NotAutomatic', 'ButAutomaticUpgrades'}), {})
+            return suite, (release.get('NotAutomatic', '').lower() == 'yes'
+                            and release.get('ButAutomaticUpgrades', '').lower() != 'yes')
+        except (IOError, OSError):
+            continue
+
+    return suite, False
+
+def native_upgrades(status_file=DPKG_STATUS_FILE, lists_dir=APT_LISTS_DIR):
+    '''
+    Works out the same counts and package records as simulating apt-get
+    upgrade, but in process by reading the dpkg status file and the Packages
+    files apt-get update downloaded.
+
+    An installed package is upgradable if some Packages file has a newer
+    version (dpkg ordering) for the same architecture. It is counted as not
+    upgraded (kept back) if it is held, or if the new version depends on a
+    package that isn't installed, as apt-get upgrade never installs new
+    packages. For the same reason install and remove are always 0.
+
+    This is an approximation of apt's resolver: pin priorities other than
+    NotAutomatic archives (which are ignored, unless they're also
+    ButAutomaticUpgrades, see read_release_flags()) aren't looked at, and phased
+    updates are counted as upgrades where apt would keep them back. Both
+    still end up in upgradable. Use --cross_check to compare against apt-get.
+
+    @param status_file String path of dpkg's status file.
+    @param lists_dir String directory where apt keeps the downloaded lists.
+    @throws UpgradeSimulError if the status or lists can't be read.
+    @return (UpgradeCounts, list of PackageRecords) tuple. The records' origin
+        is the suite of the candidate's archive.
+    @date Oct 17, 2026
+    '''
+    import glob
+
+    installed = {}              # (name, arch) -> (version, held)
+    installed_names = set()     # includes what the installed packages provide
+    native_arch = None
+    try:
+        with open(status_file, 'r', errors='replace') as f:
+            for stanza in read_stanzas(f, {'Status', 'Version', 'Architecture', 'Provides'}):
+                status = stanza.get('Status', '').split()
+                if len(status) != 3 or status[2] in ('not-installed', 'config-files'):
+                    continue
+
+                name = stanza['Package']
+                arch = stanza.get('Architecture', 'all')
+                if name == 'dpkg':
+                    native_arch = arch
+
+                installed[(name, arch)] = (stanza.get('Version', ''), status[0] == 'hold')
+                installed_names.add(name)
+                for provided in stanza.get('Provides', '').split(','):
+                    if provided.strip():
+                        installed_names.add(provided.split()[0])
+    except (IOError, OSError) as e:
+        raise UpgradeSimulError(e)
+
+    def normalize(arch):
+        return native_arch if arch == 'all' and native_arch else arch
+
+    installed = dict(((name, normalize(arch)), value) for (name, arch), value in installed.items())
+    candidates = {}             # (name, arch) -> (version, depends, suite)
+
+    packages_files = glob.glob(os.path.join(lists_dir, '*_Packages'))
+    if not packages_files:
+        raise UpgradeSimulError('no uncompressed Packages files in %s' % lists_dir)
+
+    for packages_file in packages_files:
+        suite, not_automatic = read_release_flags(lists_dir, packages_file)
+        if not_automatic:
+            log.debug("skipping NotAutomatic archive %s" % packages_file)
+            continue
+
+        try:
+            with open(packages_file, 'r', errors='replace') as f:
+                for stanza in read_stanzas(f, {'Version', 'Architecture', 'Depends', 'Pre-Depends'},
+                                            installed_names.__contains__):
+                    key = (stanza['Package'], normalize(stanza.get('Architecture', 'all')))
+                    if key not in installed:
+                        continue
+
+                    version = stanza.get('Version', '')
+                    best = candidates.get(key)
+                    if best is None or dpkg_version_compare(version, best[0]) > 0:
+                        depends = stanza.get('Pre-Depends', '') + ',' + stanza.get('Depends', '')
+                        candidates[key] = (version, depends, suite)
+        except (IOError, OSError) as e:
+            raise UpgradeSimulError(e)
+
+    def needs_new_package(depends):
+        for clause in depends.split(','):
+            alternatives = [alt.split()[0].split(':')[0] for alt in clause.split('|') if alt.strip()]
+            if alternatives and not any(alt in installed_names for alt in alternatives):
+                return True
+        return False
+
+    records = []
+    not_upgraded = 0
+    for (name, arch), (version, depends, suite) in sorted(candidates.items()):
+        current, held = installed[(name, arch)]
+        if dpkg_version_compare(version, current) <= 0:
+            continue
+
+        if held or needs_new_package(depends):
+            not_upgraded += 1
+        else:
+            records.append(PackageRecord('Inst', name, current, version, suite, arch))
+
+    return UpgradeCounts(len(records), 0, 0, not_upgraded), records
+
+def compute_upgrades(engine, cross_check, need_records=True, root=None, timeout=None):
+    '''
+    Works out the pending upgrades with the chosen engine.
+
+    The native engine falls back to apt-get if it fails. When cross checking,
+    both engines are run and apt-get's result wins if they disagree.
+
+    @param engine String 'apt' or 'native'.
+    @param cross_check Boolean whether to run both engines and compare them.
+    @param need_records Boolean whether the per-package records are needed.
+        apt-get's output can be read a lot quicker without them.
+    @param root String root directory of the system to check. None means the
+        running system.
+    @param timeout Number seconds apt-get may take, None means no limit.
+    @throws UpgradeSimulError, UpgradeOutputParseError, DeadlineExceededError
+    @return (UpgradeCounts, list of PackageRecords) tuple. The records are
+        None if they weren't needed (and weren't free).
+    @date Oct 17, 2026
+    '''
+    native_result = None
+    if engine == 'native' or cross_check:
+        try:
+            native_result = native_upgrades(rooted(root, DPKG_STATUS_FILE), rooted(root, APT_LISTS_DIR))
+            log.info("native engine counts: %r" % (native_result[0],))
+        except UpgradeSimulError as e:
+            log.warning("native engine failed, falling back to apt-get: %s" % e)
+
+    if native_result is not None and not cross_check:
+        return native_result
+
+    counts, records = parse_upgrade_output(get_upgrade_output(apt_root_options(root), timeout), need_records)
+
+    if native_result is not None:
+        if native_result[0] == counts:
+            log.info("cross check: engines agree")
+        else:
+            log.warning("cross check: native engine got %r, apt-get got %r" % (native_result[0], counts))
+
+    return counts, records
+
+def generate_output(template, template_dict):
+    '''
+    Generates the output from the given template and its dict.
+
+    The template has already been checked when it was loaded, so this should
+    only fail if template_dict is missing placeholders.
+
+    @throws GenerateOutputError
+    @param template Template the output template with placeholders (or not) to replace
+    with their proper values.
+    @param template_dict Dictionary Dictionary of template-placeholder value to use with
+    formatting the template.
+    @return the output string
+    @date Feb 12, 2011
+    @author Matthew Todd
+    '''
+    try:
+        return template.render(template_dict)
+    except KeyError as e:
+        raise GenerateOutputError('unknown identifier/placeholder: %s' % e)
+
+def state_fingerprint(root=None, hash_contents=False, engine='apt', cross_check=False):
+    '''
+    Fingerprints what the pending upgrades are worked out from: the dpkg
+    status file, the apt lists, apt's preferences and configuration, and the
+    engine that works them out.
+
+    If the fingerprint hasn't changed, neither can the result of simulating
+    the upgrade.
+
+    apt's configuration files are small, so their contents are always hashed.
+
+    @param root String root directory of the system. None means the running
+        system.
+    @param hash_contents Boolean whether to hash the files' contents as well as
+        their mtime, size and inode.
+    @param engine String the engine, see compute_upgrades().
+    @param cross_check Boolean whether both engines are run.
+    @return String hex digest, or None if there's no dpkg status file and no
+        lists, in which case there's nothing to fingerprint (and a cached
+        result can't be trusted).
+    @date Oct 17, 2026
+    '''
+    import hashlib
+
+    def listing(directory):
+        try:
+            return sorted(entry.path for entry in os.scandir(directory)
+                            if entry.is_file() and entry.name != 'lock')
+        except (IOError, OSError):
+            return []
+
+    state = [rooted(root, DPKG_STATUS_FILE)] + listing(rooted(root, APT_LISTS_DIR))
+    preferences = [rooted(root, APT_PREFERENCES)] + listing(rooted(root, APT_PREFERENCES_PARTS))
+    conf = [rooted(root, APT_CONF)] + listing(rooted(root, APT_CONF_PARTS))
+
+    state_paths, conf_paths = frozenset(state), frozenset(conf)
+    digest = hashlib.sha256(('engine %s cross_check %d\n' % (engine, cross_check)).encode())
+    found = 0
+    for path in state + preferences + conf:
+        try:
+            st = os.stat(path)
+        except (IOError, OSError):
+            continue
+        if path in state_paths:
+            found += 1
+
+        digest.update(('%s %d %d %d\n' % (path, st.st_mtime_ns, st.st_size, st.st_ino)).encode())
+        if hash_contents or path in conf_paths:
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+            except (IOError, OSError) as e:
+                digest.update(str(e).encode())
+
+    if not found:
+        return None
+    return digest.hexdigest()
+
+def load_cached_result(cache_file, fingerprint, need_records=True):
+    '''
+    Gets the cached counts, if they were cached for the same fingerprint.
+
+    A missing or unreadable cache is just a miss, as is a cache without
+    records when we need them.
+
+    @param cache_file String path of the cache file.
+    @param fingerprint String see state_fingerprint(). None is always a miss.
+    @param need_records Boolean whether the per-package records are needed.
+    @return (UpgradeCounts, list of PackageRecords) tuple, or None on a cache
+        miss.
+    @date Oct 17, 2026
+    '''
+    import json
+
+    if fingerprint is None:
+        return None
+
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+
+        if cache.get('fingerprint') == fingerprint:
+            if cache['records'] is not None:
+                return (UpgradeCounts(*cache['counts']),
+                        [PackageRecord(*record) for record in cache['records']])
+            elif not need_records:
+                return UpgradeCounts(*cache['counts']), None
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        log.debug("couldn't use cache file %s: %s" % (cache_file, e))
+
+    return None
+
+def save_cached_result(cache_file, fingerprint, counts, records):
+    '''
+    Caches the counts and package records under the given fingerprint.
+
+    The cache is written with atomic_write(), so a concurrent run never reads
+    half of it. Failing to write the cache isn't an error, it just gets logged.
+
+    @param cache_file String path of the cache file.
+    @param fingerprint String see state_fingerprint().
+    @param counts UpgradeCounts the counts to cache.
+    @param records List of PackageRecords to cache, or None if they weren't
+        parsed.
+    @date Oct 17, 2026
+    '''
+    import json
+
+    cache = {'fingerprint' : fingerprint,
+            'counts'       : list(counts),
+            'records'      : None if records is None else [list(record) for record in records],
+            'time'         : time.time(),}
+
+    try:
+        atomic_write(cache_file, json.dumps(cache))
+    except (IOError, OSError) as e:
+        log.warning("couldn't write cache file %s: %s" % (cache_file, e))
+
+def save_shared_result(filename, counts, template_dict, placeholders, security=None):
+    '''
+    Saves a check's result, as rendered, for other runs to render: those
+    waiting on it (see Flight), or later ones that run out of time (see
+    --stale_file).
+
+    The file is written with atomic_write(). Failing to write it isn't an
+    error, it just gets logged.
+
+    @param filename String path of the file.
+    @param counts UpgradeCounts
+    @param template_dict dict see create_template_dict().
+    @param placeholders Set of the placeholders template_dict was built for.
+    @param security Int the number of security upgrades, None if the records
+        weren't parsed.
+    @date Oct 17, 2026
+    '''
+    import json
+
+    shared = {'counts'      : list(counts),
+            'template_dict' : template_dict,
+            'placeholders'  : sorted(placeholders),
+            'security'      : security,
+            'time'          : time.time(),}
+    try:
+        atomic_write(filename, json.dumps(shared))
+    except (IOError, OSError) as e:
+        log.warning("couldn't write shared result %s: %s" % (filename, e))
+
+def load_shared_result(filename):
+    '''
+    Loads a result saved with save_shared_result().
+
+    @param filename String path of the file.
+    @return dict with counts (UpgradeCounts), template_dict, placeholders (a
+        set), security and time (when it was saved), or None if there isn't a
+        usable one.
+    @date Oct 17, 2026
+    '''
+    import json
+
+    try:
+        with open(filename, 'r') as f:
+            shared = json.load(f)
+        return {'counts'        : UpgradeCounts(*shared['counts']),
+                'template_dict' : dict(shared['template_dict']),
+                'placeholders'  : frozenset(shared['placeholders']),
+                'security'      : shared['security'],
+                'time'          : float(shared['time']),}
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        log.debug("couldn't use shared result %s: %s" % (filename, e))
+        return None
+
+def age_to_str(age):
+    '''
+    Formats an age for {stale_age}, e.g: 5 min, 3 h, 2 days.
+
+    @param age Number seconds.
+    @return String
+    @date Oct 17, 2026
+    '''
+    minutes = max(0, int(age // 60))
+    if minutes < 120:
+        return '%d min' % minutes
+    if minutes < 48 * 60:
+        return '%d h' % (minutes // 60)
+    return '%d days' % (minutes // (24 * 60))
+
+def update_history(history_file, counts, records, now=None):
+    '''
+    Records a run in the history file and works out what changed since the
+    last one.
+
+    The file is a SQLite database (see HISTORY_SCHEMA). The pending table only
+    holds the latest state, so reading it doesn't depend on how long the
+    history is, and the runs table is compacted down to HISTORY_MAX_RUNS, so
+    the file stays small. Failing to use the history isn't an error, it just
+    gets logged.
+
+    @param history_file String path of the history file.
+    @param counts UpgradeCounts this run's counts.
+    @param records List of PackageRecords of the pending upgrades.
+    @param now Float the run's time, None means time.time().
+    @return dict with new_since_last (upgrades, or new candidate versions,
+        that weren't pending last run) and pending_days (days the oldest
+        pending upgrade has been pending), as Ints. None if the history
+        couldn't be used.
+    @date Oct 17, 2026
+    '''
+    import sqlite3
+
+    if now is None:
+        now = time.time()
+    upgrades = dict(((record.name, record.arch), record.candidate) for record in records or ()
+                        if record.action == 'Inst' and record.current is not None)
+
+    try:
+        connection = sqlite3.connect(history_file, timeout=10)
+    except sqlite3.Error as e:
+        log.warning("couldn't open history file %s: %s" % (history_file, e))
+        return None
+
+    try:
+        connection.executescript(HISTORY_SCHEMA)
+        with connection:
+            previous = dict(((name, arch), (candidate, first_seen)) for name, arch, candidate, first_seen
+                            in connection.execute('SELECT name, arch, candidate, first_seen FROM pending'))
+            new = sum(1 for key, candidate in upgrades.items() if previous.get(key, (None,))[0] != candidate)
+            pending = [(name, arch, candidate, previous.get((name, arch), (None, now))[1])
+                        for (name, arch), candidate in upgrades.items()]
+
+            connection.execute('DELETE FROM pending')
+            connection.executemany('INSERT INTO pending VALUES (?, ?, ?, ?)', pending)
+            connection.execute('INSERT INTO runs (time, upgrade, install, remove, not_upgraded, new) '
+                                'VALUES (?, ?, ?, ?, ?, ?)', (now,) + tuple(counts) + (new,))
+            connection.execute('DELETE FROM runs WHERE id <= (SELECT MAX(id) FROM runs) - ?', (HISTORY_MAX_RUNS,))
+        connection.execute('PRAGMA incremental_vacuum')
+    except sqlite3.Error as e:
+        log.warning("couldn't update history file %s: %s" % (history_file, e))
+        return None
+    finally:
+        connection.close()
+
+    oldest = min([first_seen for _, _, _, first_seen in pending] or [now])
+    return {'new_since_last': new, 'pending_days': int((now - oldest) // 86400)}
+
+def create_template_dict(counts, time_format, records=(), index=None, history=None, installed=None,
+                            native_arch=None):
+    '''
+    Create the template dict to be used to substitute in real values.
+
+    The counts are put in the dict as strings, so that format specs in
+    templates behave the same as they always have.
+
+    @param counts UpgradeCounts the pending upgrades, the counts of the Result
+        from check_updates(). Fills in upgrade, install, remove, not_upgraded
+        and upgradable.
+    @param time_format a format string to be used in formatting the time
+        placeholder. Should be of the format as described by the Python spec
+        (probably same or very similar to C spec as well.)
+    @param records List of PackageRecords of the pending upgrades, the records
+        of the Result from check_updates(), for packages, security and
+        security_packages (and the sizes). None if they weren't parsed, which
+        leaves those placeholders empty.
+    @param index dict from packages_index() with the pending packages'
+        candidates, for download_size and installed_size_delta. None if it
+        wasn't built, which leaves both empty.
+    @param history dict from update_history(), for new_since_last and
+        pending_days. None if there is no history, which leaves both empty.
+    @param installed dict from installed_sizes() with the installed versions
+        of the pending packages, for installed_size_delta. None if it wasn't
+        read, which leaves it empty.
+    @param native_arch String the native architecture, for looking up records
+        without one (see package_key()).
+    @return dictionary with every placeholder in TEMPLATE_PLACEHOLDERS as keys
+        and their values as strings (stale_age is always empty, see
+        run_check())
+    @date Feb 11, 2011
+    @author Matthew Todd
+    '''
+    upgrade = str(counts.upgrade)
+    install = str(counts.install)
+    remove = str(counts.remove)
+    not_upgraded = str(counts.not_upgraded)
+    cur_time = time.strftime(time_format)
+    upgradable = str(counts.upgrade + counts.not_upgraded)
+    upgrades = [record for record in records or () if record.action == 'Inst' and record.current is not None]
+    security_upgrades = [record.name for record in upgrades if is_security_record(record)]
+
+    def lookup(sizes, record, *version):
+        name, arch = package_key(record, native_arch)
+        for key in ((name, arch) + version, (name, 'all') + version):
+            if key in sizes:
+                return sizes[key]
+        return None
+
+    # unknown (empty) if any of the upgrades isn't in the index, rather than
+    # an undercount
+    download_size = 0 if index is not None else None
+    for record in upgrades if index is not None else ():
+        candidate = lookup(index, record, record.candidate)
+        if candidate is not None:
+            download_size += candidate[0]
+        else:
+            log.debug("no size for %s %s in the Packages index" % (record.name, record.candidate))
+            download_size = None
+            break
+
+    # what the upgrades add, less what the upgraded and removed versions took,
+    # unknown (empty) too if any of them can't be sized
+    installed_size_delta = 0 if index is not None and installed is not None else None
+    for record in records or () if installed_size_delta is not None else ():
+        if record.action == 'Inst':
+            candidate = lookup(index, record, record.candidate)
+            if candidate is None:
+                log.debug("no installed size for %s %s in the Packages index" % (record.name, record.candidate))
+                installed_size_delta = None
+                break
+            installed_size_delta += candidate[1]
+        if record.action == 'Remv' or record.current is not None:
+            current = lookup(installed, record)
+            if current is None:
+                log.debug("no installed size for %s %s in dpkg's status" % (record.name, record.current))
+                installed_size_delta = None
+                break
+            installed_size_delta -= current
+
+    return { 'upgrade'      : upgrade,
+            'install'       : install,
+            'remove'        : remove,
+            'not_upgraded'  : not_upgraded,
+            'time'          : cur_time,
+            'upgradable'    : upgradable,
+            'packages'      : ', '.join(record.name for record in upgrades),
+            'security'      : str(len(security_upgrades)),
+            'security_packages' : ', '.join(security_upgrades),
+            'download_size' : size_to_str(download_size) if download_size is not None else '',
+            'installed_size_delta' : size_to_str(installed_size_delta, True)
+                                        if installed_size_delta is not None else '',
+            'new_since_last': str(history['new_since_last']) if history is not None else '',
+            'pending_days'  : str(history['pending_days']) if history is not None else '',
+            'stale_age'     : '',}
+
+###
+#### main
+###
+def report_error(targets, e, metrics=None):
+    '''
+    Logs the exception and writes the related error message to the targets'
+    output files (see write_error()).
+
+    @param targets List of Targets.
+    @param e Exception the exception that stopped the check.
+    @param metrics Metrics counts the error, if given.
+    @return The exit code related to the exception (see ERROR_CODES).
+    @date Oct 17, 2026
+    '''
+    log.exception(e)
+
+    if isinstance(e, CustomException):
+        key = e.key
+    else:
+        key = 'default'
+
+    if metrics is not None:
+        metrics.count('errors_total', {'error': key})
+    write_error(targets, key)
+    return ERROR_CODES[key]
+
+def write_error(targets, key):
+    '''
+    Writes an error message to the targets' output files. format=json targets
+    get it as JSON, with the error and exit_code like --query's answers, so
+    that whatever reads them doesn't have to parse plain text as well.
+
+    @param targets List of Targets.
+    @param key String the key of the error in ERROR_MSGS and ERROR_CODES.
+    @date Oct 17, 2026
+    '''
+    for target in targets:
+        if isinstance(target.template, JSONTemplate):
+            msg = target.template.render({'error': ERROR_MSGS[key].strip(), 'exit_code': ERROR_CODES[key]})
+        else:
+            msg = ERROR_MSGS[key]
+        write_msg(target.out_file, msg, True, target.no_error_output)
+
+def check_updates(config=None, root=None, need_records=True, metrics=None, deadline=None):
+    '''
+    Finds the available upgrades: checks the network, updates the package
+    lists and works out what would be upgraded, as set in config. Nothing is
+    rendered or written out, this is the entry point for using this module as
+    a library:
+
+    @code
+    import ubuntu_updates_avail
+    result = ubuntu_updates_avail.check_updates(ubuntu_updates_avail.Config(no_root=True))
+    print(result.counts.upgrade)
+    @endcode
+
+    @param config Config the settings to use. None means the defaults.
+    @param root String root directory of the system to check. None means the
+        running system.
+    @param need_records Boolean whether the PackageRecords are needed.
+    @param metrics Metrics times the stages and counts the retries and cache
+        hits, if given.
+    @param deadline Float time.monotonic() by which the check has to be done,
+        every timeout is cut short to meet it. None means config.deadline
+        seconds from now (if any).
+    @return Result
+    @throws CustomException (one of its subclasses) if the check failed.
+    @date Oct 17, 2026
+    '''
+    if config is None:
+        config = Config()
+    if metrics is None:
+        metrics = Metrics(root)
+    if deadline is None and config.deadline > 0:
+        deadline = time.monotonic() + config.deadline
+
+    def remaining(timeout=None):
+        '''
+        The timeout, cut short to meet the deadline.
+        '''
+        if deadline is None:
+            return timeout
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceededError('no time left for the rest of the check')
+        return left if timeout is None else min(timeout, left)
+
+    if config.network_check:
+        with metrics.stage('network_check'):
+            mirrors = config.mirrors or source_mirrors(
+                        read_apt_sources(rooted(root, APT_SOURCES_LIST), rooted(root, APT_SOURCES_PARTS)))
+            check_network(mirrors, remaining(config.network_timeout))
+
+    with metrics.stage('update'):
+        sources = None
+        if config.conditional_update and config.num_update_checks > 0:
+            sources = read_apt_sources(rooted(root, APT_SOURCES_LIST), rooted(root, APT_SOURCES_PARTS))
+
+        if config.no_root:
+            log.info("not running 'call_update' b/c of insufficient privileges (no_root).")
+        elif sources is not None and not changed_sources(sources, rooted(root, APT_LISTS_DIR),
+                                                        remaining(config.probe_timeout)):
+            log.info("all sources unchanged upstream, skipping update")
+        else:
+            update_deadline = config.update_deadline
+            if deadline is not None:
+                update_deadline = remaining(update_deadline if update_deadline > 0 else None)
+            policy = RetryPolicy(config.num_update_checks, config.sleep_period, config.backoff_factor,
+                                    config.max_sleep_period, config.jitter, update_deadline)
+            call_update(policy, apt_root_options(root), metrics,
+                        [rooted(root, APT_LISTS_LOCK_FILE), rooted(root, DPKG_FRONTEND_LOCK_FILE)],
+                        config.lock_timeout, config.skip_if_locked)
+
+    cache_file = root_file(compute_base_file(config.base_dir, config.cache_file), root)
+    result = None
+    if cache_file:
+        with metrics.stage('cache'):
+            fingerprint = state_fingerprint(root, config.cache_hash, config.engine, config.cross_check)
+            result = load_cached_result(cache_file, fingerprint, need_records)
+        log.info("cache %s for %s" % ('hit' if result else 'miss', fingerprint))
+        metrics.count('cache_hits_total' if result else 'cache_misses_total')
+
+    if result is None:
+        with metrics.stage('compute_upgrades'):
+            result = compute_upgrades(config.engine, config.cross_check, need_records, root,
+                                        remaining() if deadline is not None else None)
+        if cache_file and fingerprint is not None:
+            save_cached_result(cache_file, fingerprint, *result)
+
+    return Result(*result)
+
+def check_metrics(config, root=None):
+    '''
+    The Metrics for a check, with the metrics file from config (if any).
+
+    @param config Config the settings for the check.
+    @param root String root directory being checked, None for the running
+        system.
+    @return Metrics
+    @date Oct 17, 2026
+    '''
+    metrics_file = compute_base_file(config.base_dir, config.metrics_file)
+    if metrics_file:
+        metrics_file = metrics_root_file(metrics_file, root)
+    return Metrics(root, metrics_file)
+
+def build_template_dict(config, placeholders, root=None, metrics=None, deadline=None):
+    '''
+    Runs check_updates() and builds the template dict from its result, along
+    with whatever the placeholders need (the Packages index, the history).
+
+    With a flight_file in config, a check already in progress is waited for
+    and its template dict reused instead (see Flight).
+
+    @param config Config the settings for the check.
+    @param placeholders Set of the placeholders that will be rendered.
+    @param root String root directory of the system to check. None means the
+        running system.
+    @param metrics Metrics times the stages, if given.
+    @param deadline Float time.monotonic() by which the check has to be done,
+        see check_updates().
+    @return (UpgradeCounts, template dict) tuple
+    @throws CustomException (one of its subclasses) if the check failed.
+    @date Oct 17, 2026
+    '''
+    if metrics is None:
+        metrics = Metrics(root)
+    if deadline is None and config.deadline > 0:
+        deadline = time.monotonic() + config.deadline
+
+    flight_file = root_file(compute_base_file(config.base_dir, config.flight_file), root)
+    flight = None
+    if flight_file:
+        wait = config.flight_wait
+        if deadline is not None:
+            wait = min(wait, max(0, deadline - time.monotonic()))
+        flight = Flight(flight_file, wait)
+    try:
+        shared = None
+        if flight is not None:
+            with metrics.stage('flight'):
+                shared = flight.join(placeholders)
+
+        if shared is not None:
+            counts, template_dict, security = shared
+            metrics.count('shared_results_total')
+        else:
+            history_file = root_file(compute_base_file(config.base_dir, config.history_file), root)
+            need_records = bool(RECORD_PLACEHOLDERS & placeholders) or bool(history_file)
+            counts, records = check_updates(config, root, need_records, metrics, deadline)
+
+            history = None
+            if history_file:
+                with metrics.stage('history'):
+                    history = update_history(history_file, counts, records)
+
+            index = installed = native_arch = None
+            if INDEX_PLACEHOLDERS & placeholders:
+                with metrics.stage('index'):
+                    names = set(package_key(record)[0] for record in records)
+                    index = packages_index(rooted(root, APT_LISTS_DIR), names)
+                    if 'installed_size_delta' in placeholders:
+                        installed = installed_sizes(rooted(root, DPKG_STATUS_FILE), names)
+                    if not all(package_key(record)[1] for record in records):
+                        native_arch = native_architecture(rooted(root, DPKG_STATUS_FILE))
+
+            with metrics.stage('render'):
+                template_dict = create_template_dict(counts, config.time_format, records, index, history,
+                                                    installed, native_arch)
+
+            security = int(template_dict['security']) if records is not None else None
+            if flight is not None:
+                flight.share(counts, template_dict, placeholders, security)
+    finally:
+        if flight is not None:
+            flight.close()
+
+    for kind, value in counts._asdict().items():
+        metrics.set('pending_packages', value, {'kind': kind})
+    if security is not None:
+        metrics.set('pending_packages', security, {'kind': 'security'})
+    metrics.set('last_success_timestamp_seconds', time.time())
+
+    return counts, template_dict
+
+def build_within_deadline(config, placeholders, root, metrics, late):
+    '''
+    Runs build_template_dict() in a thread of its own, so that we can do
+    something about it running late: late() is called if the check is still
+    running after config.stale_after seconds, or runs past config.deadline.
+
+    After stale_after, the check carries on (up to the deadline). Past the
+    deadline it's abandoned: its commands' timeouts run out with the
+    deadline, whatever is still running DEADLINE_GRACE seconds later gets
+    killed, and the thread is left in abandoned_checks, as it only stops at
+    the next step that checks the deadline.
+
+    @param config Config the settings for the check.
+    @param placeholders Set of the placeholders that will be rendered.
+    @param root String root directory of the system to check. None means the
+        running system.
+    @param metrics Metrics times the stages.
+    @param late Function to call (once, with no arguments) when the check is
+        running late.
+    @return (UpgradeCounts, template dict) tuple
+    @throws DeadlineExceededError, or whatever the check raised.
+    @date Oct 17, 2026
+    '''
+    import threading
+
+    deadline = time.monotonic() + config.deadline if config.deadline > 0 else None
+    outcome = {}
+    called = []
+
+    def refresh():
+        try:
+            outcome['result'] = build_template_dict(config, placeholders, root, metrics, deadline)
+        except BaseException as e:
+            outcome['error'] = e
+
+    def call_late():
+        if not called:
+            called.append(True)
+            late()
+
+    thread = threading.Thread(target=refresh, name='check', daemon=True)
+    thread.start()
+
+    if config.stale_after > 0 and (deadline is None or config.stale_after < config.deadline):
+        thread.join(config.stale_after)
+        if thread.is_alive():
+            log.warning("check still running after %d seconds" % config.stale_after)
+            call_late()
+
+    if deadline is None:
+        thread.join()
+    else:
+        thread.join(max(0, deadline - time.monotonic()) + DEADLINE_GRACE)
+    if thread.is_alive():
+        log.error("check still running past the deadline, abandoning it")
+        abandoned_checks.append(thread)
+        kill_running_groups()
+        call_late()
+        raise DeadlineExceededError('check still running after %d seconds' % config.deadline)
+
+    if 'error' in outcome:
+        if isinstance(outcome['error'], DeadlineExceededError):
+            call_late()
+        raise outcome['error']
+    return outcome['result']
+
+def wait_for_abandoned_checks():
+    '''
+    Waits for the checks build_within_deadline() abandoned to finish, so that
+    the next check doesn't run alongside one that's still winding down (and
+    may still hold the apt locks, or write the cache or stale file). Their
+    deadline has passed, so they stop at their next step; any commands they
+    start in the meantime are killed.
+
+    @date Oct 17, 2026
+    '''
+    if any(thread.is_alive() for thread in abandoned_checks):
+        log.warning("waiting for the check abandoned at its deadline to finish")
+
+    while abandoned_checks:
+        abandoned_checks[0].join(DEADLINE_GRACE)
+        if abandoned_checks[0].is_alive():
+            kill_running_groups()
+        else:
+            abandoned_checks.pop(0)
+
+def run_check(config, targets, root=None):
+    '''
+    Runs a single update check, from updating through to writing the output.
+
+    Has a default catch all except clause which logs the exception. Normally
+    catch-alls are undesired b/c it may hide/obscure problems, but b/c this
+    program is likely to be run as a cron job, we need a way to catch
+    exceptions/errors/etc for later debugging/assesing/etc.
+
+    Every target is rendered from the same template dict, so there is only
+    the one simulation however many outputs there are.
+
+    With a stale_file (and a deadline or stale_after) in config, a check that
+    runs late has the last good result rendered, with its {stale_age}, and
+    that's left in place if the check then fails (see
+    build_within_deadline()).
+
+    @param config Config the settings for the check.
+    @param targets List of Targets to render to.
+    @param root String root directory of the system to check. None means the
+        running system.
+    @return (exit code, UpgradeCounts) tuple. See ERROR_CODES for the exit
+        code. The counts are None if the check failed.
+    @date Oct 17, 2026
+    '''
+    metrics = check_metrics(config, root)
+    placeholders = frozenset().union(*[target.template.placeholders for target in targets])
+    stale_file = root_file(compute_base_file(config.base_dir, config.stale_file), root)
+    stale = []
+
+    def render(template_dict):
+        for target in targets:
+            with metrics.stage('render'):
+                output = generate_output(target.template, template_dict)
+
+            with metrics.stage('write'):
+                write_msg(target.out_file, output, False, target.no_error_output)
+
+    def render_stale():
+        shared = load_shared_result(stale_file)
+        if shared is None or not placeholders <= shared['placeholders']:
+            log.warning("no last good result to render from %s" % stale_file)
+            return
+        age = age_to_str(time.time() - shared['time'])
+        log.warning("rendering the last good result, from %s ago" % age)
+        metrics.count('stale_renders_total')
+        render(dict(shared['template_dict'], stale_age=age))
+        stale.append(True)
+
+    try:
+        with metrics.stage('total'):
+            if stale_file and (config.deadline > 0 or config.stale_after > 0):
+                counts, template_dict = build_within_deadline(config, placeholders, root, metrics, render_stale)
+                save_shared_result(stale_file, counts, template_dict, placeholders)
+            else:
+                counts, template_dict = build_template_dict(config, placeholders, root, metrics)
+            render(template_dict)
+
+        log.info('check of %s finished: %s' % (root or '/', time.asctime()))
+        ret = NO_ERROR
 
     except Exception as e:
-        log.exception(e)
-        write_msg(out_file, ERROR_MSGS['default'], is_error=True)
+        # a stale result that was rendered stays, rather than an error message
+        ret = report_error([] if stale else targets, e, metrics)
+        counts = None
+
+    metrics.finish(ret)
+    return ret, counts
+
+def run_roots(config, targets):
+    '''
+    Checks each of the root directories with run_check(), concurrently, in a
+    pool of jobs processes.
+
+    Each root's outputs are written by its own process as soon as it's done,
+    to root_file(out_file, root) for each target, so a slow or failing root
+    doesn't hold up the others. Once they're all done (or timeout has passed)
+    a summary of all of them is written to each target's out_file (as JSON for
+    format=json targets). Roots still running after timeout are
+    killed, along with their commands, and counted as failed.
+
+    The roots, jobs and timeout come from config.roots, config.jobs and
+    config.roots_timeout (<= 0 means no limit).
+
+    @param config Config the settings for the checks.
+    @param targets List of Targets, rendered for each root.
+    @return The exit code of the first root that failed, or NO_ERROR.
+    @date Oct 17, 2026
+    '''
+    import json
+    import multiprocessing
+
+    def root_targets(root):
+        return [target._replace(out_file=root_file(target.out_file, root)) for target in targets]
+
+    roots, timeout = config.roots, config.roots_timeout
+    error_keys = dict((code, key) for key, code in ERROR_CODES.items())
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+
+    # each root's check gets the timeout as its deadline, so its commands run
+    # in process groups of their own that can be killed along with it
+    root_config = config
+    if timeout > 0 and not 0 < config.deadline <= timeout:
+        root_config = Config(**dict(vars(config), deadline=timeout))
+
+    pool = multiprocessing.Pool(max(1, min(config.jobs, len(roots))), setup_worker)
+    try:
+        pending = [(root, pool.apply_async(run_check, (root_config, root_targets(root), root)))
+                    for root in roots]
+
+        results = []
+        for root, async_result in pending:
+            try:
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                results.append((root,) + async_result.get(remaining))
+            except multiprocessing.TimeoutError:
+                log.error("check of root %s timed out" % root)
+                write_error(root_targets(root), 'default')
+                results.append((root, ERROR_CODES['default'], None))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    lines = []
+    summary = {}
+    upgradable = succeeded = 0
+    for root, ret, counts in results:
+        if counts is None:
+            error = ERROR_MSGS[error_keys.get(ret, 'default')].strip()
+            lines.append(' %s: %s' % (root, error))
+            summary[root] = {'error': error}
+        else:
+            lines.append(' %s: %d upgradable' % (root, counts.upgrade + counts.not_upgraded))
+            summary[root] = {'upgradable': counts.upgrade + counts.not_upgraded}
+            upgradable += counts.upgrade + counts.not_upgraded
+            succeeded += 1
+    lines.append(' total: %d upgradable in %d of %d roots' % (upgradable, succeeded, len(roots)))
+
+    for target in targets:
+        if isinstance(target.template, JSONTemplate):
+            msg = json.dumps({'roots': summary, 'upgradable': upgradable, 'succeeded': succeeded}, sort_keys=True)
+        else:
+            msg = '\n'.join(lines)
+        write_msg(target.out_file, msg, succeeded == 0, target.no_error_output)
+
+    failures = [ret for _, ret, _ in results if ret != NO_ERROR]
+    return failures[0] if failures else NO_ERROR
+
+def run_checks(config, targets):
+    '''
+    Runs one round of checks: run_roots() if we were given roots to check,
+    otherwise run_check() on the running system.
+
+    @return The exit code (see ERROR_CODES).
+    @date Oct 17, 2026
+    '''
+    if config.roots:
+        return run_roots(config, targets)
+    return run_check(config, targets)[0]
+
+def local_check_config(config):
+    '''
+    The settings for the checks triggered by a change to the package state
+    (see Watcher): the state is already on disk, so these checks go without
+    the update, and without the network check, which is only there for the
+    update's sake.
+
+    @param config Config the settings for the full checks.
+    @return Config
+    @date Oct 17, 2026
+    '''
+    return Config(**dict(vars(config), num_update_checks=0, network_check=False))
+
+def run_daemon(config, targets, interval):
+    '''
+    Runs run_checks() every interval seconds until we're interrupted or
+    terminated.
+
+    The interval is measured from the start of one check to the start of the
+    next, so the checks don't drift by however long apt-get takes. If a check
+    takes longer than the interval, the next one starts right away. The
+    templates are reloaded before a check if their files have changed.
+
+    With config.watch, the package state is watched in between (see Watcher)
+    and when it changes the check is re-run without updating, straight away.
+    Those checks don't move the schedule of the full ones.
+
+    @param config Config the settings for the checks.
+    @param targets List of Targets, their templates already loaded.
+    @param interval Int seconds between the start of each check. Values <= 0
+        mean DEFAULT_DAEMON_INTERVAL.
+    @return NO_ERROR once we've been told to stop.
+    @date Oct 17, 2026
+    '''
+    import signal
+
+    def stop(signum, frame):
+        log.info("received signal %d, stopping daemon" % signum)
+        kill_running_groups()
+        sys.exit(NO_ERROR)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    if interval <= 0:
+        interval = DEFAULT_DAEMON_INTERVAL
+
+    log.info("starting daemon with an interval of %d seconds" % interval)
+
+    watcher = Watcher(config.roots or (None,)) if config.watch else None
+    local_config = local_check_config(config)
+
+    next_run = time.monotonic()
+    full = True
+    try:
+        while True:
+            for target in targets:
+                target.template.reload_if_changed()
+            wait_for_abandoned_checks()
+            ret = run_checks(config if full else local_config, targets)
+
+            if full:
+                next_run += interval
+                if watcher is not None:
+                    watcher.read()          # the update's own changes to the lists
+            now = time.monotonic()
+            if next_run < now:
+                log.warning("check overran the interval by %.1f seconds" % (now - next_run))
+                next_run = now
+            log.info("check returned %d, next check in %d seconds" % (ret, next_run - now))
+
+            if watcher is not None:
+                full = not watcher.wait(next_run - now)
+            else:
+                time.sleep(next_run - now)
+    except KeyboardInterrupt:
+        log.info("daemon interrupted")
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+    return NO_ERROR
+
+def serve(config, targets, socket_path, interval):
+    '''
+    Runs the server: checks every interval seconds and answers queries on a
+    Unix socket from the latest result, until terminated.
+
+    Clients send one request line and get back their exit code on the first
+    line and the answer after it. The requests are:
+     - render NAME: the output of the target named NAME ("default" being the
+       --template one).
+     - counts: the counts, the time of the check and its error, as JSON.
+
+    Each client is served by asyncio on the one thread, straight from the
+    latest result (renders are cached until the next check), so no request
+    does any apt work. The checks run in a thread of their own, and queries
+    keep getting the previous result while one is running. The socket is bound
+    before the first check, which clients get a NoResultError for until it
+    finishes. Being told to stop doesn't wait for a check that's running: the
+    commands that have a --deadline are killed, and the rest are left to
+    finish on their own. If a check fails, clients get its error message,
+    except for no_error_output targets which keep getting the last good
+    output. With config.watch, changes to the
+    package state trigger a check without updating, as in run_daemon().
+
+    The socket is made accessible to everyone, so that each user's status bar
+    can query a server running as root.
+
+    @param config Config the settings for the checks.
+    @param targets List of Targets, the named templates.
+    @param socket_path String path of the Unix socket.
+    @param interval Int seconds between the start of each check. Values <= 0
+        mean DEFAULT_DAEMON_INTERVAL.
+    @return NO_ERROR once we've been told to stop.
+    @date Oct 17, 2026
+    '''
+    import asyncio
+    import json
+    import signal
+    import stat
+    import threading
+
+    if interval <= 0:
+        interval = DEFAULT_DAEMON_INTERVAL
+
+    names = dict((target.name, target) for target in targets)
+    error_keys = dict((code, key) for key, code in ERROR_CODES.items())
+    latest = {'result': {'ret': ERROR_CODES['NoResultError'], 'counts': None, 'template_dict': None,
+                            'time': None, 'rendered': {}}}
+    local_config = local_check_config(config)
+
+    def refresh(full=True):
+        for target in targets:
+            target.template.reload_if_changed()
+        placeholders = frozenset().union(*[target.template.placeholders for target in targets])
+
+        result = dict(latest['result'], rendered={})
+        metrics = check_metrics(config)
+        try:
+            with metrics.stage('total'):
+                counts, template_dict = build_template_dict(config if full else local_config,
+                                                            placeholders, None, metrics)
+            result.update(ret=NO_ERROR, counts=counts, template_dict=template_dict, time=time.time())
+        except Exception as e:
+            result['ret'] = report_error([], e, metrics)
+        metrics.finish(result['ret'])
+
+        latest['result'] = result           # one assignment, so queries never see half a result
+        log.info("check returned %d, serving it on %s" % (result['ret'], socket_path))
+
+    def respond(request):
+        '''
+        @return (exit code, answer) tuple
+        '''
+        result = latest['result']
+        ret = result['ret']
+        error = ERROR_MSGS[error_keys.get(ret, 'default')] if ret != NO_ERROR else None
+        command, _, name = request.strip().partition(' ')
+
+        if command == 'counts':
+            answer = {'time': result['time'], 'exit_code': ret, 'error': error}
+            if result['counts'] is not None:
+                answer.update(result['counts']._asdict())
+                answer['upgradable'] = result['counts'].upgrade + result['counts'].not_upgraded
+            return ret, json.dumps(answer, sort_keys=True)
+
+        if command == 'render':
+            target = names.get(name or 'default')
+            if target is None:
+                return ERROR_CODES['GenerateOutputError'], ' unknown template: %s' % name
+            if result['template_dict'] is None or (error and not target.no_error_output):
+                return ret, error
+            if target.name not in result['rendered']:
+                result['rendered'][target.name] = generate_output(target.template, result['template_dict'])
+            return ret, result['rendered'][target.name]
+
+        return ERROR_CODES['default'], ' unknown request: %s' % request.strip()
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), DEFAULT_QUERY_TIMEOUT)
+            ret, answer = respond(request.decode('utf-8', 'replace'))
+            writer.write(('%d\n%s' % (ret, answer)).encode())
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, GenerateOutputError) as e:
+            log.warning("couldn't answer a query: %s" % e)
+        finally:
+            writer.close()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+
+        def on_signal(signum):
+            log.info("received signal %d, stopping server" % signum)
+            stop.set()
+            kill_running_groups()           # so that a check that's running ends now
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, on_signal, signum)
+
+        async def check(full=True):
+            '''
+            Runs refresh() in a thread, until it's done or we're told to stop.
+            The thread is a daemon one, so that a check that's still running
+            doesn't hold up stopping.
+            '''
+            finished = asyncio.Event()
+
+            def run():
+                try:
+                    refresh(full)
+                finally:
+                    try:
+                        loop.call_soon_threadsafe(finished.set)
+                    except RuntimeError:
+                        pass                        # the server has already stopped
+
+            threading.Thread(target=run, name='check', daemon=True).start()
+            waiters = [asyncio.ensure_future(finished.wait()), asyncio.ensure_future(stop.wait())]
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+            if not finished.is_set():
+                log.warning("stopping with a check still running")
+
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)              # left behind by a server that was killed
+        except FileNotFoundError:
+            pass
+        server = await asyncio.start_unix_server(handle, path=socket_path)
+        os.chmod(socket_path, 0o666)
+        log.info("serving on %s, checking every %d seconds" % (socket_path, interval))
+
+        changed = asyncio.Event()
+        debounce = []
+        watcher = Watcher() if config.watch else None
+        if watcher is not None:
+            def on_event():
+                changed_paths = watcher.read()
+                if changed_paths:
+                    log.debug("package state changed: %s" % ', '.join(sorted(set(changed_paths))))
+                    for timer in debounce:
+                        timer.cancel()
+                    debounce[:] = [loop.call_later(WATCH_DEBOUNCE, changed.set)]
+
+            loop.add_reader(watcher.fileno(), on_event)
+
+        next_run = loop.time()                      # the first check straight away
+        try:
+            while not stop.is_set():
+                waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(changed.wait())]
+                await asyncio.wait(waiters, timeout=max(0, next_run - loop.time()),
+                                    return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+
+                if stop.is_set():
+                    break
+                elif changed.is_set():
+                    changed.clear()
+                    await check(False)
+                else:
+                    await check()
+                    next_run = max(next_run + interval, loop.time())
+                    for timer in debounce:          # the update's own changes to the lists
+                        timer.cancel()
+                    changed.clear()
+        finally:
+            if watcher is not None:
+                loop.remove_reader(watcher.fileno())
+                watcher.close()
+            server.close()
+            await server.wait_closed()
+            os.unlink(socket_path)
+
+    asyncio.run(run())
+    log.info("server stopped")
+    return NO_ERROR
+
+def query(socket_path, request, timeout=DEFAULT_QUERY_TIMEOUT):
+    '''
+    Sends a request to the --serve server and prints its answer (see
+    serve()), which is what a status bar can run instead of reading the
+    output file.
+
+    Deliberately does nothing else (no logging setup, no apt), so that it
+    starts and finishes quickly.
+
+    @param socket_path String path of the server's Unix socket.
+    @param request String the request, e.g: render default.
+    @param timeout Float seconds to wait for the server.
+    @return The exit code the server sent, ERROR_CODES['default'] if it
+        couldn't be asked.
+    @date Oct 17, 2026
+    '''
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall((request + '\n').encode())
+            answer = b''.join(iter(lambda: sock.recv(65536), b''))
+    except (IOError, OSError) as e:
+        print("couldn't query %s: %s" % (socket_path, e), file=sys.stderr)
         return ERROR_CODES['default']
 
+    ret, _, text = answer.decode('utf-8', 'replace').partition('\n')
+    print(text, flush=True)
+    return int(ret) if ret.isdigit() else ERROR_CODES['default']
+
+def profile_call(func, directory, name):
+    '''
+    Calls func() under cProfile, timing every subprocess it starts, and
+    writes out the stats to <name>.pstats and a summary to <name>.profile in
+    directory.
+
+    The subprocesses are timed by swapping subprocess.Popen for a subclass
+    that notes when each child was started and when its wait() returned. This
+    is only done here, so there is no cost at all when not profiling.
+
+    @param func Function to call, without arguments.
+    @param directory String directory to write the files to.
+    @param name String the files' name, without extension.
+    @return What func returned.
+    @date Oct 17, 2026
+    '''
+    import cProfile
+    import io
+    import pstats
+    import subprocess
+
+    children = []
+
+    class TimedPopen(subprocess.Popen):
+        def __init__(self, *args, **kwargs):
+            self.started = time.monotonic()
+            self.timed = False
+            super().__init__(*args, **kwargs)
+
+        def wait(self, timeout=None):
+            ret = super().wait(timeout)
+            if not self.timed:
+                self.timed = True
+                children.append((time.monotonic() - self.started, self.returncode, self.args))
+            return ret
+
+    profiler = cProfile.Profile()
+    original_popen = subprocess.Popen
+    subprocess.Popen = TimedPopen
+    start = time.monotonic()
+    try:
+        return profiler.runcall(func)
+    finally:
+        wall_time = time.monotonic() - start
+        subprocess.Popen = original_popen
+
+        base = os.path.join(directory, name)
+        profiler.dump_stats(base + '.pstats')
+
+        summary = io.StringIO()
+        summary.write('wall time: %.3f seconds\n' % wall_time)
+        summary.write('subprocesses: %d, %.3f seconds\n' % (len(children), sum(child[0] for child in children)))
+        for seconds, ret_code, args in children:
+            command = args if isinstance(args, str) else ' '.join(args)
+            summary.write('  %8.3f s  exit %-4s %s\n' % (seconds, ret_code, command))
+        summary.write('\n')
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+        try:
+            with open(base + '.profile', 'w') as f:
+                f.write(summary.getvalue())
+            log.info("wrote profile to %s.pstats and %s.profile" % (base, base))
+        except (IOError, OSError) as e:
+            log.warning("couldn't write the profile summary %s.profile: %s" % (base, e))
+
+def run_main(config, filename=None):
+    '''
+    Loads the targets' templates once and then either runs a single check or
+    hands off to the daemon loop or the server.
+
+    @param config Config the settings.
+    @param filename String the output file argument, see compute_out_file().
+        None if only --targets were given.
+    @return The exit code (see ERROR_CODES).
+    @date Oct 17, 2026
+    '''
+    if config.serve:
+        filename = '-'                      # the default template is still served
+
+    try:
+        targets = load_targets(config, filename)
+    except GenerateOutputError as e:
+        return ERROR_CODES[e.key]
+
+    if config.serve:
+        return serve(config, targets, compute_base_file(config.base_dir, config.serve), config.interval)
+    elif config.daemon:
+        return run_daemon(config, targets, config.interval)
+    else:
+        ret = run_checks(config, targets)
+        log.info('exit: %s' % time.asctime())
+        return ret
+
+def main(argv=None):
+    '''
+    Main function.
+
+    Parses the arguments, sets up logging and then does the run (see
+    run_main()), under the profiler if asked to.
+
+    @param argv List of Strings, the command line arguments. None means
+        sys.argv.
+    @return The exit code. The meaning of the exit code is store above near the
+    top of the file in the ERROR_CODES dictionary.
+
+    @date Feb 11, 2011
+    @author Matthew Todd
+    '''
+    config, args = program_options(argv)
+
+    if config.query:
+        request = 'counts' if config.query_counts else 'render %s' % (args[0] if args else 'default')
+        return query(compute_base_file(config.base_dir, config.query), request)
+
+    log_dir = compute_log_dir(config.log_dir, config.base_dir)
+    listener = setupLogging(log_dir, config.log_file, config.log_level,
+                            config.log_max_bytes, config.log_backups, config.log_format)
+    try:
+        log.info("config = %r, args = %r" % (config, args))           # never know when we might need this info
+
+        filename = args[0] if args else None
+        if config.profile:
+            return profile_call(lambda: run_main(config, filename), log_dir, os.path.splitext(config.log_file)[0])
+        return run_main(config, filename)
+    finally:
+        listener.stop()
+
 if __name__ == "__main__":
     sys.exit(main())